@@ -16,17 +16,22 @@
 from fastapi import FastAPI
 from fastapi_health import health
 
-from app.resources.health_check import atlas_check
-from app.resources.health_check import es_check
+from app.resources.health_check import dependencies_healthy
+from app.resources.health_check import health_report
 from app.routers import api_root
 from app.routers.v1 import api_audit_log
 from app.routers.v1 import api_file_meta
+from app.routers.v1 import api_metrics
 from app.routers.v1.api_lineage import lineage
 
 
 def api_registry(app: FastAPI):
-    app.add_api_route('/v1/health', health([atlas_check, es_check], success_status=204), tags=['Health'])
+    readiness = health([dependencies_healthy], success_status=204, failure_handler=health_report)
+    app.add_api_route('/v1/health', readiness, tags=['Health'])
+    app.add_api_route('/v1/health/ready', readiness, tags=['Health'])
+    app.add_api_route('/v1/health/live', health([], success_status=204), tags=['Health'])
     app.include_router(api_root.router)
     app.include_router(api_audit_log.router, prefix='/v1')
     app.include_router(lineage.router, prefix='/v1/lineage', tags=['lineage'])
     app.include_router(api_file_meta.router, prefix='/v1')
+    app.include_router(api_metrics.router, prefix='/v1')
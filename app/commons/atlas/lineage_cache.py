@@ -0,0 +1,188 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import Optional
+from typing import Set
+
+import aioredis
+from common import LoggerFactory
+
+from app.config import ConfigClass
+from app.resources.metrics import metrics
+from app.resources.ttl_cache import MISSING
+from app.resources.ttl_cache import TTLCache
+
+
+def lineage_entity_ids(lineage: dict) -> Set[str]:
+    """Global entity ids of the file entities in a lineage response of Atlas."""
+    entity_ids = set()
+    for entity in lineage.get('guidEntityMap', {}).values():
+        global_entity_id = entity.get('attributes', {}).get('global_entity_id')
+        if global_entity_id:
+            entity_ids.add(global_entity_id)
+    return entity_ids
+
+
+class LineageCache:
+    """TTL cache of enriched lineage responses, which also remembers the entities in every cached graph.
+
+    A new Process between two entities changes the graph of everything connected to them, so invalidate drops every
+    cached graph containing one of the given entities. A disabled cache stores and returns nothing.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, enabled: bool = True):
+        self.enabled = enabled
+        self._cache = TTLCache(maxsize, ttl)
+        self._entity_ids: Dict[Hashable, Set[str]] = {}
+        self._keys_by_entity_id: Dict[str, Set[Hashable]] = {}
+
+    def get(self, item_id: str, direction: str, depth: int) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        lineage = self._cache.get((item_id, direction, depth))
+        return None if lineage is MISSING else lineage
+
+    def set(self, item_id: str, direction: str, depth: int, lineage: dict) -> None:
+        if not self.enabled:
+            return
+        key = (item_id, direction, depth)
+        self._forget(key)
+        self._cache.set(key, lineage)
+        if key not in self._cache:
+            return
+
+        entity_ids = lineage_entity_ids(lineage) | {item_id}
+        self._entity_ids[key] = entity_ids
+        for entity_id in entity_ids:
+            self._keys_by_entity_id.setdefault(entity_id, set()).add(key)
+
+        # expired and evicted graphs are only dropped from the index from time to time
+        if len(self._entity_ids) > 2 * self._cache.maxsize:
+            for stale_key in [cached_key for cached_key in self._entity_ids if cached_key not in self._cache]:
+                self._forget(stale_key)
+
+    def invalidate(self, entity_ids: Iterable[str]) -> int:
+        """Drop every cached graph containing one of entity_ids and return how many were dropped."""
+        keys = set()
+        for entity_id in entity_ids:
+            keys |= self._keys_by_entity_id.get(entity_id, set())
+        for key in keys:
+            self._cache.invalidate(key)
+            self._forget(key)
+        return len(keys)
+
+    def _forget(self, key: Hashable) -> None:
+        for entity_id in self._entity_ids.pop(key, ()):
+            keys = self._keys_by_entity_id[entity_id]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_entity_id[entity_id]
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._entity_ids.clear()
+        self._keys_by_entity_id.clear()
+
+    def info(self) -> dict:
+        return self._cache.info()
+
+
+class LineageCacheSync:
+    """Share invalidations of a LineageCache between every worker and instance of the service through redis pub/sub.
+
+    invalidate drops the graphs locally and publishes the entity ids on `channel`; every subscribed worker drops them
+    too. Without a redis url invalidations only reach the worker that made them, so the cache should only be enabled
+    with a single worker. While not subscribed, e.g. at startup or after losing the redis connection, invalidations
+    may be missed, so the cache is cleared and disabled until the subscription is back.
+    """
+
+    def __init__(self, cache: LineageCache, redis_url: Optional[str], channel: str, retry_interval: float = 5.0):
+        self._logger = LoggerFactory('lineage_cache').get_logger()
+        self.cache = cache
+        self.redis_url = redis_url
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self._redis = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.cache.enabled or self.running:
+            return
+        if not self.redis_url:
+            self._logger.warning('Lineage cache invalidations only reach this worker, no redis url is configured')
+            return
+        self.cache.enabled = False
+        self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        task = self._task
+        self._task = None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await self._redis.close()
+        self.cache.enabled = True
+
+    async def invalidate(self, entity_ids: Iterable[str]) -> None:
+        entity_ids = sorted(set(entity_ids))
+        self.cache.invalidate(entity_ids)
+        if not self.running or not entity_ids:
+            return
+        try:
+            await self._redis.publish(self.channel, json.dumps(entity_ids))
+        except Exception as e:
+            self._logger.error(f'Failed to publish the invalidation of lineage graphs of {entity_ids}: {e}')
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.cache.clear()
+                self.cache.enabled = True
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.cache.invalidate(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.warning(f'Lost the lineage cache invalidation channel, retrying: {e}')
+            finally:
+                self.cache.enabled = False
+                await pubsub.close()
+            await asyncio.sleep(self.retry_interval)
+
+
+lineage_cache = LineageCache(
+    ConfigClass.LINEAGE_CACHE_SIZE, ConfigClass.LINEAGE_CACHE_TTL, enabled=ConfigClass.LINEAGE_CACHE_ENABLED
+)
+lineage_cache_sync = LineageCacheSync(
+    lineage_cache, ConfigClass.LINEAGE_CACHE_REDIS_URL, ConfigClass.LINEAGE_CACHE_REDIS_CHANNEL
+)
+metrics.register_cache('lineage', lineage_cache.info)
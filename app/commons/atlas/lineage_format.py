@@ -0,0 +1,85 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+NODE_FIELDS = ['guid', 'global_entity_id', 'name', 'typeName', 'zone', 'display_path']
+
+
+class StringTable:
+    """Interned strings of a compact response, referenced by their index."""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._indexes: Dict[str, int] = {}
+
+    def intern(self, value: Optional[str]) -> Optional[int]:
+        if value is None:
+            return None
+        index = self._indexes.get(value)
+        if index is None:
+            index = self._indexes[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+
+def compact_lineage(base_entity_guid: str, guid_entity_map: dict, edges: Iterable[Tuple[str, str]]) -> dict:
+    """Render lineage entities and edges in the compact format.
+
+    Every string is stored once in `strings`. Nodes are lists laid out as NODE_FIELDS, holding string indexes and a
+    list of indexes for zone. Edges are [from, to] pairs of node indexes, and base_entity is the node index of the
+    entity the lineage was asked for.
+    """
+    table = StringTable()
+    nodes = []
+    node_indexes = {}
+    for guid, entity in guid_entity_map.items():
+        attributes = entity.get('attributes', {})
+        zone = attributes.get('zone')
+        node_indexes[guid] = len(nodes)
+        nodes.append(
+            [
+                table.intern(guid),
+                table.intern(attributes.get('global_entity_id')),
+                table.intern(attributes.get('name') or entity.get('displayText')),
+                table.intern(entity.get('typeName')),
+                [table.intern(label) for label in zone] if zone else None,
+                table.intern(attributes.get('display_path')),
+            ]
+        )
+
+    compact_edges = []
+    for from_guid, to_guid in edges:
+        if from_guid in node_indexes and to_guid in node_indexes:
+            compact_edges.append([node_indexes[from_guid], node_indexes[to_guid]])
+
+    return {
+        'format': 'compact',
+        'strings': table.strings,
+        'node_fields': NODE_FIELDS,
+        'nodes': nodes,
+        'edges': compact_edges,
+        'base_entity': node_indexes.get(base_entity_guid),
+    }
+
+
+def compact_atlas_lineage(lineage: dict) -> dict:
+    """Render a lineage response of Atlas, with its guidEntityMap and relations, in the compact format."""
+    edges = [(relation['fromEntityId'], relation['toEntityId']) for relation in lineage.get('relations', [])]
+    return compact_lineage(lineage.get('baseEntityGuid'), lineage.get('guidEntityMap') or {}, edges)
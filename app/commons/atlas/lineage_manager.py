@@ -13,15 +13,40 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 from time import time
 
-import httpx
 from common import LoggerFactory
 
 from app.config import ConfigClass
 from app.models.data_models import EDataType
 from app.models.meta_class import MetaService
 from app.models.models_lineage import CreationForm
+from app.resources.http_client import atlas_client
+from app.resources.metrics import metrics
+from app.resources.ttl_cache import MISSING
+from app.resources.ttl_cache import TTLCache
+
+# (global_entity_id, type name) -> Atlas GUID; an entity keeps its GUID once it is created in Atlas
+guid_cache = TTLCache(
+    ConfigClass.ATLAS_GUID_CACHE_SIZE, ConfigClass.ATLAS_GUID_CACHE_TTL, ConfigClass.ATLAS_GUID_CACHE_NEGATIVE_TTL
+)
+metrics.register_cache('atlas_guid', guid_cache.info)
+_NOT_FOUND = object()
+
+
+class EntityNotFound(Exception):
+    def __init__(self, _id, status_code):
+        super().__init__(f'Not Found Entity: {_id}')
+        self.status_code = status_code
+
+
+def invalidate_guid_cache(global_entity_id=None):
+    """Forget the cached GUIDs of an entity, e.g. after it was deleted from Atlas, or every GUID when no id is given."""
+    if global_entity_id is None:
+        guid_cache.clear()
+    else:
+        guid_cache.invalidate_matching(lambda key: key[0] == global_entity_id)
 
 
 class SrvLineageMgr(metaclass=MetaService):
@@ -30,18 +55,19 @@ class SrvLineageMgr(metaclass=MetaService):
     def __init__(self):
         self.ATLAS_API = f'http://{ConfigClass.ATLAS_HOST}:{ConfigClass.ATLAS_PORT}/'
         self.lineage_endpoint = 'api/atlas/v2/lineage/uniqueAttribute/type'
+        self.lineage_by_guid_endpoint = 'api/atlas/v2/lineage'
         self.entity_bulk_endpoint = 'api/atlas/v2/entity/bulk'
         self.search_endpoint = 'api/atlas/v2/search/attribute'
 
-    async def create(self, creation_form: CreationForm, version='v1'):
-        """create lineage in Atlas."""
+    def typenames(self, version):
         # v2 uses new entity type, v1 uses old one
-        typenames = (
+        return (
             (EDataType.nfs_file.name, EDataType.nfs_file_processed.name)
             if version == 'v1'
             else ['file_data', 'file_data']
         )
-        self._logger.info(f'_________typenames is: {typenames}')
+
+    def build_process_entity(self, creation_form: CreationForm, input_guid, output_guid, typenames, version):
         # to atlas post form
         input_file_name = creation_form.input_name
         output_file_name = creation_form.output_name
@@ -56,46 +82,141 @@ class SrvLineageMgr(metaclass=MetaService):
             input_file_name,
             output_file_name,
         )
-        input_guid = await self.get_guid_by_id(creation_form.input_id, typenames[0])
-        output_guid = await self.get_guid_by_id(creation_form.output_id, typenames[1])
+        return {
+            'typeName': 'Process',
+            'attributes': {
+                'createTime': current_timestamp,
+                'updateTime': current_timestamp,
+                'qualifiedName': qualifiedName if version == 'v1' else qualifiedName + ':v2',
+                'name': qualifiedName if version == 'v1' else qualifiedName + ':v2',
+                'description': creation_form.description,
+                'inputs': [{'guid': input_guid, 'typeName': typenames[0]}],
+                'outputs': [{'guid': output_guid, 'typeName': typenames[1]}],
+            },
+        }
+
+    async def post_entities(self, entities):
+        headers = {'content-type': 'application/json'}
+        res = await atlas_client.get().post(
+            url=self.ATLAS_API + self.entity_bulk_endpoint,
+            json={'entities': entities},
+            headers=headers,
+            timeout=300,
+        )
+        return res
+
+    async def create(self, creation_form: CreationForm, version='v1'):
+        """create lineage in Atlas."""
+        typenames = self.typenames(version)
+        self._logger.info(f'_________typenames is: {typenames}')
+        input_guid, output_guid = await self.get_guids_by_ids(
+            [(creation_form.input_id, typenames[0]), (creation_form.output_id, typenames[1])]
+        )
         atlas_post_form_json = {
-            'entities': [
-                {
-                    'typeName': 'Process',
-                    'attributes': {
-                        'createTime': current_timestamp,
-                        'updateTime': current_timestamp,
-                        'qualifiedName': qualifiedName if version == 'v1' else qualifiedName + ':v2',
-                        'name': qualifiedName if version == 'v1' else qualifiedName + ':v2',
-                        'description': creation_form.description,
-                        'inputs': [{'guid': input_guid, 'typeName': typenames[0]}],
-                        'outputs': [{'guid': output_guid, 'typeName': typenames[1]}],
-                    },
-                }
-            ]
+            'entities': [self.build_process_entity(creation_form, input_guid, output_guid, typenames, version)]
         }
         self._logger.debug(f'[SrvLineageMgr]atlas_post_form_json: {atlas_post_form_json}')
         # create atlas lineage
-        headers = {'content-type': 'application/json'}
-        async with httpx.AsyncClient(verify=False) as client:
-            res = await client.post(
-                url=self.ATLAS_API + self.entity_bulk_endpoint,
-                json=atlas_post_form_json,
-                auth=(ConfigClass.ATLAS_ADMIN, ConfigClass.ATLAS_PASSWD),
-                headers=headers,
-                timeout=300,
-            )
+        res = await self.post_entities(atlas_post_form_json['entities'])
+        if res.status_code >= 300:
+            self._forget_guids([(creation_form.input_id, creation_form.output_id)])
         return res
 
+    async def create_many(self, creation_forms, version='v1'):
+        """Create a Process for every creation form and return one result per form, in order.
+
+        Every distinct input and output is looked up once, with at most ATLAS_MAX_CONCURRENCY lookups in flight, and
+        the Process entities are posted in chunks of LINEAGE_BATCH_CHUNK_SIZE. Each result has the status of its edge:
+        404 when the input or output is not in Atlas, otherwise the status of the bulk request of its chunk, or 500
+        when that request failed without a response.
+        """
+        typenames = self.typenames(version)
+        lookups = {}
+        for creation_form in creation_forms:
+            lookups[(creation_form.input_id, typenames[0])] = None
+            lookups[(creation_form.output_id, typenames[1])] = None
+
+        semaphore = asyncio.Semaphore(ConfigClass.ATLAS_MAX_CONCURRENCY)
+
+        async def lookup(_id, type_name):
+            async with semaphore:
+                return await self.get_guid_by_id(_id, type_name)
+
+        guids = await asyncio.gather(*(lookup(*key) for key in lookups), return_exceptions=True)
+        lookups = dict(zip(lookups, guids))
+
+        results = []
+        pending = []
+        for index, creation_form in enumerate(creation_forms):
+            result = {'input_id': creation_form.input_id, 'output_id': creation_form.output_id, 'guid': None}
+            results.append(result)
+            input_guid = lookups[(creation_form.input_id, typenames[0])]
+            output_guid = lookups[(creation_form.output_id, typenames[1])]
+            error = self._lookup_error(creation_form.input_id, input_guid) or self._lookup_error(
+                creation_form.output_id, output_guid
+            )
+            if error:
+                result['status'] = 404 if isinstance(error, EntityNotFound) else 500
+                result['error'] = str(error)
+                continue
+
+            entity = self.build_process_entity(creation_form, input_guid, output_guid, typenames, version)
+            # negative guids let atlas report the guid it assigned to each new entity
+            entity['guid'] = str(-(index + 1))
+            pending.append((result, entity))
+
+        size = ConfigClass.LINEAGE_BATCH_CHUNK_SIZE
+        for start in range(0, len(pending), size):
+            end = start + size
+            await self._create_chunk(pending[start:end])
+
+        return results
+
+    def _lookup_error(self, _id, guid):
+        if isinstance(guid, Exception):
+            return guid
+        if not guid:
+            return EntityNotFound(_id, 200)
+        return None
+
+    async def _create_chunk(self, pending):
+        try:
+            res = await self.post_entities([entity for _, entity in pending])
+            guid_assignments = res.json().get('guidAssignments', {}) if res.status_code < 300 else {}
+        except Exception as e:
+            # a timeout or unreadable response fails only this chunk; atlas may still have created some of it
+            self._logger.exception(f'Error when creating {len(pending)} lineages in bulk')
+            for result, _ in pending:
+                result['status'] = 500
+                result['error'] = repr(e)
+            return
+
+        if res.status_code >= 300:
+            self._logger.error(f'Error when creating lineage in bulk: {res.text}')
+            self._forget_guids([(result['input_id'], result['output_id']) for result, _ in pending])
+        for result, entity in pending:
+            result['status'] = res.status_code
+            result['guid'] = guid_assignments.get(entity['guid'])
+            result['error'] = res.text if res.status_code >= 300 else None
+
+    def _forget_guids(self, edges):
+        # atlas rejects a Process whose input or output was deleted, so their cached guids may be stale
+        for input_id, output_id in edges:
+            invalidate_guid_cache(input_id)
+            invalidate_guid_cache(output_id)
+
     async def get(self, _id, type_name, direction, depth=50):
         url = self.ATLAS_API + self.lineage_endpoint + '/{}'.format(type_name)
         self._logger.debug(f'Url is: {url}')
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(
-                url,
-                params={'attr:global_entity_id': _id, 'depth': depth, 'direction': direction},
-                auth=(ConfigClass.ATLAS_ADMIN, ConfigClass.ATLAS_PASSWD),
-            )
+        response = await atlas_client.get().get(
+            url, params={'attr:global_entity_id': _id, 'depth': depth, 'direction': direction}
+        )
+        return response
+
+    async def get_by_guid(self, guid, direction, depth=1):
+        url = self.ATLAS_API + self.lineage_by_guid_endpoint + '/{}'.format(guid)
+        self._logger.debug(f'Url is: {url}')
+        response = await atlas_client.get().get(url, params={'direction': direction, 'depth': depth})
         return response
 
     async def search_entity(self, _id, type_name=None):
@@ -103,23 +224,47 @@ class SrvLineageMgr(metaclass=MetaService):
         self._logger.debug(f'LIne 97 Url is: {url}')
         typeName = type_name if type_name else 'nfs_file_processed'
         params = {'attrName': 'global_entity_id', 'typeName': typeName, 'attrValuePrefix': _id}
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(
-                url, timeout=100, params=params, auth=(ConfigClass.ATLAS_ADMIN, ConfigClass.ATLAS_PASSWD)
-            )
+        response = await atlas_client.get().get(url, params=params)
         if response.status_code == 200 and response.json().get('entities'):
             return response
         else:
-            raise Exception(f'Not Found Entity: {_id}')
+            raise EntityNotFound(_id, response.status_code)
 
     async def get_guid_by_id(self, _id, type_name=None):
-        search_res = await self.search_entity(_id, type_name)
+        key = (_id, type_name)
+        guid = guid_cache.get(key)
+        if guid is _NOT_FOUND:
+            raise EntityNotFound(_id, 200)
+        if guid is not MISSING:
+            return guid
+
+        try:
+            search_res = await self.search_entity(_id, type_name)
+        except EntityNotFound as e:
+            # only an empty search result is cached, errors of atlas are not
+            if e.status_code == 200:
+                guid_cache.set_negative(key, _NOT_FOUND)
+            raise
         if search_res.status_code == 200:
             my_json = search_res.json()
             self._logger.debug(f'[SrvLineageMgr]search_res: {my_json}')
             entities = my_json['entities']
             found = [entity for entity in entities if entity['attributes']['global_entity_id'] == _id]
-            return found[0]['guid'] if found else None
+            if not found:
+                guid_cache.set_negative(key)
+                return None
+            guid_cache.set(key, found[0]['guid'])
+            return found[0]['guid']
         else:
             self._logger.error(f'Error when get_guid_by_id: {search_res.text}')
             return None
+
+    async def get_guids_by_ids(self, ids):
+        """Resolve (id, type_name) pairs concurrently; raises the first lookup error once every lookup has finished."""
+        guids = await asyncio.gather(
+            *(self.get_guid_by_id(_id, type_name) for _id, type_name in ids), return_exceptions=True
+        )
+        for guid in guids:
+            if isinstance(guid, Exception):
+                raise guid
+        return guids
@@ -0,0 +1,119 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from typing import Dict
+from typing import List
+from typing import Set
+from typing import Tuple
+
+from common import LoggerFactory
+
+from app.commons.atlas.lineage_format import compact_lineage
+from app.config import ConfigClass
+
+_logger = LoggerFactory('api_lineage_action').get_logger()
+
+
+class LineageGraph:
+    """Deduplicated nodes and edges of a lineage traversal, holding at most max_nodes nodes."""
+
+    def __init__(self, base_entity: dict, max_nodes: int):
+        self.base_entity_guid = base_entity['guid']
+        self.max_nodes = max_nodes
+        self.entities: Dict[str, dict] = {base_entity['guid']: base_entity}
+        self.edges: Set[Tuple[str, str]] = set()
+        self.truncated = False
+        self.depth = 0
+
+    def merge(self, lineage: dict) -> List[str]:
+        """Add the entities and relations of an Atlas lineage response; returns the guids of its files in the graph."""
+        files = []
+        for guid, entity in lineage.get('guidEntityMap', {}).items():
+            if guid not in self.entities:
+                if len(self.entities) >= self.max_nodes:
+                    self.truncated = True
+                    continue
+                self.entities[guid] = entity
+            if entity.get('typeName') != 'Process':
+                files.append(guid)
+
+        for relation in lineage.get('relations', []):
+            edge = (relation['fromEntityId'], relation['toEntityId'])
+            if edge[0] in self.entities and edge[1] in self.entities:
+                self.edges.add(edge)
+
+        return files
+
+    def to_compact(self) -> dict:
+        return compact_lineage(self.base_entity_guid, self.entities, sorted(self.edges))
+
+    def to_dict(self) -> dict:
+        nodes = []
+        for guid, entity in self.entities.items():
+            attributes = entity.get('attributes', {})
+            nodes.append(
+                {
+                    'guid': guid,
+                    'global_entity_id': attributes.get('global_entity_id'),
+                    'name': attributes.get('name') or entity.get('displayText'),
+                    'typeName': entity.get('typeName'),
+                    'zone': attributes.get('zone'),
+                    'display_path': attributes.get('display_path'),
+                }
+            )
+        return {
+            'base_entity_guid': self.base_entity_guid,
+            'nodes': nodes,
+            'edges': [list(edge) for edge in sorted(self.edges)],
+            'depth': self.depth,
+            'truncated': self.truncated,
+        }
+
+
+async def traverse_lineage(lineage_mgr, base_entity: dict, direction: str, depth: int, max_nodes: int) -> LineageGraph:
+    """Walk the lineage of an Atlas entity one Process hop at a time, up to depth hops and max_nodes nodes.
+
+    Every level asks Atlas for the direct lineage (depth=1) of the files reached by the previous level, with at most
+    ATLAS_MAX_CONCURRENCY requests in flight. BOTH walks upstream and downstream separately. The walk stops early once
+    the node budget is spent.
+    """
+    graph = LineageGraph(base_entity, max_nodes)
+    directions = ['INPUT', 'OUTPUT'] if direction == 'BOTH' else [direction]
+    frontier = [(graph.base_entity_guid, walk_direction) for walk_direction in directions]
+    expanded = set(frontier)
+    semaphore = asyncio.Semaphore(ConfigClass.ATLAS_MAX_CONCURRENCY)
+
+    async def fetch(guid, walk_direction):
+        async with semaphore:
+            response = await lineage_mgr.get_by_guid(guid, walk_direction, depth=1)
+        if response.status_code != 200:
+            raise Exception(f'Error getting lineage of {guid} from atlas: {response.text}')
+        return response.json()
+
+    while frontier and graph.depth < depth and not graph.truncated:
+        responses = await asyncio.gather(*(fetch(guid, walk_direction) for guid, walk_direction in frontier))
+        graph.depth += 1
+
+        next_frontier = []
+        for (_, walk_direction), lineage in zip(frontier, responses):
+            for guid in graph.merge(lineage):
+                if (guid, walk_direction) not in expanded:
+                    expanded.add((guid, walk_direction))
+                    next_frontier.append((guid, walk_direction))
+        _logger.debug(f'Lineage level {graph.depth} of {graph.base_entity_guid}: {len(next_frontier)} to expand')
+        frontier = next_frontier
+
+    return graph
@@ -0,0 +1,82 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from common import LoggerFactory
+
+from app.config import ConfigClass
+from app.models.meta_class import MetaService
+from app.resources.http_client import metadata_client
+
+
+class SrvItemMgr(metaclass=MetaService):
+    _logger = LoggerFactory('api_lineage_action').get_logger()
+
+    async def get_items(self, item_ids) -> dict:
+        """Get items of the metadata service by id, looking up every id once.
+
+        Ids are sent in batches of METADATA_BATCH_SIZE to the batch lookup when METADATA_BATCH_LOOKUP_ENABLED is set,
+        otherwise fetched one by one with at most METADATA_MAX_CONCURRENCY requests in flight. Ids without an item are
+        left out of the result.
+        """
+        item_ids = list(dict.fromkeys(item_ids))
+        if not item_ids:
+            return {}
+
+        if ConfigClass.METADATA_BATCH_LOOKUP_ENABLED:
+            return await self._get_items_in_batches(item_ids)
+        return await self._get_items_one_by_one(item_ids)
+
+    async def _get_items_in_batches(self, item_ids) -> dict:
+        url = f'{ConfigClass.METADATA_SERVICE}items/batch/'
+        size = ConfigClass.METADATA_BATCH_SIZE
+        batches = []
+        for start in range(0, len(item_ids), size):
+            end = start + size
+            batches.append(item_ids[start:end])
+
+        async def get_batch(batch):
+            response = await metadata_client.get().get(url, params={'ids': batch})
+            if response.status_code != 200:
+                raise Exception('Error calling metadata service')
+            return response.json()['result']
+
+        items = {}
+        for result in await self._gather(get_batch(batch) for batch in batches):
+            for item in result:
+                items[item['id']] = item
+        return items
+
+    async def _get_items_one_by_one(self, item_ids) -> dict:
+        semaphore = asyncio.Semaphore(ConfigClass.METADATA_MAX_CONCURRENCY)
+
+        async def get_item(item_id):
+            async with semaphore:
+                response = await metadata_client.get().get(f'{ConfigClass.METADATA_SERVICE}item/{item_id}/')
+            if response.status_code != 200:
+                raise Exception('Error calling metadata service')
+            return item_id, response.json()['result']
+
+        results = await self._gather(get_item(item_id) for item_id in item_ids)
+        return {item_id: item for item_id, item in results if item}
+
+    async def _gather(self, coroutines) -> list:
+        """Run coroutines concurrently; raises the first error once all of them have finished."""
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
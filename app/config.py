@@ -16,6 +16,7 @@
 import os
 from typing import Any
 from typing import Dict
+from typing import Optional
 
 from common import VaultClient
 from dotenv import load_dotenv
@@ -51,6 +52,75 @@ class Settings(BaseSettings):
     ELASTIC_SEARCH_PORT: int
     METADATA_SERVICE: str
 
+    ELASTIC_SEARCH_MAX_CONNECTIONS: int = 100
+    ELASTIC_SEARCH_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    ELASTIC_SEARCH_KEEPALIVE_EXPIRY: float = 5.0
+    ELASTIC_SEARCH_TIMEOUT: float = 10.0
+    ELASTIC_SEARCH_CONNECT_TIMEOUT: float = 5.0
+    ELASTIC_SEARCH_PIT_KEEP_ALIVE: str = '5m'
+    ELASTIC_SEARCH_BULK_MAX_BYTES: int = 5 * 1024 * 1024
+    ELASTIC_SEARCH_SLOW_QUERY_THRESHOLD_MS: float = 1000.0
+
+    ATLAS_MAX_CONNECTIONS: int = 50
+    ATLAS_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    ATLAS_KEEPALIVE_EXPIRY: float = 5.0
+    ATLAS_TIMEOUT: float = 100.0
+    ATLAS_CONNECT_TIMEOUT: float = 5.0
+    ATLAS_MAX_CONCURRENCY: int = 10
+    ATLAS_GUID_CACHE_SIZE: int = 10000
+    ATLAS_GUID_CACHE_TTL: float = 3600.0
+    ATLAS_GUID_CACHE_NEGATIVE_TTL: float = 0.0
+
+    METADATA_MAX_CONNECTIONS: int = 50
+    METADATA_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    METADATA_KEEPALIVE_EXPIRY: float = 5.0
+    METADATA_TIMEOUT: float = 5.0
+    METADATA_MAX_CONCURRENCY: int = 10
+    METADATA_BATCH_LOOKUP_ENABLED: bool = False
+    METADATA_BATCH_SIZE: int = 100
+
+    LINEAGE_CACHE_ENABLED: bool = False
+    LINEAGE_CACHE_SIZE: int = 1000
+    LINEAGE_CACHE_TTL: float = 30.0
+    LINEAGE_CACHE_REDIS_URL: Optional[str] = None
+    LINEAGE_CACHE_REDIS_CHANNEL: str = 'audit_trail:lineage_cache:invalidate'
+    LINEAGE_BATCH_MAX_SIZE: int = 1000
+    LINEAGE_BATCH_CHUNK_SIZE: int = 100
+    LINEAGE_GRAPH_MAX_DEPTH: int = 50
+    LINEAGE_GRAPH_MAX_NODES: int = 5000
+
+    HEALTH_CHECK_INTERVAL: float = 10.0
+    HEALTH_CHECK_TIMEOUT: float = 3.0
+    HEALTH_CHECK_MAX_AGE: float = 30.0
+
+    METRICS_MULTIPROC_DIR: Optional[str] = None
+    METRICS_WRITE_INTERVAL: float = 1.0
+    SERVER_TIMING_ENABLED: bool = False
+
+    FILE_QUERY_CACHE_SIZE: int = 256
+    FILE_QUERY_PLANNING_ENABLED: bool = True
+    FILE_QUERY_NGRAM_REWRITE_ENABLED: bool = False
+    FILE_META_BATCH_MAX_SIZE: int = 50000
+    FILE_META_UPDATE_RETRY_ON_CONFLICT: int = 3
+
+    AUDIT_LOG_BATCH_MAX_SIZE: int = 1000
+    AUDIT_LOG_EXPORT_BATCH_SIZE: int = 1000
+    AUDIT_LOG_STATS_MAX_BUCKET_SIZE: int = 1000
+    GEID_POOL_BLOCK_SIZE: int = 1000
+    GEID_POOL_LOW_WATER_MARK: int = 200
+    AUDIT_LOG_WRITE_BEHIND_ENABLED: bool = False
+    AUDIT_LOG_QUEUE_MAX_SIZE: int = 10000
+    AUDIT_LOG_FLUSH_SIZE: int = 500
+    AUDIT_LOG_FLUSH_INTERVAL: float = 0.2
+    AUDIT_LOG_FLUSH_MAX_RETRIES: int = 3
+    AUDIT_LOG_FLUSH_RETRY_BACKOFF: float = 0.5
+    AUDIT_LOG_SPOOL_ENABLED: bool = False
+    AUDIT_LOG_SPOOL_DIR: str = '/tmp/audit_log_spool'
+    AUDIT_LOG_SPOOL_SEGMENT_MAX_BYTES: int = 4 * 1024 * 1024
+    AUDIT_LOG_SPOOL_FSYNC_INTERVAL: float = 0.005
+    AUDIT_LOG_SPOOL_REPLAY_INTERVAL: float = 1.0
+    AUDIT_LOG_SPOOL_REPLAY_BATCH_SIZE: int = 500
+
     OPEN_TELEMETRY_ENABLED: bool = False
     OPEN_TELEMETRY_HOST: str = '127.0.0.1'
     OPEN_TELEMETRY_PORT: int = 6831
@@ -26,8 +26,19 @@ from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
 from app.api_registry import api_registry
+from app.commons.atlas.lineage_cache import lineage_cache_sync
 from app.config import SRV_NAMESPACE
 from app.config import ConfigClass
+from app.models.base_models import FastJSONResponse
+from app.resources.audit_log_spool import audit_log_spool
+from app.resources.audit_log_writer import audit_log_writer
+from app.resources.geid_pool import geid_pool
+from app.resources.health_check import health_monitor
+from app.resources.http_client import close_http_clients
+from app.resources.http_client import open_http_clients
+from app.resources.metrics import MetricsMiddleware
+from app.resources.metrics import metrics
+from app.resources.server_timing import ServerTimingMiddleware
 
 
 def create_app():
@@ -38,6 +49,7 @@ def create_app():
         description='Service for managing audit logs.',
         docs_url='/v1/api-doc',
         version=ConfigClass.version,
+        default_response_class=FastJSONResponse,
     )
 
     app.add_middleware(
@@ -47,6 +59,30 @@ def create_app():
         allow_methods=['*'],
         allow_headers=['*'],
     )
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(ServerTimingMiddleware)
+
+    @app.on_event('startup')
+    async def startup() -> None:
+        await open_http_clients()
+        geid_pool.start()
+        health_monitor.start()
+        metrics.start()
+        lineage_cache_sync.start()
+        if ConfigClass.AUDIT_LOG_SPOOL_ENABLED:
+            audit_log_spool.start()
+        elif ConfigClass.AUDIT_LOG_WRITE_BEHIND_ENABLED:
+            audit_log_writer.start()
+
+    @app.on_event('shutdown')
+    async def shutdown() -> None:
+        await audit_log_writer.stop()
+        await audit_log_spool.stop()
+        await geid_pool.stop()
+        await health_monitor.stop()
+        await metrics.stop()
+        await lineage_cache_sync.stop()
+        await close_http_clients()
 
     # API registry
     # v1
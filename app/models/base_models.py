@@ -13,20 +13,53 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from enum import Enum
+from typing import Any
+from typing import Optional
 
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:  # a dependency of the service, only missing from a partial install
+    orjson = None
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, falling back to the standard library encoder for values orjson rejects."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(content, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+            except orjson.JSONEncodeError:
+                # e.g. integers over 64 bits, which the standard library encoder handles
+                pass
+        return json.dumps(
+            content, default=_json_default, ensure_ascii=False, allow_nan=False, separators=(',', ':')
+        ).encode('utf-8')
+
 
 class EAPIResponseCode(Enum):
     success = 200
+    accepted = 202
     internal_error = 500
     bad_request = 400
     not_found = 404
     forbidden = 403
     unauthorized = 401
     conflict = 409
+    service_unavailable = 503
 
 
 class APIResponse(BaseModel):
@@ -38,9 +71,14 @@ class APIResponse(BaseModel):
     result = []
 
     def json_response(self):
-        data = self.dict()
+        # results are plain JSON from elastic search or atlas, so skip the deep copy .dict() would make of them
+        data = {name: getattr(self, name) for name in self.__fields__}
         data['code'] = self.code.value
-        return JSONResponse(status_code=self.code.value, content=data)
+        return FastJSONResponse(status_code=self.code.value, content=data)
+
+
+class CursorAPIResponse(APIResponse):
+    next_cursor: Optional[str] = None
 
 
 class PaginationRequest(BaseModel):
@@ -13,10 +13,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel
 
+# mapping type of the audit log documents in every audit log index
+ES_TYPE = 'operation_logs'
+
 
 class AuditLogCreation(BaseModel):
     """Create an Audit Log."""
@@ -40,3 +44,22 @@ class AuditLogQuery(BaseModel):
     operator: Optional[str] = None
     start_date: Optional[int] = None
     end_date: Optional[int] = None
+
+
+class EAuditLogGroupBy(str, Enum):
+    """Audit log fields that statistics can be grouped by."""
+
+    action = 'action'
+    operator = 'operator'
+    outcome = 'outcome'
+    resource = 'resource'
+
+
+class ECalendarInterval(str, Enum):
+    minute = 'minute'
+    hour = 'hour'
+    day = 'day'
+    week = 'week'
+    month = 'month'
+    quarter = 'quarter'
+    year = 'year'
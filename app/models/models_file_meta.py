@@ -13,9 +13,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from enum import Enum
+from typing import Any
+from typing import List
 from typing import Optional
 
 from pydantic import BaseModel
+from pydantic import conlist
+from pydantic import validator
 
 
 class FileMetaCreation(BaseModel):
@@ -42,8 +47,70 @@ class FileMetaCreation(BaseModel):
     version: Optional[str] = None
 
 
+class EFileBatchOperation(str, Enum):
+    """Bulk action of POST /v1/entity/file/batch; create fails for files that are already indexed."""
+
+    index = 'index'
+    create = 'create'
+
+
 class FileMetaUpdate(BaseModel):
     """Update a File Info."""
 
     global_entity_id: str
     updated_fields: dict
+
+
+class EUpdateConflicts(str, Enum):
+    """What an update by query does on version conflicts: abort the task, or count them and carry on."""
+
+    abort = 'abort'
+    proceed = 'proceed'
+
+
+class FileMetaUpdateByQuery(BaseModel):
+    """Update every File Info matching query, written like the query of GET /v1/entity/file."""
+
+    query: dict
+    updated_fields: dict
+    slices: Optional[str] = 'auto'
+    conflicts: Optional[EUpdateConflicts] = EUpdateConflicts.proceed
+
+    @validator('slices')
+    def validate_slices(cls, value):
+        if value != 'auto' and not (value.isdigit() and int(value) > 0):
+            raise ValueError("slices must be 'auto' or a positive number")
+        return value
+
+
+class FileFieldCondition(BaseModel):
+    """Condition on a plain field of the file search query, e.g. {'value': 'x', 'condition': 'contain'}."""
+
+    value: Any
+    condition: str
+
+
+class FileRangeCondition(BaseModel):
+    """Condition on time_created or file_size; one bound with condition lte/gte, or a [gte, lte] pair."""
+
+    value: conlist(int, min_items=1, max_items=2)
+    condition: Optional[str] = None
+
+
+class FileTagsCondition(BaseModel):
+    value: list
+    condition: str
+
+
+class FileAttributeCondition(BaseModel):
+    attribute_name: str
+    type: str
+    condition: str
+    value: Any
+
+
+class FileAttributesCondition(BaseModel):
+    """Condition on the nested manifest attributes of a file."""
+
+    name: str
+    attributes: List[FileAttributeCondition] = []
@@ -13,18 +13,44 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from enum import Enum
+
 from common import LoggerFactory
 from pydantic import BaseModel
 from pydantic import Field
+from pydantic import conint
 
 from app.models.base_models import APIResponse
 
 _logger = LoggerFactory('api_lineage_action').get_logger()
 
 
+class ELineageFormat(str, Enum):
+    """full is the lineage as Atlas returns it, compact the node and edge tables of lineage_format.compact_lineage."""
+
+    full = 'full'
+    compact = 'compact'
+
+
 class GETLineage(BaseModel):
     item_id: str
     direction: str = 'INPUT'
+    depth: int = 50
+    format: ELineageFormat = ELineageFormat.full
+
+
+class ELineageDirection(str, Enum):
+    INPUT = 'INPUT'
+    OUTPUT = 'OUTPUT'
+    BOTH = 'BOTH'
+
+
+class GETLineageGraph(BaseModel):
+    item_id: str
+    direction: ELineageDirection = ELineageDirection.BOTH
+    depth: conint(ge=1) = 5
+    max_nodes: conint(ge=1) = 500
+    format: ELineageFormat = ELineageFormat.full
 
 
 class GETLineageResponse(APIResponse):
@@ -0,0 +1,290 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import fcntl
+import json
+import os
+from typing import IO
+from typing import List
+from typing import Optional
+
+from common import LoggerFactory
+
+from app.config import ConfigClass
+from app.models.models_audit_log import ES_TYPE
+from app.resources.es_helper import bulk
+
+SEGMENT_SUFFIX = '.log'
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SpoolReplayError(Exception):
+    """Elastic search did not acknowledge a spooled segment; it is kept and retried later."""
+
+
+def _fsync_and_close(active: IO, retired: List[IO]) -> None:
+    try:
+        for segment in retired:
+            os.fsync(segment.fileno())
+        os.fsync(active.fileno())
+    finally:
+        for segment in retired:
+            segment.close()
+
+
+def _read_segment(path: str) -> List[str]:
+    with open(path, encoding='utf-8') as segment:
+        return segment.readlines()
+
+
+class AuditLogSpool:
+    """Append-only on-disk write-ahead log for audit logs.
+
+    Every accepted audit log is appended to the active segment file and `append` returns only once the line is fsynced.
+    Concurrent appends share a single fsync (group commit) issued at most every `fsync_interval` seconds. The active
+    segment is rolled once it grows over `segment_max_bytes` or when the replayer wants to drain it, and a background
+    task replays sealed segments into elastic search through the _bulk API, deleting each one after every document in
+    it is acknowledged. Documents are indexed with their geid as `_id`, so replaying a segment twice is harmless.
+
+    Each gunicorn worker claims its own slot directory under `directory` with an exclusive file lock, so segments left
+    behind by a worker that died are picked up by the next worker claiming the slot.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int,
+        fsync_interval: float,
+        replay_interval: float,
+        replay_batch_size: int,
+        max_slots: int = 64,
+    ):
+        self._logger = LoggerFactory('audit_log_spool').get_logger()
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        self.replay_batch_size = replay_batch_size
+        self.max_slots = max_slots
+
+        self._slot_dir: Optional[str] = None
+        self._lock_file: Optional[IO] = None
+        self._file: Optional[IO] = None
+        self._file_path: Optional[str] = None
+        self._file_size = 0
+        self._sequence = 0
+        self._retired: List[str] = []
+        self._retired_files: List[IO] = []
+        self._sealed: List[str] = []
+
+        self._pending_sync: Optional[asyncio.Future] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    @property
+    def opened(self) -> bool:
+        return self._file is not None
+
+    def open(self) -> None:
+        """Claim a slot directory, pick up segments left in it and start a new active segment."""
+        if self.opened:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for slot in range(self.max_slots):
+            slot_dir = os.path.join(self.directory, f'slot-{slot}')
+            os.makedirs(slot_dir, exist_ok=True)
+            lock_file = open(os.path.join(slot_dir, 'lock'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            self._slot_dir = slot_dir
+            self._lock_file = lock_file
+            break
+        else:
+            raise RuntimeError(f'No free audit log spool slot in {self.directory}')
+
+        segments = sorted(name for name in os.listdir(self._slot_dir) if name.endswith(SEGMENT_SUFFIX))
+        self._sealed = [os.path.join(self._slot_dir, name) for name in segments]
+        if segments:
+            self._sequence = int(segments[-1][: -len(SEGMENT_SUFFIX)])
+        self._open_segment()
+        self._logger.info(f'Audit log spool opened in {self._slot_dir} with {len(self._sealed)} pending segments')
+
+    def start(self) -> None:
+        self.open()
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.create_task(self._replay_loop())
+
+    async def stop(self) -> None:
+        """Stop replaying, make everything appended so far durable and release the slot."""
+        if not self.opened:
+            return
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+        while self._pending_sync is not None:
+            await asyncio.shield(self._pending_sync)
+        if self._sync_task is not None:
+            await self._sync_task
+            self._sync_task = None
+
+        self._file.close()
+        if self._file_size == 0:
+            os.remove(self._file_path)
+        self._file = None
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+        self._sealed = []
+
+    async def append(self, es_index: str, document: dict) -> None:
+        """Append a document to the spool; returns once it has been fsynced to disk."""
+        self.open()
+        line = json.dumps({'index': es_index, 'document': document}) + '\n'
+        self._file.write(line)
+        self._file_size += len(line.encode('utf-8'))
+        self.appended += 1
+
+        pending_sync = self._schedule_sync(self.fsync_interval)
+        if self._file_size >= self.segment_max_bytes:
+            self._roll()
+
+        await asyncio.shield(pending_sync)
+
+    def stats(self) -> dict:
+        return {
+            'pending_segments': len(self._sealed) + len(self._retired) + (1 if self._file_size else 0),
+            'active_segment_bytes': self._file_size,
+            'appended': self.appended,
+            'replayed': self.replayed,
+            'dropped': self.dropped,
+        }
+
+    async def replay(self) -> None:
+        """Index every sealed segment into elastic search, deleting segments once they are fully acknowledged."""
+        loop = asyncio.get_running_loop()
+        for path in list(self._sealed):
+            lines = await loop.run_in_executor(None, _read_segment, path)
+            actions = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn write at the tail of a segment from a crashed worker was never acknowledged
+                    self._logger.warning(f'Skipping corrupted line in audit log spool segment {path}')
+                    continue
+                document = record['document']
+                action = {'index': {'_index': record['index'], '_type': ES_TYPE, '_id': document['geid']}}
+                actions.append((action, document))
+
+            for start in range(0, len(actions), self.replay_batch_size):
+                end = start + self.replay_batch_size
+                await self._replay_chunk(actions[start:end])
+
+            os.remove(path)
+            self._sealed.remove(path)
+            self._logger.debug(f'Replayed audit log spool segment {path}')
+
+    async def _replay_chunk(self, actions: list) -> None:
+        res = await bulk(actions)
+        if 'items' not in res:
+            raise SpoolReplayError(f'Bulk request rejected: {res}')
+
+        retryable = 0
+        for item in res['items']:
+            outcome = item['index']
+            if 'error' not in outcome:
+                continue
+            if outcome['status'] in RETRYABLE_STATUSES:
+                retryable += 1
+            else:
+                self.dropped += 1
+                self._logger.error(f'Dropping audit log {outcome.get("_id")} rejected by elastic search: {outcome}')
+        if retryable:
+            raise SpoolReplayError(f'{retryable} audit logs were not acknowledged by elastic search')
+        self.replayed += len(actions)
+
+    async def _replay_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            if self._file_size:
+                self._roll()
+                self._schedule_sync(0)
+            try:
+                await self.replay()
+            except Exception:
+                self._logger.exception('Failed to replay audit log spool, retrying later')
+
+    def _open_segment(self) -> None:
+        self._sequence += 1
+        self._file_path = os.path.join(self._slot_dir, f'{self._sequence:020d}{SEGMENT_SUFFIX}')
+        self._file = open(self._file_path, 'a', encoding='utf-8')
+        self._file_size = 0
+
+    def _roll(self) -> None:
+        """Retire the active segment; it becomes sealed once the next sync has made it durable."""
+        self._file.flush()
+        self._retired.append(self._file_path)
+        self._retired_files.append(self._file)
+        self._open_segment()
+
+    def _schedule_sync(self, delay: float) -> asyncio.Future:
+        if self._pending_sync is None:
+            self._pending_sync = asyncio.get_running_loop().create_future()
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync(delay))
+        return self._pending_sync
+
+    async def _sync(self, delay: float) -> None:
+        while self._pending_sync is not None:
+            await asyncio.sleep(delay)
+            pending_sync, self._pending_sync = self._pending_sync, None
+            retired, self._retired = self._retired, []
+            retired_files, self._retired_files = self._retired_files, []
+
+            self._file.flush()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, _fsync_and_close, self._file, retired_files)
+            except Exception as e:
+                self._logger.exception('Failed to fsync audit log spool')
+                # the retired segments are closed either way, leave them to the replayer rather than losing track
+                self._sealed.extend(retired)
+                pending_sync.set_exception(e)
+                continue
+
+            self._sealed.extend(retired)
+            pending_sync.set_result(None)
+            delay = self.fsync_interval
+
+
+audit_log_spool = AuditLogSpool(
+    ConfigClass.AUDIT_LOG_SPOOL_DIR,
+    ConfigClass.AUDIT_LOG_SPOOL_SEGMENT_MAX_BYTES,
+    ConfigClass.AUDIT_LOG_SPOOL_FSYNC_INTERVAL,
+    ConfigClass.AUDIT_LOG_SPOOL_REPLAY_INTERVAL,
+    ConfigClass.AUDIT_LOG_SPOOL_REPLAY_BATCH_SIZE,
+)
@@ -0,0 +1,193 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from common import LoggerFactory
+
+from app.config import ConfigClass
+from app.models.models_audit_log import ES_TYPE
+from app.resources.audit_log_spool import RETRYABLE_STATUSES
+from app.resources.es_helper import bulk
+
+_STOP = object()
+
+
+class AuditLogWriter:
+    """Write-behind buffer that indexes audit logs in micro-batches through the _bulk API.
+
+    Documents are flushed once `flush_size` of them are buffered or `flush_interval` seconds have passed since the first
+    one of the batch arrived, whichever happens first. The queue is bounded, so callers get `asyncio.QueueFull` instead
+    of the service buffering without limit while elastic search is slow.
+
+    Documents failing with a retryable status (429, 5xx) or with the whole request, e.g. while elastic search is down,
+    are flushed again up to `max_retries` times, waiting `retry_backoff` seconds doubled on every attempt. Consuming
+    the queue pauses meanwhile, so callers see it fill up instead of documents being dropped. Documents are indexed
+    with their geid as `_id`, so retrying a batch elastic search already indexed does not duplicate them. Only documents
+    rejected for good, or still failing after the last retry, are dropped and counted as failed.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        flush_size: int,
+        flush_interval: float,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        self._logger = LoggerFactory('audit_log_writer').get_logger()
+        self.max_queue_size = max_queue_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.flushed = 0
+        self.failed = 0
+        self.retried = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything that is still buffered and stop the background task."""
+        if not self.running:
+            return
+        task = self._task
+        self._task = None
+        await self._queue.put(_STOP)
+        await task
+
+    def enqueue(self, es_index: str, document: dict) -> None:
+        """Buffer a document for indexing; raises asyncio.QueueFull when the buffer is at capacity."""
+        self.start()
+        self._queue.put_nowait((es_index, document))
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'queue_capacity': self.max_queue_size,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'flushes': self.flushes,
+            'last_flush_latency': self.last_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[str, dict]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                self.retried += len(batch)
+            batch = await self._flush(batch)
+            if not batch:
+                return
+
+        self.failed += len(batch)
+        geids = [document.get('geid') for _, document in batch]
+        self._logger.error(f'Dropping {len(batch)} audit logs after {self.max_retries} retries: {geids}')
+
+    async def _flush(self, batch: List[Tuple[str, dict]]) -> List[Tuple[str, dict]]:
+        """Index a batch through the _bulk API and return the documents worth retrying."""
+        actions = []
+        for es_index, document in batch:
+            action = {'index': {'_index': es_index, '_type': ES_TYPE, '_id': document.get('geid')}}
+            actions.append((action, document))
+
+        start = time.perf_counter()
+        try:
+            res = await bulk(actions)
+            outcomes = [item['index'] for item in res['items']]
+        except Exception:
+            self._logger.exception(f'Failed to flush {len(batch)} audit logs into elastic search')
+            outcomes = [{'status': None, 'error': 'bulk request failed'}] * len(batch)
+
+        latency = time.perf_counter() - start
+        self.flushes += 1
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+
+        retries = []
+        rejected = 0
+        for item, outcome in zip(batch, outcomes):
+            if 'error' not in outcome:
+                self.flushed += 1
+            elif outcome['status'] is None or outcome['status'] in RETRYABLE_STATUSES:
+                retries.append(item)
+            else:
+                rejected += 1
+                self._logger.error(f'Dropping audit log {item[1].get("geid")} rejected by elastic search: {outcome}')
+
+        self.failed += rejected
+        if retries:
+            self._logger.warning(f'{len(retries)} of {len(batch)} audit logs failed to insert and will be retried')
+        self._logger.debug(f'Flushed {len(batch)} audit logs in {latency:.3f}s')
+        return retries
+
+
+audit_log_writer = AuditLogWriter(
+    ConfigClass.AUDIT_LOG_QUEUE_MAX_SIZE,
+    ConfigClass.AUDIT_LOG_FLUSH_SIZE,
+    ConfigClass.AUDIT_LOG_FLUSH_INTERVAL,
+    ConfigClass.AUDIT_LOG_FLUSH_MAX_RETRIES,
+    ConfigClass.AUDIT_LOG_FLUSH_RETRY_BACKOFF,
+)
@@ -0,0 +1,145 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import json
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Optional
+from typing import Tuple
+
+from app.resources.es_helper import ESRequestError
+from app.resources.es_helper import close_point_in_time
+from app.resources.es_helper import open_point_in_time
+
+
+class InvalidCursor(Exception):
+    """Cursor could not be decoded or its point in time has expired."""
+
+
+# errors elastic search reports for an expired or unknown point in time, or a search_after not matching the sort
+CURSOR_ERROR_TYPES = {'search_context_missing_exception'}
+CURSOR_ERROR_REASONS = ('point in time', 'search context', 'search_after', 'pit id')
+
+
+def is_cursor_error(error) -> bool:
+    """Whether a search error is caused by the point in time or the search_after of a cursor, not by the query."""
+    if not isinstance(error, dict):
+        return any(reason in str(error).lower() for reason in CURSOR_ERROR_REASONS)
+
+    causes = [error, *error.get('root_cause', [])]
+    causes.extend(failure.get('reason', {}) for failure in error.get('failed_shards', []))
+    for cause in causes:
+        if cause.get('type') in CURSOR_ERROR_TYPES:
+            return True
+        if any(reason in str(cause.get('reason', '')).lower() for reason in CURSOR_ERROR_REASONS):
+            return True
+    return False
+
+
+def encode_cursor(pit_id: str, search_after: list) -> str:
+    payload = json.dumps({'pit_id': pit_id, 'search_after': search_after}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, list]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload['pit_id'], payload['search_after']
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+
+
+async def search_with_cursor(
+    es_index: str,
+    cursor: Optional[str],
+    page_size: int,
+    search: Callable[..., Awaitable[dict]],
+) -> Tuple[dict, Optional[str]]:
+    """Run one page of `search` inside a point in time and return the response with the cursor of the next page.
+
+    Without a cursor a new point in time is opened on `es_index`. `search` is called with `pit_id` and `search_after`
+    keyword arguments. Once a page comes back short the point in time is closed and the returned cursor is None.
+
+    InvalidCursor is raised only when the given cursor is at fault; any other search error is returned as is, with no
+    cursor, after closing the point in time opened for the first page.
+    """
+
+    if cursor:
+        pit_id, search_after = decode_cursor(cursor)
+    else:
+        pit_id, search_after = await open_point_in_time(es_index), None
+
+    res = await search(pit_id=pit_id, search_after=search_after)
+    if 'error' in res:
+        if cursor and is_cursor_error(res['error']):
+            raise InvalidCursor(f'Cursor is no longer valid: {res["error"]}')
+        if not cursor:
+            await close_point_in_time(pit_id)
+        return res, None
+
+    hits = res['hits']['hits']
+    pit_id = res.get('pit_id', pit_id)
+    if len(hits) < page_size:
+        await close_point_in_time(pit_id)
+        return res, None
+
+    return res, encode_cursor(pit_id, hits[-1]['sort'])
+
+
+async def scan_with_cursor(
+    es_index: str,
+    page_size: int,
+    search: Callable[..., Awaitable[dict]],
+) -> AsyncIterator[list]:
+    """Open a point in time, fetch the first page of `search` and return an iterator over every page of hits.
+
+    Failing to open the point in time or to fetch the first page raises ESRequestError here, before the caller starts
+    streaming. The point in time is closed when the scan finishes, and also when the consumer stops iterating early.
+    """
+
+    pit_id = await open_point_in_time(es_index)
+    try:
+        res = await search(pit_id=pit_id, search_after=None)
+        if 'error' in res:
+            raise ESRequestError(res.get('status', 500), res['error'])
+    except BaseException:
+        await close_point_in_time(pit_id)
+        raise
+
+    return _scan_pages(res, pit_id, page_size, search)
+
+
+async def _scan_pages(
+    res: dict,
+    pit_id: str,
+    page_size: int,
+    search: Callable[..., Awaitable[dict]],
+) -> AsyncIterator[list]:
+    try:
+        while True:
+            hits = res['hits']['hits']
+            pit_id = res.get('pit_id', pit_id)
+            if hits:
+                yield hits
+            if len(hits) < page_size:
+                return
+
+            res = await search(pit_id=pit_id, search_after=hits[-1]['sort'])
+            if 'error' in res:
+                raise InvalidCursor(f'Point in time is no longer valid: {res["error"]}')
+    finally:
+        await close_point_in_time(pit_id)
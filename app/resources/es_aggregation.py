@@ -0,0 +1,67 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import List
+from typing import Optional
+
+# audit logs store createdTime as float epoch seconds, which a date_histogram on the field would read as milliseconds
+EPOCH_SECONDS_TO_MILLIS = (
+    'if (doc[params.field].size() == 0) { return null; } return (long) (doc[params.field].value * 1000);'
+)
+
+
+def build_aggregations(
+    group_by: List[str], size: int, date_field: Optional[str] = None, interval: Optional[str] = None
+) -> dict:
+    """Nest a date_histogram on `date_field` (when an interval is given) and a terms aggregation per `group_by` field.
+
+    `date_field` holds epoch seconds, so the histogram buckets its value converted to milliseconds by a script. Each
+    aggregation is named after the field it groups by, in the order returned by `aggregation_levels`.
+    """
+
+    aggregations = {}
+    for field in reversed(group_by):
+        aggregation = {'terms': {'field': field, 'size': size}}
+        if aggregations:
+            aggregation['aggs'] = aggregations
+        aggregations = {field: aggregation}
+
+    if interval:
+        script = {'source': EPOCH_SECONDS_TO_MILLIS, 'params': {'field': date_field}}
+        aggregation = {'date_histogram': {'script': script, 'calendar_interval': interval, 'min_doc_count': 1}}
+        if aggregations:
+            aggregation['aggs'] = aggregations
+        aggregations = {date_field: aggregation}
+
+    return aggregations
+
+
+def aggregation_levels(group_by: List[str], date_field: Optional[str] = None, interval: Optional[str] = None) -> list:
+    return ([date_field] if interval else []) + list(group_by)
+
+
+def flatten_buckets(aggregations: dict, levels: list, row: Optional[dict] = None) -> List[dict]:
+    """Turn nested buckets into one row per leaf bucket, e.g. {'createdTime': ..., 'action': ..., 'count': 3}."""
+    row = row or {}
+    if not levels:
+        return [dict(row, count=aggregations['doc_count'])]
+
+    name = levels[0]
+    rows = []
+    for bucket in aggregations[name]['buckets']:
+        bucket_row = dict(row)
+        bucket_row[name] = bucket.get('key_as_string', bucket['key'])
+        rows.extend(flatten_buckets(bucket, levels[1:], bucket_row))
+    return rows
@@ -13,19 +13,183 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
+import time
+
 import httpx
 from common import LoggerFactory
 
 from app.config import ConfigClass
+from app.resources.http_client import es_client
+from app.resources.server_timing import record_timing
 
 __logger = LoggerFactory('es_helper').get_logger()
 ELASTIC_SEARCH_URL = f'http://{ConfigClass.ELASTIC_SEARCH_HOST}:{ConfigClass.ELASTIC_SEARCH_PORT}/'
 
 
-async def exact_search(es_type, es_index, page, page_size, params, sort_by=None, sort_type=None):
-    url = ELASTIC_SEARCH_URL + '{}/{}/_search'.format(es_index, es_type)
-    __logger.info(f'exact_search_url is {url}')
+class ESRequestError(Exception):
+    """Elastic search answered a request with an error instead of a result."""
+
+    def __init__(self, status_code: int, error):
+        super().__init__(f'{status_code}: {error}')
+        self.status_code = status_code
+        self.error = error
+
+
+def source_filter(fields=None, exclude=None):
+    """Build the _source filter of a search from comma separated field lists; None returns the whole source."""
+    includes = [field.strip() for field in fields.split(',') if field.strip()] if fields else []
+    excludes = [field.strip() for field in exclude.split(',') if field.strip()] if exclude else []
+    if not includes and not excludes:
+        return None
+
+    source = {}
+    if includes:
+        source['includes'] = includes
+    if excludes:
+        source['excludes'] = excludes
+    return source
+
+
+def lean_hits(hits):
+    """Drop the elastic search metadata of each hit, keeping its id next to the (projected) source."""
+    return [dict(hit.get('_source', {}), _id=hit['_id']) for hit in hits]
+
+
+def query_shape(body):
+    """Structure of a search body with every value replaced by '?', so searches differing only in values match.
+
+    Keys are kept since they name clauses and fields; a list keeps every distinct shape of its elements once, so a
+    terms clause with three values has the shape of one with thirty.
+    """
+    if isinstance(body, dict):
+        return {key: query_shape(value) for key, value in sorted(body.items())}
+    if isinstance(body, list):
+        shapes = []
+        for item in body:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return '?'
+
+
+def query_fingerprint(body):
+    shape = json.dumps(query_shape(body), separators=(',', ':'))
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:16]
+
+
+def request_stats(operation, body, result, encode_ms, client_ms):
+    """Log fields telling elastic search execution time apart from the time spent on the wire and encoding the body.
+
+    Responses without took or _shards, e.g. a single document write, leave those fields None; so does a body without a
+    query, e.g. a document or bulk NDJSON, for the fingerprint.
+    """
+    shards = result.get('_shards', {})
+    return {
+        'es_operation': operation,
+        'es_took_ms': result.get('took'),
+        'es_timed_out': result.get('timed_out'),
+        'es_shards_total': shards.get('total'),
+        'es_shards_successful': shards.get('successful'),
+        'es_shards_skipped': shards.get('skipped'),
+        'es_shards_failed': shards.get('failed'),
+        'es_encode_ms': round(encode_ms, 1),
+        'es_client_ms': round(client_ms, 1),
+        'es_query_fingerprint': query_fingerprint(body) if body is not None else None,
+    }
+
+
+async def _request(operation, method, url, query=None, json_body=None, content=None, params=None):
+    """Send a request to elastic search, logging its request_stats and adding them to the Server-Timing header.
+
+    The body is `json_body` encoded here, or `content` already encoded as NDJSON; `query` is the part of the body
+    fingerprinted in the stats. Requests slower than ELASTIC_SEARCH_SLOW_QUERY_THRESHOLD_MS, measured on the client,
+    or timed out in elastic search are logged as warnings together with the shape of their query; a threshold of 0
+    only logs the timed out ones. Returns the response and its JSON payload, or {'error': text} when it is not JSON.
+    """
+    started = time.perf_counter()
+    if content is None:
+        content = json.dumps(json_body).encode('utf-8')
+        content_type = 'application/json'
+    else:
+        content_type = 'application/x-ndjson'
+    encoded = time.perf_counter()
+    res = await es_client.get().request(
+        method, url, content=content, params=params, headers={'Content-Type': content_type}
+    )
+    try:
+        result = res.json()
+    except ValueError:
+        result = {'error': res.text}
+    finished = time.perf_counter()
+
+    stats = request_stats(operation, query, result, (encoded - started) * 1000, (finished - encoded) * 1000)
+    if stats['es_took_ms'] is not None:
+        __logger.info(f'{operation} took {stats["es_took_ms"]}ms in elastic search', extra=stats)
+    else:
+        __logger.info(f'{operation} took {stats["es_client_ms"]}ms on the client', extra=stats)
+
+    threshold = ConfigClass.ELASTIC_SEARCH_SLOW_QUERY_THRESHOLD_MS
+    if stats['es_timed_out'] or (threshold > 0 and stats['es_client_ms'] >= threshold):
+        extra = dict(stats)
+        if query is not None:
+            extra['es_query_shape'] = json.dumps(query_shape(query), separators=(',', ':'))
+        __logger.warning(
+            f'slow {operation}: {stats["es_client_ms"]}ms on the client, {stats["es_took_ms"]}ms in elastic search',
+            extra=extra,
+        )
+
+    if stats['es_took_ms'] is not None:
+        record_timing('es', stats['es_took_ms'])
+    record_timing('es-client', stats['es_client_ms'])
+    record_timing('es-encode', stats['es_encode_ms'])
+
+    return res, result
+
+
+async def _search(operation, url, body):
+    _, result = await _request(operation, 'GET', url, query=body, json_body=body)
+    return result
+
+
+def _paginate(url, search_data, page, page_size, pit_id=None, search_after=None):
+    """Page with from/size, or with search_after inside a point in time when pit_id is given."""
+    search_data['size'] = page_size
+    if pit_id is None:
+        search_data['from'] = page * page_size
+        return url
+
+    # a search against a point in time must not name the index, it is bound to the pit
+    search_data['pit'] = {'id': pit_id, 'keep_alive': ConfigClass.ELASTIC_SEARCH_PIT_KEEP_ALIVE}
+    if search_after:
+        search_data['search_after'] = search_after
+    return ELASTIC_SEARCH_URL + '_search'
+
+
+async def open_point_in_time(es_index):
+    url = ELASTIC_SEARCH_URL + '{}/_pit'.format(es_index)
+    __logger.debug(f'open pit es url is: {url}')
+
+    res = await es_client.get().post(url, params={'keep_alive': ConfigClass.ELASTIC_SEARCH_PIT_KEEP_ALIVE})
+    payload = res.json()
+    if 'error' in payload:
+        raise ESRequestError(res.status_code, payload['error'])
+
+    return payload['id']
+
+
+async def close_point_in_time(pit_id):
+    url = ELASTIC_SEARCH_URL + '_pit'
+    __logger.debug(f'close pit es url is: {url}')
+
+    res = await es_client.get().request('DELETE', url, json={'id': pit_id})
+
+    return res.json()
 
+
+def _exact_query(params):
     search_params = []
 
     for key, value in params.items():
@@ -40,146 +204,219 @@ async def exact_search(es_type, es_index, page, page_size, params, sort_by=None,
         else:
             search_params.append({'constant_score': {'filter': {'term': {key: value}}}})
 
-    search_data = {
-        'query': {
-            'bool': {
-                'must': search_params,
-            },
+    return {
+        'bool': {
+            'must': search_params,
         },
-        'size': page_size,
-        'from': page * page_size,
+    }
+
+
+async def exact_search(
+    es_type,
+    es_index,
+    page,
+    page_size,
+    params,
+    sort_by=None,
+    sort_type=None,
+    pit_id=None,
+    search_after=None,
+    source=None,
+):
+    url = ELASTIC_SEARCH_URL + '{}/{}/_search'.format(es_index, es_type)
+    __logger.info(f'exact_search_url is {url}')
+
+    search_data = {
+        'query': _exact_query(params),
         'sort': [{sort_by: sort_type}],
     }
+    if source is not None:
+        search_data['_source'] = source
+    url = _paginate(url, search_data, page, page_size, pit_id, search_after)
 
-    async with httpx.AsyncClient() as client:
-        res = await client.request('GET', url, json=search_data)
-        __logger.debug(f'Response is: {res.json()}')
+    res = await _search('exact_search', url, search_data)
+    __logger.debug(f'Response is: {res}')
 
-    return res.json()
+    return res
+
+
+async def aggregate(es_type, es_index, params, aggregations):
+    """Run aggregations over the documents matching the exact_search params without returning any hits."""
+    url = ELASTIC_SEARCH_URL + '{}/{}/_search'.format(es_index, es_type)
+    __logger.info(f'aggregate_url is {url}')
+
+    search_data = {
+        'query': _exact_query(params),
+        'size': 0,
+        'aggs': aggregations,
+    }
+
+    return await _search('aggregate', url, search_data)
 
 
 async def insert_one(es_type, es_index, data):
     url = ELASTIC_SEARCH_URL + '{}/{}'.format(es_index, es_type)
     __logger.debug(f'es url is: {url}')
 
-    async with httpx.AsyncClient(verify=False) as client:
-        res = await client.post(url, json=data)
+    _, result = await _request('insert_one', 'POST', url, json_body=data)
 
-    return res.json()
+    return result
 
 
 async def insert_one_by_id(es_type, es_index, data, id_):
     url = ELASTIC_SEARCH_URL + '{}/{}/{}'.format(es_index, es_type, id_)
     __logger.debug(f'es url is: {url}')
 
-    async with httpx.AsyncClient() as client:
-        res = await client.put(url, json=data)
+    _, result = await _request('insert_one_by_id', 'PUT', url, json_body=data)
 
     __logger.info(f'Inserting url: {url}')
     __logger.info(f'Inserting data: {data}')
 
-    return res.json()
+    return result
+
+
+def _encode_bulk_action(action, source):
+    lines = json.dumps(action) + '\n'
+    if source is not None:
+        lines += json.dumps(source) + '\n'
+    return lines.encode('utf-8')
+
+
+async def _post_bulk(operation, body):
+    url = ELASTIC_SEARCH_URL + '_bulk'
+    __logger.debug(f'bulk es url is: {url}')
+    return await _request(operation, 'POST', url, content=body)
+
+
+async def bulk(actions):
+    """Send (action, source) pairs to the _bulk API as NDJSON; source is None for actions without a body."""
+    body = b''.join(_encode_bulk_action(action, source) for action, source in actions)
+    _, result = await _post_bulk('bulk', body)
+
+    return result
+
+
+def chunk_bulk_actions(actions, max_bytes):
+    """Encode (action, source) pairs and group them into NDJSON bodies of at most max_bytes.
+
+    Yields (body, operations) where operations lists the action type of every pair in the body, e.g. 'index'. A
+    single pair larger than max_bytes is sent on its own.
+    """
+    lines = []
+    operations = []
+    size = 0
+    for action, source in actions:
+        encoded = _encode_bulk_action(action, source)
+        if lines and size + len(encoded) > max_bytes:
+            yield b''.join(lines), operations
+            lines, operations, size = [], [], 0
+        lines.append(encoded)
+        operations.append(next(iter(action)))
+        size += len(encoded)
+
+    if lines:
+        yield b''.join(lines), operations
+
+
+async def bulk_chunked(actions, max_bytes=None):
+    """Send (action, source) pairs to the _bulk API in bodies of at most max_bytes, one request after another.
+
+    The result has the shape of a single _bulk response. When a whole request is rejected, e.g. with 413 or 429,
+    every item of that chunk is reported with the status and error of the response, and with status 500 when the
+    request fails in transport, e.g. on a timeout; the other chunks are still sent.
+    """
+    max_bytes = max_bytes or ConfigClass.ELASTIC_SEARCH_BULK_MAX_BYTES
+    errors = False
+    items = []
+    for body, operations in chunk_bulk_actions(actions, max_bytes):
+        try:
+            res, payload = await _post_bulk('bulk_chunked', body)
+        except httpx.HTTPError as e:
+            # the chunk may or may not have been applied, so its items are reported as failed, like a rejected chunk
+            __logger.error(f'bulk request of {len(operations)} actions failed: {e!r}')
+            errors = True
+            items.extend({operation: {'status': 500, 'error': repr(e)}} for operation in operations)
+            continue
+
+        if 'items' in payload:
+            errors = errors or payload['errors']
+            items.extend(payload['items'])
+            continue
+
+        __logger.error(f'bulk request of {len(operations)} actions failed: {res.status_code} {payload}')
+        errors = True
+        error = payload.get('error', payload)
+        items.extend({operation: {'status': res.status_code, 'error': error}} for operation in operations)
+
+    return {'errors': errors, 'items': items}
 
 
 async def update_one_by_id(es_index, id_, fields):
     url = ELASTIC_SEARCH_URL + '{}/_update/{}'.format(es_index, id_)
     __logger.debug(f'update es url is: {url}')
     request_body = {'doc': fields}
-    async with httpx.AsyncClient() as client:
-        res = await client.post(url, json=request_body)
+    _, result = await _request('update_one_by_id', 'POST', url, json_body=request_body)
+
+    return result
+
+
+async def update_by_query(es_index, query, script, slices='auto', conflicts='proceed'):
+    """Start an _update_by_query as an elastic search task; the response holds the task id to poll with get_task."""
+    url = ELASTIC_SEARCH_URL + '{}/_update_by_query'.format(es_index)
+    __logger.debug(f'update by query es url is: {url}')
+    params = {'wait_for_completion': 'false', 'slices': slices, 'conflicts': conflicts}
+    _, result = await _request(
+        'update_by_query', 'POST', url, query=query, json_body={'query': query, 'script': script}, params=params
+    )
+
+    return result
+
+
+async def get_task(task_id):
+    url = ELASTIC_SEARCH_URL + '_tasks/{}'.format(task_id)
+    __logger.debug(f'get task es url is: {url}')
+    res = await es_client.get().get(url)
+
+    return res.json()
+
+
+async def get_mapping(es_index):
+    url = ELASTIC_SEARCH_URL + '{}/_mapping'.format(es_index)
+    __logger.debug(f'mapping es url is: {url}')
+
+    res = await es_client.get().get(url)
+    res.raise_for_status()
+
+    return res.json()
+
+
+async def get_settings(es_index):
+    url = ELASTIC_SEARCH_URL + '{}/_settings'.format(es_index)
+    __logger.debug(f'settings es url is: {url}')
+
+    res = await es_client.get().get(url)
+    res.raise_for_status()
 
     return res.json()
 
 
-async def file_search(es_index, page, page_size, data, sort_by=None, sort_type=None):  # noqa: C901
+async def file_search(
+    es_index, page, page_size, query, sort_by=None, sort_type=None, pit_id=None, search_after=None, source=None
+):
+    """Search files with a query compiled by app.resources.file_query_compiler."""
     url = ELASTIC_SEARCH_URL + '{}/_search'.format(es_index)
     __logger.debug(f'es url is: {url}')
 
-    search_fields = []
-
-    for item in data:
-        if item['nested']:
-            field_values = [{'match': {'attributes.name': item['name']}}]
-
-            if 'attribute_name' in item:
-                field_values.append({'match': {'attributes.attribute_name': item['attribute_name']}})
-            if 'search_type' in item:
-                if item['search_type'] == 'wildcard':
-                    field_values.append({'wildcard': {'attributes.value': item['value']}})
-                elif item['search_type'] == 'match':
-                    field_values.append({'match': {'attributes.value': item['value']}})
-                elif item['search_type'] == 'should':
-                    options = []
-                    for option in item['value']:
-                        options.append({'match': {'attributes.value': option}})
-                    field_values.append({'bool': {'should': options}})
-                elif item['search_type'] == 'must':
-                    options = []
-                    for option in item['value']:
-                        options.append({'match': {'attributes.value': option}})
-                    field_values.append({'bool': {'must': options}})
-
-            search_fields.append(
-                {
-                    'nested': {
-                        'path': item['field'],
-                        'query': {
-                            'bool': {
-                                'must': field_values,
-                            }
-                        },
-                    }
-                }
-            )
-        elif item['range']:
-            if len(item['range']) == 1:
-                value = str(item['range'][0])
-                if len(value) > 20:
-                    value = value[:19]
-                if item['search_type'] == 'lte':
-                    search_fields.append({'range': {item['field']: {'lte': int(value)}}})
-                else:
-                    search_fields.append({'range': {item['field']: {'gte': int(value)}}})
-            else:
-                value1 = str(item['range'][0])
-                value2 = str(item['range'][1])
-
-                if len(value1) > 20:
-                    value1 = value1[:19]
-
-                if len(value2) > 20:
-                    value2 = value2[:19]
-
-                search_fields.append({'range': {item['field']: {'gte': int(value1), 'lte': int(value2)}}})
-        elif item['multi_values']:
-            options = []
-            for option in item['value']:
-                options.append({'term': {item['field']: option}})
-
-            if item['search_type'] == 'should':
-                search_fields.append({'bool': {'should': options}})
-            else:
-                search_fields.append({'bool': {'must': options}})
-        else:
-            if item['search_type'] == 'contain':
-                search_fields.append({'wildcard': {item['field']: '*{}*'.format(item['value'])}})
-            elif item['search_type'] == 'start_with':
-                search_fields.append({'wildcard': {item['field']: '{}*'.format(item['value'])}})
-            elif item['search_type'] == 'end_with':
-                search_fields.append({'wildcard': {item['field']: '*{}'.format(item['value'])}})
-            else:
-                search_fields.append({'term': {item['field']: item['value']}})
-
     search_params = {
-        'query': {'bool': {'must': search_fields}},
-        'size': page_size,
-        'from': page * page_size,
+        'query': query,
         'sort': [{sort_by: sort_type}],
+        'track_scores': False,
     }
+    if source is not None:
+        search_params['_source'] = source
+    url = _paginate(url, search_params, page, page_size, pit_id, search_after)
 
     __logger.info(f'Searching url: {url}')
     __logger.info(f'Searching data: {search_params}')
 
-    async with httpx.AsyncClient() as client:
-        res = await client.request('GET', url, json=search_params)
-    return res.json()
+    return await _search('file_search', url, search_params)
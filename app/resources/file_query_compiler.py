@@ -0,0 +1,269 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+from pydantic import ValidationError
+
+from app.config import ConfigClass
+from app.models.models_file_meta import FileAttributesCondition
+from app.models.models_file_meta import FileFieldCondition
+from app.models.models_file_meta import FileRangeCondition
+from app.models.models_file_meta import FileTagsCondition
+from app.resources.metrics import metrics
+
+RANGE_FIELDS = {'time_created', 'file_size'}
+
+Renderer = Callable[[tuple], list]
+
+
+class InvalidFileQuery(Exception):
+    """The file search query does not match the supported query language."""
+
+
+def _range_bound(value) -> int:
+    # timestamps sent with a higher precision than nanoseconds are cut down to 19 digits
+    value = str(value)
+    if len(value) > 20:
+        value = value[:19]
+    return int(value)
+
+
+def _field_renderer(field: str, condition: str) -> Renderer:
+    if condition == 'contain':
+        return lambda values: [{'wildcard': {field: '*{}*'.format(values[0])}}]
+    if condition == 'start_with':
+        return lambda values: [{'wildcard': {field: '{}*'.format(values[0])}}]
+    if condition == 'end_with':
+        return lambda values: [{'wildcard': {field: '*{}'.format(values[0])}}]
+    return lambda values: [{'term': {field: values[0]}}]
+
+
+def _range_renderer(field: str, condition: str, bounds: int) -> Renderer:
+    if bounds == 2:
+        return lambda values: [{'range': {field: {'gte': _range_bound(values[0]), 'lte': _range_bound(values[1])}}}]
+    operator = 'lte' if condition == 'lte' else 'gte'
+    return lambda values: [{'range': {field: {operator: _range_bound(values[0])}}}]
+
+
+def _tags_renderer(field: str, condition: str) -> Renderer:
+    occur = 'should' if condition == 'contain' else 'must'
+    return lambda values: [{'bool': {occur: [{'term': {field: option}} for option in values[0]]}}]
+
+
+def _attribute_value_renderer(is_text: bool, is_contain: bool) -> Callable:
+    if is_text and is_contain:
+        return lambda value: {'wildcard': {'attributes.value': '*{}*'.format(value)}}
+    if is_text:
+        return lambda value: {'match': {'attributes.value': value}}
+    occur = 'should' if is_contain else 'must'
+    return lambda value: {'bool': {occur: [{'match': {'attributes.value': option}} for option in value]}}
+
+
+def _attributes_renderer(records: tuple) -> Renderer:
+    value_renderers = [_attribute_value_renderer(is_text, is_contain) for is_text, is_contain in records]
+
+    def render(values: tuple) -> list:
+        name, record_values = values
+        name_clause = {'match': {'attributes.name': name}}
+        clauses = [{'nested': {'path': 'attributes', 'query': {'bool': {'must': [name_clause]}}}}]
+        for value_renderer, (attribute_name, value) in zip(value_renderers, record_values):
+            must = [
+                {'match': {'attributes.name': name}},
+                {'match': {'attributes.attribute_name': attribute_name}},
+                value_renderer(value),
+            ]
+            clauses.append({'nested': {'path': 'attributes', 'query': {'bool': {'must': must}}}})
+        return clauses
+
+    return render
+
+
+def _validate(queries: dict) -> None:
+    """Raise the error of the typed condition models for a query _split rejected."""
+    try:
+        for key, condition in queries.items():
+            if key == 'attributes':
+                attributes = FileAttributesCondition.parse_obj(condition)
+                for record in attributes.attributes:
+                    if record.type != 'text' and not isinstance(record.value, list):
+                        raise InvalidFileQuery(f'Value of attribute {record.attribute_name} must be a list')
+            elif key in RANGE_FIELDS:
+                FileRangeCondition.parse_obj(condition)
+            elif key == 'tags':
+                FileTagsCondition.parse_obj(condition)
+            else:
+                FileFieldCondition.parse_obj(condition)
+    except ValidationError as e:
+        raise InvalidFileQuery(f'Invalid query: {e}')
+
+
+def _check(valid: bool) -> None:
+    if not valid:
+        raise TypeError('invalid condition')
+
+
+def _is_bound(value) -> bool:
+    if isinstance(value, str):
+        return value.lstrip('-').isdigit()
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_scalar(value) -> bool:
+    return isinstance(value, (str, int, float))
+
+
+def _split(queries: dict) -> Tuple[tuple, list]:
+    """Separate a query into its shape, which decides the DSL structure, and the values bound into it.
+
+    The types of the values are checked on every call, as strictly as the condition models or more, so whether a
+    query is accepted never depends on which shapes are cached. Raises TypeError or KeyError for an invalid query.
+    """
+    shape = []
+    values = []
+    for key, condition in queries.items():
+        _check(isinstance(condition, dict))
+        if key == 'attributes':
+            records = condition.get('attributes', [])
+            _check(isinstance(condition['name'], str) and isinstance(records, list))
+            for record in records:
+                _check_attribute(record)
+            shape.append((key, tuple(_attribute_shape(record) for record in records)))
+            values.append((condition['name'], tuple((record['attribute_name'], record['value']) for record in records)))
+        elif key in RANGE_FIELDS:
+            bounds = condition['value']
+            _check(isinstance(bounds, list) and 1 <= len(bounds) <= 2 and all(_is_bound(bound) for bound in bounds))
+            _check(isinstance(condition.get('condition'), (str, type(None))))
+            shape.append((key, condition.get('condition'), len(bounds)))
+            values.append(tuple(bounds))
+        elif key == 'tags':
+            _check(isinstance(condition['value'], list) and isinstance(condition['condition'], str))
+            _check(all(_is_scalar(option) for option in condition['value']))
+            shape.append((key, condition['condition']))
+            values.append((condition['value'],))
+        else:
+            _check(isinstance(condition['condition'], str) and _is_scalar(condition['value']))
+            shape.append((key, condition['condition']))
+            values.append((condition['value'],))
+    return tuple(shape), values
+
+
+def _check_attribute(record: dict) -> None:
+    _check(isinstance(record, dict))
+    _check(all(isinstance(record[field], str) for field in ('attribute_name', 'type', 'condition')))
+    if record['type'] == 'text':
+        _check(_is_scalar(record['value']))
+    else:
+        _check(isinstance(record['value'], list) and all(_is_scalar(option) for option in record['value']))
+
+
+def _attribute_shape(record: dict) -> tuple:
+    return record['type'] == 'text', record['condition'] == 'contain'
+
+
+def _compile_shape(shape: tuple) -> List[Renderer]:
+    renderers = []
+    for entry in shape:
+        key = entry[0]
+        if key == 'attributes':
+            renderers.append(_attributes_renderer(entry[1]))
+        elif key in RANGE_FIELDS:
+            renderers.append(_range_renderer(key, entry[1], entry[2]))
+        elif key == 'tags':
+            renderers.append(_tags_renderer(key, entry[1]))
+        else:
+            renderers.append(_field_renderer(key, entry[1]))
+    return renderers
+
+
+class CompiledQueryCache:
+    """LRU of compiled query shapes with hit and miss counters."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._renderers: 'OrderedDict[tuple, List[Renderer]]' = OrderedDict()
+
+    def get(self, shape: tuple) -> List[Renderer]:
+        renderers = self._renderers.get(shape)
+        if renderers is not None:
+            self.hits += 1
+            self._renderers.move_to_end(shape)
+            return renderers
+
+        self.misses += 1
+        renderers = _compile_shape(shape)
+        self._renderers[shape] = renderers
+        if len(self._renderers) > self.maxsize:
+            self._renderers.popitem(last=False)
+        return renderers
+
+    def clear(self) -> None:
+        self._renderers.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._renderers), 'maxsize': self.maxsize}
+
+
+compiled_query_cache = CompiledQueryCache(ConfigClass.FILE_QUERY_CACHE_SIZE)
+metrics.register_cache('compiled_query', compiled_query_cache.info)
+
+
+def compile_file_query(queries: dict) -> dict:
+    """Compile the JSON query of the file search API into an elastic search bool query.
+
+    The structure of the query (fields, conditions, attribute types and the number of range bounds) is compiled once
+    into a list of renderers and cached; repeated queries with the same shape only bind their values. The types of the
+    values are checked on every call; a rejected query raises the error of the typed condition models.
+    """
+
+    if not isinstance(queries, dict):
+        raise InvalidFileQuery('Query must be a JSON object')
+    try:
+        shape, values = _split(queries)
+    except (KeyError, TypeError, AttributeError):
+        _validate(queries)
+        raise InvalidFileQuery('Invalid query')
+
+    try:
+        clauses = []
+        for render, entry_values in zip(compiled_query_cache.get(shape), values):
+            clauses.extend(render(entry_values))
+    except (ValueError, TypeError) as e:
+        raise InvalidFileQuery(f'Invalid query value: {e}')
+
+    return {'bool': {'must': clauses}}
+
+
+@lru_cache(maxsize=ConfigClass.FILE_QUERY_CACHE_SIZE)
+def compile_file_query_string(query: str) -> dict:
+    """Compile the JSON query string of the file search API, memoizing the result for identical query strings.
+
+    The returned query is shared between callers and must not be modified.
+    """
+
+    try:
+        queries = json.loads(query)
+    except ValueError as e:
+        raise InvalidFileQuery(f'Query is not valid JSON: {e}')
+    return compile_file_query(queries)
@@ -0,0 +1,143 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from common import LoggerFactory
+
+from app.resources.es_helper import get_mapping
+from app.resources.es_helper import get_settings
+
+# field -> (subfield, kind, shortest value the subfield answers)
+ContainSubfields = Dict[str, Tuple[str, str, int]]
+
+
+class FileSearchMapping:
+    """Subfields of the files index that answer leading-wildcard searches cheaper than the field itself.
+
+    A `wildcard` typed subfield is used, since it returns exactly what the wildcard query on the keyword returns. With
+    `ngram_rewrite`, a text subfield is used otherwise when the index settings show its analyzer returns the same
+    results for a `contain` search, see _exact_ngram_analyzers. The mapping is read once per worker; when it cannot be
+    read, searches run unrewritten and the mapping is fetched again after `retry_interval` seconds.
+    """
+
+    def __init__(self, es_index: str, retry_interval: float = 60, ngram_rewrite: bool = False):
+        self._logger = LoggerFactory('file_query_planner').get_logger()
+        self.es_index = es_index
+        self.retry_interval = retry_interval
+        self.ngram_rewrite = ngram_rewrite
+        self._subfields: Optional[ContainSubfields] = None
+        self._failed_at = 0.0
+
+    async def contain_subfields(self) -> ContainSubfields:
+        if self._subfields is not None:
+            return self._subfields
+        if time.monotonic() - self._failed_at < self.retry_interval:
+            return {}
+
+        try:
+            mapping = await get_mapping(self.es_index)
+            ngram_analyzers = _exact_ngram_analyzers(await get_settings(self.es_index)) if self.ngram_rewrite else {}
+        except Exception as e:
+            self._logger.warning(f'Failed to read the mapping of {self.es_index}: {e}')
+            self._failed_at = time.monotonic()
+            return {}
+
+        self._subfields = {}
+        for index_mapping in mapping.values():
+            for field, properties in index_mapping['mappings'].get('properties', {}).items():
+                subfield = _contain_subfield(properties.get('fields', {}), ngram_analyzers)
+                if subfield:
+                    self._subfields[field] = subfield
+        self._logger.info(f'Leading wildcard subfields of {self.es_index}: {self._subfields}')
+        return self._subfields
+
+    def invalidate(self) -> None:
+        self._subfields = None
+        self._failed_at = 0.0
+
+
+def _exact_ngram_analyzers(settings: dict) -> Dict[str, int]:
+    """Analyzers of the index settings for which match_phrase on a substring finds exactly the values containing it.
+
+    That holds for an ngram tokenizer with min_gram equal to max_gram that keeps every character, without char or
+    token filters: every gram is at the position of its offset, so the grams of the substring are consecutive exactly
+    where the value contains it, case included. Returns the gram size by analyzer name; a substring shorter than that
+    has no grams at all.
+    """
+    analyzers = {}
+    for index_settings in settings.values():
+        analysis = index_settings['settings'].get('index', {}).get('analysis', {})
+        tokenizers = analysis.get('tokenizer', {})
+        for name, analyzer in analysis.get('analyzer', {}).items():
+            if analyzer.get('type', 'custom') != 'custom' or analyzer.get('filter') or analyzer.get('char_filter'):
+                continue
+            tokenizer = tokenizers.get(analyzer.get('tokenizer'), {})
+            if tokenizer.get('type') not in ('ngram', 'nGram') or tokenizer.get('token_chars'):
+                continue
+            # the defaults of the ngram tokenizer
+            min_gram = int(tokenizer.get('min_gram', 1))
+            if min_gram == int(tokenizer.get('max_gram', 2)):
+                analyzers[name] = min_gram
+    return analyzers
+
+
+def _contain_subfield(subfields: dict, ngram_analyzers: Dict[str, int]) -> Optional[Tuple[str, str, int]]:
+    for name, properties in subfields.items():
+        if properties.get('type') == 'wildcard':
+            return name, 'wildcard', 0
+    for name, properties in subfields.items():
+        analyzer = properties.get('analyzer')
+        if (
+            properties.get('type') == 'text'
+            and analyzer in ngram_analyzers
+            and properties.get('search_analyzer', analyzer) == analyzer
+        ):
+            return name, 'ngram', ngram_analyzers[analyzer]
+    return None
+
+
+def _rewrite_wildcard(clause: dict, contain_subfields: ContainSubfields) -> dict:
+    ((field, pattern),) = clause['wildcard'].items()
+    if not isinstance(pattern, str) or not pattern.startswith('*') or field not in contain_subfields:
+        return clause
+
+    subfield, kind, min_length = contain_subfields[field]
+    if kind == 'wildcard':
+        return {'wildcard': {f'{field}.{subfield}': pattern}}
+
+    # an ngram subfield can only answer `contain` of a value with at least one gram and no wildcard or escape of its own
+    value = pattern[1:-1]
+    if pattern.endswith('*') and len(value) >= max(min_length, 1) and not any(char in value for char in '*?\\'):
+        return {'match_phrase': {f'{field}.{subfield}': value}}
+    return clause
+
+
+def plan_file_query(query: dict, contain_subfields: ContainSubfields) -> dict:
+    """Move the clauses of a compiled file query into filter context and route leading wildcards to subfields.
+
+    Results are always sorted by a field, so scoring is wasted work; filter clauses skip it and can be served from
+    the node query cache. The compiled query is shared and is not modified.
+    """
+
+    clauses = []
+    for clause in query['bool']['must']:
+        if 'wildcard' in clause:
+            clause = _rewrite_wildcard(clause, contain_subfields)
+        clauses.append(clause)
+    return {'bool': {'filter': clauses}}
@@ -0,0 +1,87 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import deque
+from typing import Deque
+from typing import List
+from typing import Optional
+
+from common import GEIDClient
+from common import LoggerFactory
+
+from app.config import ConfigClass
+
+
+class GEIDPool:
+    """Pre-generated global entity ids handed out without generating them on the request path.
+
+    Ids are generated in blocks of `block_size` in the default executor, so the event loop is never blocked by id
+    generation. A new block is requested in the background as soon as fewer than `low_water_mark` ids are left.
+    """
+
+    def __init__(self, block_size: int, low_water_mark: int):
+        self._logger = LoggerFactory('geid_pool').get_logger()
+        self.block_size = block_size
+        self.low_water_mark = low_water_mark
+        self._client = GEIDClient()
+        self._ids: Deque[str] = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    @property
+    def available(self) -> int:
+        return len(self._ids)
+
+    def start(self) -> None:
+        self._start_refill(0)
+
+    async def stop(self) -> None:
+        if self._refill_task is not None and not self._refill_task.done():
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        self._refill_task = None
+
+    async def get(self) -> str:
+        return (await self.take(1))[0]
+
+    async def take(self, count: int) -> List[str]:
+        while len(self._ids) < count:
+            await asyncio.shield(self._start_refill(count - len(self._ids)))
+
+        ids = [self._ids.popleft() for _ in range(count)]
+        if len(self._ids) < self.low_water_mark:
+            self._start_refill(0)
+        return ids
+
+    def _start_refill(self, missing: int) -> asyncio.Task:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._fill(self.block_size + missing))
+            self._refill_task.add_done_callback(self._log_failure)
+        return self._refill_task
+
+    async def _fill(self, count: int) -> None:
+        ids = await asyncio.get_running_loop().run_in_executor(None, self._client.get_GEID_bulk, count)
+        self._ids.extend(ids)
+        self._logger.debug(f'Generated {count} global entity ids')
+
+    def _log_failure(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self._logger.error(f'Failed to generate global entity ids: {task.exception()}')
+
+
+geid_pool = GEIDPool(ConfigClass.GEID_POOL_BLOCK_SIZE, ConfigClass.GEID_POOL_LOW_WATER_MARK)
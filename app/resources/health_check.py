@@ -12,38 +12,133 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import httpx
+
+import asyncio
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
 from common import LoggerFactory
 
 from app.config import ConfigClass
+from app.resources.http_client import atlas_client
+from app.resources.http_client import es_client
 
 logger = LoggerFactory('audit_trail_health_check').get_logger()
 
 
-async def atlas_check():
-    try:
-        admin_metrics_url = f'http://{ConfigClass.ATLAS_HOST}:{ConfigClass.ATLAS_PORT}/' + 'api/atlas/admin/metrics'
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(admin_metrics_url, auth=(ConfigClass.ATLAS_ADMIN, ConfigClass.ATLAS_PASSWD))
-            if response.status_code != 200:
-                raise Exception
-            logger.info('Atlas database connected successfully')
-            return True
-    except Exception as e:
-        logger.error(f'Can not connect to the Atlas database {e}')
-        return False
-
-
-async def es_check():
-    try:
-        ELASTIC_SEARCH_URL = f'http://{ConfigClass.ELASTIC_SEARCH_HOST}:{ConfigClass.ELASTIC_SEARCH_PORT}/'
-        elastic_health_url = ELASTIC_SEARCH_URL + '_cluster/health'
-        async with httpx.AsyncClient(verify=False) as client:
-            response = await client.get(elastic_health_url)
-            if response.status_code != 200:
-                raise Exception
-            logger.info('Elastic Search database connected successfully')
-            return True
-    except Exception as e:
-        logger.error(f'Can not connect to the Elastic Search database {e}')
-        return False
+async def atlas_check() -> None:
+    admin_metrics_url = f'http://{ConfigClass.ATLAS_HOST}:{ConfigClass.ATLAS_PORT}/' + 'api/atlas/admin/metrics'
+    response = await atlas_client.get().get(admin_metrics_url, timeout=ConfigClass.HEALTH_CHECK_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f'Atlas admin metrics returned {response.status_code}')
+
+
+async def es_check() -> None:
+    ELASTIC_SEARCH_URL = f'http://{ConfigClass.ELASTIC_SEARCH_HOST}:{ConfigClass.ELASTIC_SEARCH_PORT}/'
+    elastic_health_url = ELASTIC_SEARCH_URL + '_cluster/health'
+    response = await es_client.get().get(elastic_health_url, timeout=ConfigClass.HEALTH_CHECK_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f'Elastic Search cluster health returned {response.status_code}')
+
+
+class HealthMonitor:
+    """Runs dependency checks in the background and keeps the last result of each, so probes never wait on them.
+
+    Every `interval` seconds all checks run concurrently, each bounded by `timeout`; a check is healthy when it returns
+    without raising. When the last result is older than `max_age`, e.g. because the monitor is not running, the next
+    probe runs the checks itself.
+    """
+
+    def __init__(self, checks: Dict[str, Callable[[], Awaitable]], interval: float, timeout: float, max_age: float):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        self.max_age = max_age
+        self.results: Dict[str, dict] = {}
+        self._checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def reset(self) -> None:
+        self.results = {}
+        self._checked_at = None
+        self._lock = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    async def check(self) -> Dict[str, dict]:
+        results = await asyncio.gather(*(self._check(name, check) for name, check in self.checks.items()))
+        self.results = dict(zip(self.checks, results))
+        self._checked_at = time.monotonic()
+        return self.results
+
+    async def _check(self, name: str, check: Callable[[], Awaitable]) -> dict:
+        started = time.monotonic()
+        error = None
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f'timed out after {self.timeout}s'
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        healthy = error is None
+        previous = self.results.get(name)
+        if previous is None or previous['healthy'] != healthy:
+            if healthy:
+                logger.info(f'{name} connected successfully')
+            else:
+                logger.error(f'Can not connect to {name}: {error}')
+
+        return {
+            'healthy': healthy,
+            'checked_at': time.time(),
+            'latency': time.monotonic() - started,
+            'error': error,
+        }
+
+    async def current(self) -> Dict[str, dict]:
+        """The cached results, refreshed first when they are missing or older than max_age."""
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.max_age:
+            # created on first use, so it belongs to the running event loop
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._checked_at is None or time.monotonic() - self._checked_at > self.max_age:
+                    await self.check()
+        return self.results
+
+
+health_monitor = HealthMonitor(
+    {'atlas': atlas_check, 'elasticsearch': es_check},
+    ConfigClass.HEALTH_CHECK_INTERVAL,
+    ConfigClass.HEALTH_CHECK_TIMEOUT,
+    ConfigClass.HEALTH_CHECK_MAX_AGE,
+)
+
+
+async def dependencies_healthy() -> bool:
+    return all(result['healthy'] for result in (await health_monitor.current()).values())
+
+
+async def health_report(**_) -> dict:
+    return await health_monitor.current()
@@ -0,0 +1,209 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import httpx
+
+from app.config import ConfigClass
+from app.resources.metrics import metrics
+
+ES_OPERATIONS = [
+    ('/_bulk', 'bulk'),
+    ('/_update_by_query', 'update_by_query'),
+    ('/_update/', 'update'),
+    ('/_search', 'search'),
+    ('/_pit', 'pit'),
+    ('/_mapping', 'mapping'),
+    ('/_settings', 'settings'),
+    ('/_tasks/', 'task'),
+    ('/_cluster/health', 'health'),
+    ('/_doc', 'index'),
+]
+ATLAS_OPERATIONS = [
+    ('/lineage/', 'lineage'),
+    ('/search/', 'search'),
+    ('/entity/bulk', 'bulk'),
+    ('/admin/metrics', 'health'),
+]
+METADATA_OPERATIONS = [
+    ('/items/batch/', 'batch_get'),
+    ('/item/', 'get'),
+]
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Transport recording the latency and in-flight count of requests to a downstream service, by operation.
+
+    The operation is the first entry of `operations` whose path fragment is part of the request path. Otherwise a POST
+    or PUT to a path with no `_` endpoint (e.g. `/{index}/{type}` in Elasticsearch) is a `document_write_operation`,
+    when one is given. Latency is measured until the response headers are received.
+    """
+
+    def __init__(
+        self,
+        downstream: str,
+        transport: httpx.AsyncHTTPTransport,
+        operations: List[Tuple[str, str]],
+        document_write_operation: Optional[str] = None,
+    ):
+        self.downstream = downstream
+        self.transport = transport
+        self.operations = operations
+        self.document_write_operation = document_write_operation
+
+    @property
+    def _pool(self):
+        return self.transport._pool
+
+    def operation(self, request: httpx.Request) -> str:
+        path = request.url.path
+        for fragment, operation in self.operations:
+            if fragment in path:
+                return operation
+        if self.document_write_operation and request.method in ('POST', 'PUT'):
+            if not any(segment.startswith('_') for segment in path.split('/')):
+                return self.document_write_operation
+        return 'other'
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        labels = {'downstream': self.downstream, 'operation': self.operation(request)}
+        in_flight_labels = {'downstream': self.downstream}
+        status = 'error'
+        started = time.perf_counter()
+        metrics.add('audit_trail_downstream_requests_in_flight', in_flight_labels, 1)
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.add('audit_trail_downstream_requests_in_flight', in_flight_labels, -1)
+            metrics.observe(
+                'audit_trail_downstream_request_duration_seconds',
+                dict(labels, status=status),
+                time.perf_counter() - started,
+            )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class SharedHTTPClient:
+    """Pooled httpx.AsyncClient shared by every request handled in a worker.
+
+    The client is built lazily on first use, so it also works when the application startup hooks have not run (e.g. in
+    tests), and it is rebuilt if it has been closed.
+    """
+
+    _registry: List['SharedHTTPClient'] = []
+
+    def __init__(self, name: str, factory: Callable[[], httpx.AsyncClient]):
+        self.name = name
+        self._factory = factory
+        self._client: Optional[httpx.AsyncClient] = None
+        self._registry.append(self)
+
+    def get(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._factory()
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    def pool_gauges(self):
+        """Connection pool gauges of the client, if it has been built."""
+        if self._client is None or self._client.is_closed:
+            return []
+        pool = self._client._transport._pool
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        labels = {'downstream': self.name}
+        return [
+            ('audit_trail_http_pool_connections', dict(labels, state='active'), len(connections) - idle),
+            ('audit_trail_http_pool_connections', dict(labels, state='idle'), idle),
+            ('audit_trail_http_pool_max_connections', labels, pool._max_connections),
+            (
+                'audit_trail_http_pool_waiting_requests',
+                labels,
+                sum(1 for request in pool._requests if request.connection is None),
+            ),
+        ]
+
+
+def _build_es_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=ConfigClass.ELASTIC_SEARCH_MAX_CONNECTIONS,
+        max_keepalive_connections=ConfigClass.ELASTIC_SEARCH_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=ConfigClass.ELASTIC_SEARCH_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(ConfigClass.ELASTIC_SEARCH_TIMEOUT, connect=ConfigClass.ELASTIC_SEARCH_CONNECT_TIMEOUT)
+    transport = InstrumentedTransport(
+        'elasticsearch', httpx.AsyncHTTPTransport(verify=False, limits=limits), ES_OPERATIONS, 'index'
+    )
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def _build_atlas_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=ConfigClass.ATLAS_MAX_CONNECTIONS,
+        max_keepalive_connections=ConfigClass.ATLAS_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=ConfigClass.ATLAS_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(ConfigClass.ATLAS_TIMEOUT, connect=ConfigClass.ATLAS_CONNECT_TIMEOUT)
+    auth = (ConfigClass.ATLAS_ADMIN, ConfigClass.ATLAS_PASSWD)
+    transport = InstrumentedTransport('atlas', httpx.AsyncHTTPTransport(verify=False, limits=limits), ATLAS_OPERATIONS)
+    return httpx.AsyncClient(transport=transport, timeout=timeout, auth=auth)
+
+
+def _build_metadata_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=ConfigClass.METADATA_MAX_CONNECTIONS,
+        max_keepalive_connections=ConfigClass.METADATA_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=ConfigClass.METADATA_KEEPALIVE_EXPIRY,
+    )
+    transport = InstrumentedTransport(
+        'metadata', httpx.AsyncHTTPTransport(verify=False, limits=limits), METADATA_OPERATIONS
+    )
+    return httpx.AsyncClient(transport=transport, timeout=ConfigClass.METADATA_TIMEOUT)
+
+
+es_client = SharedHTTPClient('elasticsearch', _build_es_client)
+atlas_client = SharedHTTPClient('atlas', _build_atlas_client)
+metadata_client = SharedHTTPClient('metadata', _build_metadata_client)
+
+
+def _pool_gauges():
+    for shared_client in SharedHTTPClient._registry:
+        yield from shared_client.pool_gauges()
+
+
+metrics.register_collector(_pool_gauges)
+
+
+async def open_http_clients() -> None:
+    for shared_client in SharedHTTPClient._registry:
+        shared_client.get()
+
+
+async def close_http_clients() -> None:
+    for shared_client in SharedHTTPClient._registry:
+        await shared_client.close()
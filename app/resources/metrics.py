@@ -0,0 +1,276 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from common import LoggerFactory
+from starlette.routing import Match
+
+from app.config import ConfigClass
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'audit_trail_http_request_duration_seconds': ('histogram', 'Duration of requests handled by the service.'),
+    'audit_trail_http_requests_in_flight': ('gauge', 'Requests being handled by the service.'),
+    'audit_trail_downstream_request_duration_seconds': (
+        'histogram',
+        'Duration of requests to Elastic Search, Atlas and the metadata service, until response headers.',
+    ),
+    'audit_trail_downstream_requests_in_flight': ('gauge', 'Requests waiting on a downstream service.'),
+    'audit_trail_http_pool_connections': ('gauge', 'Connections in the pool of a downstream client, by state.'),
+    'audit_trail_http_pool_max_connections': ('gauge', 'Connection limit of the pool of a downstream client.'),
+    'audit_trail_http_pool_waiting_requests': ('gauge', 'Requests waiting for a connection of a downstream client.'),
+    'audit_trail_cache_hits_total': ('counter', 'Lookups answered by an in-memory cache, by cache.'),
+    'audit_trail_cache_misses_total': ('counter', 'Lookups not answered by an in-memory cache, by cache.'),
+    'audit_trail_cache_entries': ('gauge', 'Entries held by an in-memory cache, by cache.'),
+    'audit_trail_cache_max_entries': ('gauge', 'Entry limit of an in-memory cache, by cache.'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    rendered = ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels)
+    return f'{{{rendered}}}' if rendered else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics:
+    """Histograms and gauges of one worker, rendered in the Prometheus text format.
+
+    With `multiproc_dir` set, every worker writes a snapshot of its metrics to `<multiproc_dir>/<pid>.json` every
+    `write_interval` seconds and the worker answering a scrape merges the snapshots of all workers: histograms are
+    summed over every worker that ever wrote one, gauges only over workers that are still alive.
+    """
+
+    def __init__(
+        self,
+        multiproc_dir: Optional[str] = None,
+        write_interval: float = 1.0,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self._logger = LoggerFactory('metrics').get_logger()
+        self.multiproc_dir = multiproc_dir
+        self.write_interval = write_interval
+        self.buckets = buckets
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, dict, float]]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, name: str, labels: dict, value: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def add(self, name: str, labels: dict, amount: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, dict, float]]]) -> None:
+        """Add a callable returning (name, labels, value) gauges computed when a snapshot is taken."""
+        self._collectors.append(collector)
+
+    def register_cache(self, cache_name: str, info: Callable[[], dict]) -> None:
+        """Report the hits, misses, size and maxsize returned by the `info` of an in-memory cache."""
+
+        def collect():
+            stats = info()
+            labels = {'cache': cache_name}
+            return [
+                ('audit_trail_cache_hits_total', labels, stats['hits']),
+                ('audit_trail_cache_misses_total', labels, stats['misses']),
+                ('audit_trail_cache_entries', labels, stats['size']),
+                ('audit_trail_cache_max_entries', labels, stats['maxsize']),
+            ]
+
+        self.register_collector(collect)
+
+    def snapshot(self) -> dict:
+        gauges = [[name, list(labels), value] for (name, labels), value in self._gauges.items()]
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges.append([name, sorted(labels.items()), value])
+        histograms = [
+            [name, list(labels), counts, total, count]
+            for (name, labels), (counts, total, count) in self._histograms.items()
+        ]
+        return {'pid': os.getpid(), 'histograms': histograms, 'gauges': gauges}
+
+    def clear(self) -> None:
+        self._histograms.clear()
+        self._gauges.clear()
+
+    def start(self) -> None:
+        if self.multiproc_dir and (self._task is None or self._task.done()):
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self.write_snapshot()
+            except OSError:
+                self._logger.exception('Failed to write metrics snapshot')
+            await asyncio.sleep(self.write_interval)
+
+    def write_snapshot(self) -> None:
+        path = os.path.join(self.multiproc_dir, f'{os.getpid()}.json')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file)
+        os.replace(temporary_path, path)
+
+    def _read_snapshots(self) -> List[dict]:
+        self.write_snapshot()
+        snapshots = []
+        for file_name in sorted(os.listdir(self.multiproc_dir)):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.multiproc_dir, file_name), encoding='utf-8') as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (OSError, ValueError):
+                self._logger.warning(f'Skipping unreadable metrics snapshot {file_name}')
+        return snapshots
+
+    def render(self) -> str:
+        snapshots = self._read_snapshots() if self.multiproc_dir else [self.snapshot()]
+
+        histograms: Dict[Tuple[str, Labels], list] = {}
+        gauges: Dict[Tuple[str, Labels], float] = {}
+        for snapshot in snapshots:
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [left + right for left, right in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+            if snapshot['pid'] != os.getpid() and not _pid_alive(snapshot['pid']):
+                continue
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(tuple(label) for label in labels))
+                gauges[key] = gauges.get(key, 0) + value
+
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'histogram':
+                lines.extend(self._render_histograms(name, histograms))
+            else:
+                for (gauge_name, labels), value in sorted(gauges.items()):
+                    if gauge_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, name: str, histograms: Dict[Tuple[str, Labels], list]) -> List[str]:
+        lines = []
+        for (histogram_name, labels), (counts, total, count) in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+metrics = Metrics(ConfigClass.METRICS_MULTIPROC_DIR, ConfigClass.METRICS_WRITE_INTERVAL)
+
+
+def route_template(scope: dict) -> str:
+    """Path template of the route matching a request, so metrics are labelled per route rather than per URL."""
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the duration and in-flight count of every HTTP request, by route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        labels = {'method': scope['method'], 'route': route_template(scope)}
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.add('audit_trail_http_requests_in_flight', labels, 1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.add('audit_trail_http_requests_in_flight', labels, -1)
+            metrics.observe(
+                'audit_trail_http_request_duration_seconds',
+                dict(labels, status=str(status['code'])),
+                time.perf_counter() - started,
+            )
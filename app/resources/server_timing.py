@@ -0,0 +1,66 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from contextvars import ContextVar
+from typing import Dict
+from typing import Optional
+
+from app.config import ConfigClass
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('server_timings', default=None)
+
+
+def record_timing(name: str, duration_ms: float):
+    """Add a duration to the Server-Timing header of the current request; a no-op outside of ServerTimingMiddleware.
+
+    Durations recorded under the same name, e.g. by several elastic search calls of one request, are summed.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + duration_ms
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ', '.join(f'{name};dur={duration:.1f}' for name, duration in timings.items())
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding the durations recorded with record_timing to the response as a Server-Timing header.
+
+    Only active with SERVER_TIMING_ENABLED, since the header exposes backend timings to every client.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not ConfigClass.SERVER_TIMING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+
+        async def send_with_timings(message):
+            if message['type'] == 'http.response.start' and timings:
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', format_server_timing(timings).encode('latin-1')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _timings.reset(token)
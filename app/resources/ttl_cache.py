@@ -0,0 +1,92 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Tuple
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU of at most maxsize entries that expire ttl seconds after they were set, with hit and miss counters.
+
+    Entries set with set_negative expire after negative_ttl instead; with negative_ttl of 0 they are not stored, which
+    disables negative caching.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float = 0, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, float]]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value, or MISSING when there is no live entry."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > self._clock():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+
+        self.misses += 1
+        return MISSING
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether key has a live entry, without touching the counters or the LRU order."""
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] > self._clock()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._store(key, value, self.ttl)
+
+    def set_negative(self, key: Hashable, value: Any = None) -> None:
+        if self.negative_ttl > 0:
+            self._store(key, value, self.negative_ttl)
+
+    def _store(self, key: Hashable, value: Any, ttl: float) -> None:
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (value, self._clock() + ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def invalidate_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches predicate and return how many were dropped."""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
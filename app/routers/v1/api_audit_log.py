@@ -13,32 +13,55 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import time
 from datetime import datetime
 from datetime import timedelta
+from functools import partial
+from typing import List
 from typing import Optional
 
-from common import GEIDClient
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Query
+from fastapi.responses import StreamingResponse
 from fastapi_utils import cbv
 
+from app.config import ConfigClass
 from app.models.base_models import APIResponse
+from app.models.base_models import CursorAPIResponse
 from app.models.base_models import EAPIResponseCode
+from app.models.models_audit_log import ES_TYPE
 from app.models.models_audit_log import AuditLogCreation
 from app.models.models_audit_log import AuditLogQuery
+from app.models.models_audit_log import EAuditLogGroupBy
+from app.models.models_audit_log import ECalendarInterval
+from app.resources.audit_log_export import EXPORT_MEDIA_TYPES
+from app.resources.audit_log_export import EExportFormat
+from app.resources.audit_log_export import export_audit_logs
+from app.resources.audit_log_spool import audit_log_spool
+from app.resources.audit_log_writer import audit_log_writer
+from app.resources.cursor_pagination import InvalidCursor
+from app.resources.cursor_pagination import search_with_cursor
 from app.resources.error_handler import catch_internal
+from app.resources.es_aggregation import aggregation_levels
+from app.resources.es_aggregation import build_aggregations
+from app.resources.es_aggregation import flatten_buckets
+from app.resources.es_helper import ESRequestError
+from app.resources.es_helper import aggregate
+from app.resources.es_helper import bulk
 from app.resources.es_helper import exact_search
 from app.resources.es_helper import insert_one
+from app.resources.es_helper import lean_hits
+from app.resources.es_helper import source_filter
+from app.resources.geid_pool import geid_pool
 
 router = APIRouter()
 
 _API_TAG = 'Audit-logs'
 _API_NAMESPACE = 'api_audit_log'
 
-ES_TYPE = 'operation_logs'
-
 
 @cbv.cbv(router)
 class APIAuditLog:
@@ -50,19 +73,16 @@ class APIAuditLog:
     async def audit_log_creation(self, request_payload: AuditLogCreation):
         response = APIResponse()
 
-        action = request_payload.action
-        operator = request_payload.operator
-        target = request_payload.target
-        outcome = request_payload.outcome
         project_code = request_payload.project_code
-        display_name = request_payload.display_name
         resource = request_payload.resource
-        extra_info = request_payload.extra
 
         self.__logger.debug(f'Project of Audit log Creation: {project_code}')
-        self.__logger.debug(f'Params of Audit log Creation: {action}, {operator}, {target}, {outcome}, {resource}')
-        client = GEIDClient()
-        geid = client.get_GEID()
+        self.__logger.debug(
+            'Params of Audit log Creation: '
+            f'{request_payload.action}, {request_payload.operator}, {request_payload.target}, '
+            f'{request_payload.outcome}, {resource}'
+        )
+        geid = await geid_pool.get()
 
         self.__logger.debug(f'Geid of Audit log Creation: {geid}')
 
@@ -72,20 +92,27 @@ class APIAuditLog:
             return response
 
         # insert an new audit log into elastic search
-        data = {
-            'target': target,
-            'outcome': outcome,
-            'displayName': display_name,
-            'operator': operator,
-            'action': action,
-            'projectCode': project_code,
-            'createdTime': time.time(),
-            'geid': geid,
-            'resource': resource,
-        }
-
-        for key in extra_info:
-            data[key] = extra_info[key]
+        data = build_audit_log_document(request_payload, geid)
+
+        if ConfigClass.AUDIT_LOG_SPOOL_ENABLED:
+            audit_log_spool.start()
+            await audit_log_spool.append(resource, data)
+            response.code = EAPIResponseCode.accepted
+            response.result = {'geid': geid, 'result': 'spooled'}
+            return response.json_response()
+
+        if ConfigClass.AUDIT_LOG_WRITE_BEHIND_ENABLED:
+            try:
+                audit_log_writer.enqueue(resource, data)
+            except asyncio.QueueFull:
+                self.__logger.warning('Audit log queue is full')
+                response.code = EAPIResponseCode.service_unavailable
+                response.error_msg = 'Audit log queue is full, retry later'
+                return response.json_response()
+
+            response.code = EAPIResponseCode.accepted
+            response.result = {'geid': geid, 'result': 'queued'}
+            return response.json_response()
 
         res = await insert_one(ES_TYPE, resource, data)
         self.__logger.debug(f'Response is: {res}')
@@ -101,61 +128,245 @@ class APIAuditLog:
 
         return response.json_response()
 
-    @router.get('/audit-logs', tags=[_API_TAG], summary='Get audit logs')
+    @router.post('/audit-logs/batch', tags=[_API_TAG], summary='Create audit logs in a single bulk request')
     @catch_internal(_API_NAMESPACE)
-    async def audit_log_query(
+    async def audit_log_batch_creation(self, request_payload: List[AuditLogCreation]):
+        response = APIResponse()
+
+        if not request_payload:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = 'No audit logs to create'
+            return response.json_response()
+
+        if len(request_payload) > ConfigClass.AUDIT_LOG_BATCH_MAX_SIZE:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = f'Too many audit logs in one batch, maximum is {ConfigClass.AUDIT_LOG_BATCH_MAX_SIZE}'
+            return response.json_response()
+
+        geids = await geid_pool.take(len(request_payload))
+        self.__logger.debug(f'Number of Audit logs in batch: {len(geids)}')
+
+        actions = []
+        for item, geid in zip(request_payload, geids):
+            action = {'index': {'_index': item.resource, '_type': ES_TYPE}}
+            actions.append((action, build_audit_log_document(item, geid)))
+
+        res = await bulk(actions)
+        self.__logger.debug(f'Bulk response is: {res}')
+
+        if 'items' not in res:
+            self.__logger.debug('Result of Audit log batch Creation: Failed')
+            response.code = EAPIResponseCode.internal_error
+            response.result = 'failed to insert audit logs into elastic search'
+            return response.json_response()
+
+        results = []
+        for item, geid in zip(res['items'], geids):
+            outcome = item['index']
+            results.append(
+                {
+                    'geid': geid,
+                    'status': outcome['status'],
+                    'result': outcome.get('result'),
+                    'error': outcome.get('error'),
+                }
+            )
+
+        if res['errors']:
+            failed = sum(1 for result in results if result['error'])
+            self.__logger.debug(f'Result of Audit log batch Creation: {failed} failed')
+            response.error_msg = f'{failed} of {len(results)} audit logs failed to insert'
+
+        response.code = EAPIResponseCode.success
+        response.result = results
+        response.total = len(results)
+
+        return response.json_response()
+
+    @router.get('/audit-logs/queue', tags=[_API_TAG], summary='Get write-behind queue statistics')
+    @catch_internal(_API_NAMESPACE)
+    async def audit_log_queue_stats(self):
+        response = APIResponse()
+        response.code = EAPIResponseCode.success
+        response.result = audit_log_writer.stats()
+        response.result['spool'] = audit_log_spool.stats()
+        return response.json_response()
+
+    @router.get('/audit-logs/export', tags=[_API_TAG], summary='Stream all matching audit logs as NDJSON or CSV')
+    @catch_internal(_API_NAMESPACE)
+    async def audit_log_export(
         self,
         query: dict = Depends(AuditLogQuery),
-        page: Optional[int] = 0,
-        page_size: Optional[int] = 10,
+        export_format: EExportFormat = EExportFormat.ndjson,
+        compress: Optional[bool] = False,
         sort_by: Optional[str] = 'createdTime',
-        sort_type: Optional[str] = 'desc',
+        sort_type: Optional[str] = 'asc',
     ):
-        today_date = datetime.now().date()
-        today_datetime = datetime.combine(today_date, datetime.min.time())
+        queries = dict(query)
+        resource = queries['resource']
+        params = build_audit_log_params(queries)
+        self.__logger.info(f'Exporting audit logs of {resource} as {export_format.value}: {params}')
 
-        queries = {}
+        headers = {'Content-Disposition': f'attachment; filename="audit-logs-{resource}.{export_format.value}"'}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
 
-        for item in query:
-            queries[item[0]] = item[1]
+        try:
+            body = await export_audit_logs(resource, params, export_format, compress, sort_by, sort_type)
+        except ESRequestError as e:
+            self.__logger.error(f'Failed to export audit logs of {resource}: {e}')
+            response = APIResponse()
+            response.code = EAPIResponseCode.not_found if e.status_code == 404 else EAPIResponseCode.internal_error
+            response.error_msg = f'Failed to export audit logs of {resource}: {e.error}'
+            return response.json_response()
+
+        return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
+
+    @router.get('/audit-logs/stats', tags=[_API_TAG], summary='Count audit logs per time bucket and field values')
+    @catch_internal(_API_NAMESPACE)
+    async def audit_log_stats(
+        self,
+        query: dict = Depends(AuditLogQuery),
+        group_by: List[EAuditLogGroupBy] = Query([]),
+        interval: Optional[ECalendarInterval] = None,
+        bucket_size: int = Query(
+            100, description='Buckets per group_by field, at most AUDIT_LOG_STATS_MAX_BUCKET_SIZE'
+        ),
+    ):
+        """Return bucket counts only, e.g. uploads per day per operator with interval=day&group_by=operator."""
+        response = APIResponse()
+        max_bucket_size = ConfigClass.AUDIT_LOG_STATS_MAX_BUCKET_SIZE
+        if not 1 <= bucket_size <= max_bucket_size:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = f'bucket_size must be between 1 and {max_bucket_size}'
+            return response.json_response()
 
-        start_date = queries['start_date']
-        end_date = queries['end_date']
-        project_code = queries['project_code']
-        action = queries['action']
-        operator = queries['operator']
+        queries = dict(query)
         resource = queries['resource']
+        params = build_audit_log_params(queries)
 
-        if not start_date:
-            start_date = int(today_datetime.timestamp())
-        if not end_date:
-            end_datetime = datetime.combine(today_date + timedelta(days=1), datetime.min.time())
-            end_date = int(end_datetime.timestamp())
+        fields = [field.value for field in group_by]
+        interval = interval.value if interval else None
+        aggregations = build_aggregations(fields, bucket_size, 'createdTime', interval)
 
-        # get audit logs from elastic search
-        params = {
-            'createdTime': [start_date, end_date],
-            'projectCode': project_code,
-        }
+        if not aggregations:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = 'At least one of interval or group_by is required'
+            return response.json_response()
 
-        try:
-            # for actions, we might have the `all` keyword to fetch all 4 actions.
-            if action == 'all':
-                params['action'] = ['data_upload', 'data_download', 'data_transfer', 'data_delete']
-            elif action:
-                params['action'] = [action]
+        res = await aggregate(ES_TYPE, resource, params, aggregations)
+        if 'aggregations' not in res:
+            self.__logger.error(f'Failed to aggregate audit logs: {res}')
+            response.code = EAPIResponseCode.internal_error
+            response.result = 'failed to aggregate audit logs in elastic search'
+            return response.json_response()
+
+        response.code = EAPIResponseCode.success
+        response.result = flatten_buckets(res['aggregations'], aggregation_levels(fields, 'createdTime', interval))
+        response.total = res['hits']['total']['value']
+
+        return response.json_response()
+
+    @router.get('/audit-logs', tags=[_API_TAG], summary='Get audit logs')
+    @catch_internal(_API_NAMESPACE)
+    async def audit_log_query(
+        self,
+        query: dict = Depends(AuditLogQuery),
+        page: Optional[int] = 0,
+        page_size: Optional[int] = 10,
+        sort_by: Optional[str] = 'createdTime',
+        sort_type: Optional[str] = 'desc',
+        cursor: Optional[str] = None,
+        paginate_by_cursor: Optional[bool] = False,
+        fields: Optional[str] = None,
+        exclude: Optional[str] = None,
+        lean: Optional[bool] = False,
+    ):
+        """Page with page/page_size, or with an opaque cursor when paginate_by_cursor is set or a cursor is given.
 
-            if operator:
-                params['operator'] = operator
+        `fields` and `exclude` are comma separated source fields to return or leave out. With `lean` each hit is reduced
+        to its id and source.
+        """
+        source = source_filter(fields, exclude)
+        queries = dict(query)
+        resource = queries['resource']
+        params = build_audit_log_params(queries)
 
-            res = await exact_search(ES_TYPE, resource, page, page_size, params, sort_by, sort_type)
+        try:
+            next_cursor = None
+            if cursor or paginate_by_cursor:
+                search = partial(
+                    exact_search, ES_TYPE, resource, 0, page_size, params, sort_by, sort_type, source=source
+                )
+                res, next_cursor = await search_with_cursor(resource, cursor, page_size, search)
+            else:
+                res = await exact_search(ES_TYPE, resource, page, page_size, params, sort_by, sort_type, source=source)
 
+        except InvalidCursor as e:
+            response = APIResponse()
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = str(e)
+            return response.json_response()
         except Exception:
             self.__logger.exception('Error while querying elastic search service.')
 
-        response = APIResponse()
+        response = CursorAPIResponse()
         response.code = EAPIResponseCode.success
-        response.result = res['hits']['hits']
+        response.result = lean_hits(res['hits']['hits']) if lean else res['hits']['hits']
         response.total = res['hits']['total']['value']
+        response.next_cursor = next_cursor
 
         return response.json_response()
+
+
+def build_audit_log_params(queries: dict) -> dict:
+    """Translate audit log query fields into the filters used by exact_search; dates default to today."""
+    today_date = datetime.now().date()
+    today_datetime = datetime.combine(today_date, datetime.min.time())
+
+    start_date = queries['start_date']
+    end_date = queries['end_date']
+    action = queries['action']
+    operator = queries['operator']
+
+    if not start_date:
+        start_date = int(today_datetime.timestamp())
+    if not end_date:
+        end_datetime = datetime.combine(today_date + timedelta(days=1), datetime.min.time())
+        end_date = int(end_datetime.timestamp())
+
+    params = {
+        'createdTime': [start_date, end_date],
+        'projectCode': queries['project_code'],
+    }
+
+    # for actions, we might have the `all` keyword to fetch all 4 actions.
+    if action == 'all':
+        params['action'] = ['data_upload', 'data_download', 'data_transfer', 'data_delete']
+    elif action:
+        params['action'] = [action]
+
+    if operator:
+        params['operator'] = operator
+
+    return params
+
+
+def build_audit_log_document(request_payload: AuditLogCreation, geid: str) -> dict:
+    """Turn an audit log creation payload into the document stored in elastic search."""
+    data = {
+        'target': request_payload.target,
+        'outcome': request_payload.outcome,
+        'displayName': request_payload.display_name,
+        'operator': request_payload.operator,
+        'action': request_payload.action,
+        'projectCode': request_payload.project_code,
+        'createdTime': time.time(),
+        'geid': geid,
+        'resource': request_payload.resource,
+    }
+
+    for key in request_payload.extra:
+        data[key] = request_payload.extra[key]
+
+    return data
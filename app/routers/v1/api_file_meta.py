@@ -13,21 +13,40 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
+import time
+from functools import partial
+from typing import List
 from typing import Optional
 
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi_utils import cbv
 
+from app.config import ConfigClass
 from app.models.base_models import APIResponse
+from app.models.base_models import CursorAPIResponse
 from app.models.base_models import EAPIResponseCode
+from app.models.models_file_meta import EFileBatchOperation
 from app.models.models_file_meta import FileMetaCreation
 from app.models.models_file_meta import FileMetaUpdate
+from app.models.models_file_meta import FileMetaUpdateByQuery
+from app.resources.cursor_pagination import InvalidCursor
+from app.resources.cursor_pagination import search_with_cursor
 from app.resources.error_handler import catch_internal
+from app.resources.es_helper import bulk_chunked
 from app.resources.es_helper import file_search
+from app.resources.es_helper import get_task
 from app.resources.es_helper import insert_one_by_id
+from app.resources.es_helper import lean_hits
+from app.resources.es_helper import source_filter
+from app.resources.es_helper import update_by_query
 from app.resources.es_helper import update_one_by_id
+from app.resources.file_query_compiler import InvalidFileQuery
+from app.resources.file_query_compiler import compile_file_query
+from app.resources.file_query_compiler import compile_file_query_string
+from app.resources.file_query_planner import FileSearchMapping
+from app.resources.file_query_planner import plan_file_query
+from app.resources.server_timing import record_timing
 
 router = APIRouter()
 
@@ -36,6 +55,70 @@ _API_NAMESPACE = 'api_file_entity'
 
 ES_INDEX = 'files'
 
+file_search_mapping = FileSearchMapping(ES_INDEX, ngram_rewrite=ConfigClass.FILE_QUERY_NGRAM_REWRITE_ENABLED)
+
+# parameterised so elastic search compiles the script once for every update by query
+UPDATE_FIELDS_SCRIPT = 'for (entry in params.fields.entrySet()) { ctx._source[entry.getKey()] = entry.getValue(); }'
+
+
+def build_file_document(request_payload: FileMetaCreation) -> dict:
+    return {
+        'zone': request_payload.zone,
+        'data_type': request_payload.data_type,
+        'operator': request_payload.operator,
+        'tags': request_payload.tags,
+        'archived': request_payload.archived,
+        'location': request_payload.location,
+        'time_lastmodified': request_payload.time_lastmodified,
+        'time_created': request_payload.time_created,
+        'process_pipeline': request_payload.process_pipeline,
+        'uploader': request_payload.uploader,
+        'file_name': request_payload.file_name,
+        'file_size': request_payload.file_size,
+        'atlas_guid': request_payload.atlas_guid,
+        'display_path': request_payload.display_path,
+        'attributes': request_payload.attributes,
+        'project_code': request_payload.project_code,
+        'priority': request_payload.priority,
+        'version': request_payload.version,
+    }
+
+
+def build_updated_fields(updated_fields: dict) -> dict:
+    if 'time_lastmodified' in updated_fields:
+        updated_fields['time_lastmodified'] = int(updated_fields['time_lastmodified'])
+    return updated_fields
+
+
+def build_batch_results(request_payload: list, bulk_response: dict, operation: str) -> list:
+    """Pair the items of a bulk response with the global entity ids of the request, in request order."""
+    results = []
+    for item, outcome in zip(request_payload, bulk_response['items']):
+        outcome = outcome[operation]
+        results.append(
+            {
+                'global_entity_id': item.global_entity_id,
+                'status': outcome['status'],
+                'result': outcome.get('result'),
+                'error': outcome.get('error'),
+            }
+        )
+    return results
+
+
+def check_batch_size(request_payload: list, response: APIResponse) -> bool:
+    if not request_payload:
+        response.code = EAPIResponseCode.bad_request
+        response.error_msg = 'No file entities in batch'
+        return False
+
+    if len(request_payload) > ConfigClass.FILE_META_BATCH_MAX_SIZE:
+        response.code = EAPIResponseCode.bad_request
+        response.error_msg = f'Too many file entities in one batch, maximum is {ConfigClass.FILE_META_BATCH_MAX_SIZE}'
+        return False
+
+    return True
+
 
 @cbv.cbv(router)
 class APIAuditLog:
@@ -50,47 +133,9 @@ class APIAuditLog:
         self.__logger.info(f'file creation payload: {str(request_payload)}')
 
         global_entity_id = request_payload.global_entity_id
-        zone = request_payload.zone
-        data_type = request_payload.data_type
-        operator = request_payload.operator
-        tags = request_payload.tags
-        archived = request_payload.archived
-        location = request_payload.location
-        time_lastmodified = request_payload.time_lastmodified
-        time_created = request_payload.time_created
-        process_pipeline = request_payload.process_pipeline
-        uploader = request_payload.uploader
-        file_name = request_payload.file_name
-        file_size = request_payload.file_size
-        atlas_guid = request_payload.atlas_guid
-        display_path = request_payload.display_path
-        attributes = request_payload.attributes
-        project_code = request_payload.project_code
-        priority = request_payload.priority
-        version = request_payload.version
-
-        self.__logger.info(f'Project of File Meta Creation: {project_code}')
-
-        data = {
-            'zone': zone,
-            'data_type': data_type,
-            'operator': operator,
-            'tags': tags,
-            'archived': archived,
-            'location': location,
-            'time_lastmodified': time_lastmodified,
-            'time_created': time_created,
-            'process_pipeline': process_pipeline,
-            'uploader': uploader,
-            'file_name': file_name,
-            'file_size': file_size,
-            'atlas_guid': atlas_guid,
-            'display_path': display_path,
-            'attributes': attributes,
-            'project_code': project_code,
-            'priority': priority,
-            'version': version,
-        }
+        self.__logger.info(f'Project of File Meta Creation: {request_payload.project_code}')
+
+        data = build_file_document(request_payload)
 
         res = await insert_one_by_id('_doc', ES_INDEX, data, global_entity_id)
 
@@ -105,96 +150,89 @@ class APIAuditLog:
 
         return response
 
+    @router.post('/entity/file/batch', tags=[_API_TAG], summary='Create or replace file entities in bulk')
+    @catch_internal(_API_NAMESPACE)
+    async def file_meta_batch_creation(
+        self, request_payload: List[FileMetaCreation], op_type: EFileBatchOperation = EFileBatchOperation.index
+    ):
+        response = APIResponse()
+
+        if not check_batch_size(request_payload, response):
+            return response.json_response()
+
+        self.__logger.info(f'Number of file entities in batch: {len(request_payload)}')
+
+        actions = []
+        for item in request_payload:
+            action = {op_type.value: {'_index': ES_INDEX, '_id': item.global_entity_id}}
+            actions.append((action, build_file_document(item)))
+
+        res = await bulk_chunked(actions)
+        results = build_batch_results(request_payload, res, op_type.value)
+
+        if res['errors']:
+            failed = sum(1 for result in results if result['error'])
+            self.__logger.error(f'Result of Filemeta batch Creation: {failed} failed')
+            response.error_msg = f'{failed} of {len(results)} file entities failed to index'
+
+        response.code = EAPIResponseCode.success
+        response.result = results
+        response.total = len(results)
+
+        return response.json_response()
+
     @router.get('/entity/file', tags=[_API_TAG], summary='Search file entities in elastic search')
     @catch_internal(_API_NAMESPACE)
-    async def file_meta_query(  # noqa: C901
+    async def file_meta_query(
         self,
         query: str,
         page: Optional[int] = 0,
         page_size: Optional[int] = 10,
         sort_by: Optional[str] = 'time_created',
         sort_type: Optional[str] = 'desc',
+        cursor: Optional[str] = None,
+        paginate_by_cursor: Optional[bool] = False,
+        fields: Optional[str] = None,
+        exclude: Optional[str] = None,
+        lean: Optional[bool] = False,
     ):
-        response = APIResponse()
-        queries = json.loads(query)
-
-        search_params = []
-
-        for key in queries:
-            if key == 'attributes':
-                filed_params = {
-                    'nested': True,
-                    'field': 'attributes',
-                    'range': False,
-                    'name': queries['attributes']['name'],
-                    'multi_values': False,
-                }
-
-                search_params.append(filed_params)
-
-                if 'attributes' in queries['attributes']:
-                    for record in queries['attributes']['attributes']:
-                        filed_params = {
-                            'nested': True,
-                            'field': 'attributes',
-                            'range': False,
-                            'name': queries['attributes']['name'],
-                            'multi_values': False,
-                        }
-
-                        filed_params['attribute_name'] = record['attribute_name']
-
-                        if record['type'] == 'text':
-                            if record['condition'] == 'contain':
-                                filed_params['value'] = '*{}*'.format(record['value'])
-                                filed_params['search_type'] = 'wildcard'
-                            else:
-                                filed_params['value'] = record['value']
-                                filed_params['search_type'] = 'match'
-                        else:
-                            if record['condition'] == 'contain':
-                                filed_params['search_type'] = 'should'
-                            else:
-                                filed_params['search_type'] = 'must'
-
-                            filed_params['value'] = record['value']
-                            filed_params['multi_values'] = True
-
-                        search_params.append(filed_params)
-
-            elif key == 'time_created' or key == 'file_size':
-                filed_params = {
-                    'nested': False,
-                    'field': key,
-                    'range': queries[key]['value'],
-                    'multi_values': False,
-                    'search_type': queries[key]['condition'],
-                }
-                search_params.append(filed_params)
-            elif key == 'tags':
-                filed_params = {'nested': False, 'field': key, 'range': False, 'multi_values': True}
-                if queries['tags']['condition'] == 'contain':
-                    filed_params['search_type'] = 'should'
-                else:
-                    filed_params['search_type'] = 'must'
-                filed_params['value'] = queries['tags']['value']
-                search_params.append(filed_params)
-            else:
-                filed_params = {
-                    'nested': False,
-                    'field': key,
-                    'range': False,
-                    'multi_values': False,
-                    'value': queries[key]['value'],
-                    'search_type': queries[key]['condition'],
-                }
-                search_params.append(filed_params)
-        res = await file_search(ES_INDEX, page, page_size, search_params, sort_by, sort_type)
+        """Page with page/page_size, or with an opaque cursor when paginate_by_cursor is set or a cursor is given.
+
+        `fields` and `exclude` are comma separated source fields to return or leave out. With `lean` each hit is reduced
+        to its id and source.
+        """
+        source = source_filter(fields, exclude)
+        response = CursorAPIResponse()
+        started = time.perf_counter()
+        try:
+            search_query = compile_file_query_string(query)
+        except InvalidFileQuery as e:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = str(e)
+            return response.json_response()
+        record_timing('dsl', (time.perf_counter() - started) * 1000)
+
+        if ConfigClass.FILE_QUERY_PLANNING_ENABLED:
+            subfields = await file_search_mapping.contain_subfields()
+            started = time.perf_counter()
+            search_query = plan_file_query(search_query, subfields)
+            record_timing('dsl', (time.perf_counter() - started) * 1000)
+
+        if cursor or paginate_by_cursor:
+            search = partial(file_search, ES_INDEX, 0, page_size, search_query, sort_by, sort_type, source=source)
+            try:
+                res, response.next_cursor = await search_with_cursor(ES_INDEX, cursor, page_size, search)
+            except InvalidCursor as e:
+                response.code = EAPIResponseCode.bad_request
+                response.error_msg = str(e)
+                return response.json_response()
+        else:
+            res = await file_search(ES_INDEX, page, page_size, search_query, sort_by, sort_type, source=source)
         self.__logger.info(f'Response is: {res}')
         response.code = EAPIResponseCode.success
-        response.result = res['hits']['hits']
+        response.result = lean_hits(res['hits']['hits']) if lean else res['hits']['hits']
         response.total = res['hits']['total']['value']
-        return response
+        return response.json_response()
 
     @router.put('/entity/file', tags=[_API_TAG], summary='Update a file entity in elastic search')
     @catch_internal(_API_NAMESPACE)
@@ -202,10 +240,7 @@ class APIAuditLog:
         response = APIResponse()
 
         global_entity_id = request_payload.global_entity_id
-        updated_fields = request_payload.updated_fields
-
-        if 'time_lastmodified' in updated_fields:
-            updated_fields['time_lastmodified'] = int(updated_fields['time_lastmodified'])
+        updated_fields = build_updated_fields(request_payload.updated_fields)
 
         res = await update_one_by_id(ES_INDEX, global_entity_id, updated_fields)
         self.__logger.debug(f'UPdate response is:{res}')
@@ -221,3 +256,116 @@ class APIAuditLog:
             response.result = 'Faied to Update Filemeta in elastic search'
 
         return response.json_response()
+
+    @router.put('/entity/file/batch', tags=[_API_TAG], summary='Update file entities in bulk')
+    @catch_internal(_API_NAMESPACE)
+    async def file_meta_batch_update(self, request_payload: List[FileMetaUpdate]):
+        response = APIResponse()
+
+        if not check_batch_size(request_payload, response):
+            return response.json_response()
+
+        self.__logger.info(f'Number of file entities to update in batch: {len(request_payload)}')
+
+        actions = []
+        for item in request_payload:
+            action = {
+                'update': {
+                    '_index': ES_INDEX,
+                    '_id': item.global_entity_id,
+                    'retry_on_conflict': ConfigClass.FILE_META_UPDATE_RETRY_ON_CONFLICT,
+                }
+            }
+            actions.append((action, {'doc': build_updated_fields(item.updated_fields)}))
+
+        res = await bulk_chunked(actions)
+        results = build_batch_results(request_payload, res, 'update')
+
+        for result in results:
+            # same as the single update, an unchanged document is reported as updated
+            if result['result'] == 'noop':
+                result['result'] = 'updated'
+
+        if res['errors']:
+            failed = sum(1 for result in results if result['error'])
+            self.__logger.error(f'Result of Filemeta batch Update: {failed} failed')
+            response.error_msg = f'{failed} of {len(results)} file entities failed to update'
+
+        response.code = EAPIResponseCode.success
+        response.result = results
+        response.total = len(results)
+
+        return response.json_response()
+
+    @router.post('/entity/file/update-by-query', tags=[_API_TAG], summary='Update every file entity matching a query')
+    @catch_internal(_API_NAMESPACE)
+    async def file_meta_update_by_query(self, request_payload: FileMetaUpdateByQuery):
+        """Start the update as an elastic search task and return its id; poll it with GET update-by-query/{task_id}.
+
+        The query is written like the query of GET /v1/entity/file; neither it nor updated_fields may be empty.
+        """
+        response = APIResponse()
+
+        if not request_payload.query:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = 'Query must not be empty'
+            return response.json_response()
+
+        if not request_payload.updated_fields:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = 'Updated fields must not be empty'
+            return response.json_response()
+
+        try:
+            search_query = compile_file_query(request_payload.query)
+        except InvalidFileQuery as e:
+            response.code = EAPIResponseCode.bad_request
+            response.error_msg = str(e)
+            return response.json_response()
+
+        if ConfigClass.FILE_QUERY_PLANNING_ENABLED:
+            search_query = plan_file_query(search_query, await file_search_mapping.contain_subfields())
+
+        script = {
+            'source': UPDATE_FIELDS_SCRIPT,
+            'lang': 'painless',
+            'params': {'fields': build_updated_fields(request_payload.updated_fields)},
+        }
+        res = await update_by_query(
+            ES_INDEX, search_query, script, request_payload.slices, request_payload.conflicts.value
+        )
+        self.__logger.info(f'Update by query response is: {res}')
+
+        if 'task' not in res:
+            response.code = EAPIResponseCode.internal_error
+            response.error_msg = f'Failed to start update by query in elastic search: {res.get("error", res)}'
+            return response.json_response()
+
+        response.code = EAPIResponseCode.accepted
+        response.result = {'task_id': res['task']}
+        return response.json_response()
+
+    @router.get(
+        '/entity/file/update-by-query/{task_id}', tags=[_API_TAG], summary='Get the progress of an update by query'
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def file_meta_update_by_query_status(self, task_id: str):
+        response = APIResponse()
+
+        res = await get_task(task_id)
+        # a failed task still has its task entry, with the error next to it
+        if 'task' not in res:
+            response.code = EAPIResponseCode.not_found if res.get('status') == 404 else EAPIResponseCode.internal_error
+            response.error_msg = f'Failed to get update by query task {task_id}: {res.get("error", res)}'
+            return response.json_response()
+
+        task_response = res.get('response', {})
+        response.code = EAPIResponseCode.success
+        response.result = {
+            'task_id': task_id,
+            'completed': res['completed'],
+            'status': res['task']['status'],
+            'failures': task_response.get('failures', []),
+            'error': res.get('error'),
+        }
+        return response.json_response()
@@ -13,16 +13,26 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import httpx
+from typing import List
+
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi_utils.cbv import cbv
 
+from app.commons.atlas.lineage_cache import lineage_cache
+from app.commons.atlas.lineage_cache import lineage_cache_sync
+from app.commons.atlas.lineage_format import compact_atlas_lineage
+from app.commons.atlas.lineage_manager import EntityNotFound
 from app.commons.atlas.lineage_manager import SrvLineageMgr
+from app.commons.atlas.lineage_traversal import traverse_lineage
+from app.commons.metadata.item_manager import SrvItemMgr
 from app.config import ConfigClass
+from app.models.base_models import APIResponse
 from app.models.base_models import EAPIResponseCode
+from app.models.models_lineage import ELineageFormat
 from app.models.models_lineage import GETLineage
+from app.models.models_lineage import GETLineageGraph
 from app.models.models_lineage import GETLineageResponse
 from app.models.models_lineage import POSTLineage
 from app.models.models_lineage import POSTLineageResponse
@@ -36,6 +46,7 @@ _API_NAMESPACE = 'api_lineage'
 @cbv(router)
 class Lineage:
     lineage_mgr = SrvLineageMgr()
+    item_mgr = SrvItemMgr()
     _logger = LoggerFactory('api_lineage_action').get_logger()
 
     @router.get('/', response_model=GETLineageResponse, summary='Get Lineage')
@@ -45,7 +56,12 @@ class Lineage:
         api_response = GETLineageResponse()
         _id = params.item_id
         type_name = 'file_data'
-        response = await self.lineage_mgr.get(_id, type_name, params.direction)
+        cached_lineage = lineage_cache.get(_id, params.direction, params.depth)
+        if cached_lineage is not None:
+            api_response.result = self.render_lineage(cached_lineage, params.format)
+            return api_response.json_response()
+
+        response = await self.lineage_mgr.get(_id, type_name, params.direction, params.depth)
         self._logger.debug(f'Response of get is {response.text}')
         if response.status_code == 200:
             response_json = response.json()
@@ -66,7 +82,8 @@ class Lineage:
                     api_response.error_msg = 'Invalid Entity'
                     api_response.code = EAPIResponseCode.bad_request
                     return api_response.json()
-            api_response.result = response_json
+            lineage_cache.set(_id, params.direction, params.depth, response_json)
+            api_response.result = self.render_lineage(response_json, params.format)
             return api_response.json_response()
         else:
             self._logger.error('LINE 56 Error: %s', response.text)
@@ -76,6 +93,43 @@ class Lineage:
                 return api_response.json_response()
             raise
 
+    @router.get('/graph', summary='Get Lineage graph')
+    @catch_internal(_API_NAMESPACE)
+    async def get_graph(self, params: GETLineageGraph = Depends(GETLineageGraph)):
+        """walk lineage level by level, query params: item_id, direction (INPUT, OUTPUT or BOTH), depth, max_nodes"""
+        api_response = APIResponse()
+        if params.depth > ConfigClass.LINEAGE_GRAPH_MAX_DEPTH or params.max_nodes > ConfigClass.LINEAGE_GRAPH_MAX_NODES:
+            api_response.error_msg = (
+                f'depth must be at most {ConfigClass.LINEAGE_GRAPH_MAX_DEPTH} '
+                f'and max_nodes at most {ConfigClass.LINEAGE_GRAPH_MAX_NODES}'
+            )
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+
+        try:
+            res_default_entity = await self.lineage_mgr.search_entity(params.item_id, type_name='file_data')
+        except EntityNotFound as e:
+            api_response.error_msg = str(e)
+            api_response.code = EAPIResponseCode.not_found
+            return api_response.json_response()
+        entities = [
+            entity
+            for entity in res_default_entity.json()['entities']
+            if entity['attributes'].get('global_entity_id') == params.item_id
+        ]
+        if not entities:
+            api_response.error_msg = f'Not Found Entity: {params.item_id}'
+            api_response.code = EAPIResponseCode.not_found
+            return api_response.json_response()
+
+        graph = await traverse_lineage(
+            self.lineage_mgr, entities[0], params.direction.value, params.depth, params.max_nodes
+        )
+        await self.add_display_path(graph.entities)
+        api_response.result = graph.to_compact() if params.format == ELineageFormat.compact else graph.to_dict()
+        api_response.total = len(graph.entities)
+        return api_response.json_response()
+
     @router.post('/', response_model=POSTLineageResponse, summary='POST Lineage')
     @catch_internal(_API_NAMESPACE)
     async def post(self, data: POSTLineage):
@@ -122,21 +176,73 @@ class Lineage:
             else:
                 api_response.code = EAPIResponseCode.forbidden
             return api_response.json_response()
+        # the new Process changes the graph of everything connected to its input and output
+        await lineage_cache_sync.invalidate([data.input_id, data.output_id])
         api_response.result = res.json()
         return api_response.json_response()
 
-    async def add_display_path(self, guidEntityMap):
-        for _, value in guidEntityMap.items():
-            if value['typeName'] == 'Process':
+    @router.post('/batch', summary='POST Lineage in bulk')
+    @catch_internal(_API_NAMESPACE)
+    async def post_batch(self, data: List[POSTLineage]):
+        """add many lineages at once, with a result per lineage in the order of the payload"""
+        api_response = APIResponse()
+
+        if not data:
+            api_response.error_msg = 'No lineage to create'
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+
+        if len(data) > ConfigClass.LINEAGE_BATCH_MAX_SIZE:
+            api_response.error_msg = f'Too many lineages in one batch, maximum is {ConfigClass.LINEAGE_BATCH_MAX_SIZE}'
+            api_response.code = EAPIResponseCode.bad_request
+            return api_response.json_response()
+
+        results = [None] * len(data)
+        creation_forms = []
+        positions = []
+        for position, item in enumerate(data):
+            if item.input_id == item.output_id:
+                results[position] = {
+                    'input_id': item.input_id,
+                    'output_id': item.output_id,
+                    'guid': None,
+                    'status': EAPIResponseCode.bad_request.value,
+                    'error': 'Input and Output id are the same',
+                }
                 continue
-            item_id = value['attributes']['global_entity_id']
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.get(f'{ConfigClass.METADATA_SERVICE}item/{item_id}/')
-            if response.status_code != 200:
-                raise Exception('Error calling metadata service')
-            node_data = response.json()['result']
+            creation_forms.append(creation_form_factory(item))
+            positions.append(position)
+
+        created = await self.lineage_mgr.create_many(creation_forms, version='v2')
+        for position, result in zip(positions, created):
+            results[position] = result
+
+        created_ids = set()
+        for result in results:
+            if result['status'] < 300:
+                created_ids.update((result['input_id'], result['output_id']))
+        await lineage_cache_sync.invalidate(created_ids)
+
+        failed = len(results) - sum(1 for result in results if result['status'] < 300)
+        if failed:
+            self._logger.error(f'{failed} of {len(results)} lineages failed to create')
+            api_response.error_msg = f'{failed} of {len(results)} lineages failed to create'
+        api_response.result = results
+        api_response.total = len(results)
+        return api_response.json_response()
+
+    def render_lineage(self, lineage, lineage_format):
+        if lineage_format == ELineageFormat.compact:
+            return compact_atlas_lineage(lineage)
+        return lineage
+
+    async def add_display_path(self, guidEntityMap):
+        entities = [value for value in guidEntityMap.values() if value['typeName'] != 'Process']
+        items = await self.item_mgr.get_items(value['attributes']['global_entity_id'] for value in entities)
+        for value in entities:
+            node_data = items.get(value['attributes']['global_entity_id'])
             self._logger.info(f'Entity in metadata service is: {str(node_data)}')
-            if len(node_data) == 0:
+            if not node_data:
                 continue
 
             labels = ['Greenroom' if node_data['zone'] == 0 else 'Core']
@@ -149,4 +255,4 @@ class Lineage:
                 display_path = '{}/{}'.format(node_data['parent_path'].replace('.', '/'), node_data['name'])
                 value['attributes']['display_path'] = display_path
             else:
-                value['attributes']['display_path'] = value['attributes']['full_path']
+                value['attributes']['display_path'] = value['attributes'].get('full_path')
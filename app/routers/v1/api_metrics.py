@@ -0,0 +1,30 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.resources.metrics import metrics
+
+router = APIRouter()
+
+_API_TAG = 'Metrics'
+
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@router.get('/metrics', tags=[_API_TAG], summary='Request and downstream metrics in the Prometheus text format')
+async def metrics_exposition():
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_MEDIA_TYPE)
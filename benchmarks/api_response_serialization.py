@@ -0,0 +1,114 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compare rendering an APIResponse carrying a page of elastic search hits.
+
+* legacy: APIResponse.dict() followed by starlette's JSONResponse, as before FastJSONResponse.
+* stdlib: json_response() with orjson unavailable, rendered by the standard library encoder.
+* orjson: json_response() rendered by orjson, a dependency of the service.
+
+Run from the repository root with the service settings available in the environment or `.env`:
+
+    poetry run python -m benchmarks.api_response_serialization
+"""
+
+import json
+import timeit
+from unittest import mock
+
+from fastapi.responses import JSONResponse
+
+from app.models import base_models
+from app.models.base_models import APIResponse
+from app.models.base_models import EAPIResponseCode
+
+
+def file_hit(index: int) -> dict:
+    return {
+        '_index': 'files',
+        '_type': '_doc',
+        '_id': f'{index:08d}-0b1f-4f5e-9d3c-7c1e2a9b{index % 10000:04d}',
+        '_score': None,
+        '_source': {
+            'zone': 'greenroom',
+            'file_size': 1024 * index,
+            'tags': ['raw', 'mri', 'session-1'],
+            'archived': False,
+            'time_lastmodified': 1646715600 + index,
+            'time_created': 1646629200 + index,
+            'process_pipeline': '',
+            'uploader': 'admin',
+            'file_name': f'scan_{index:05d}.nii.gz',
+            'file_type': 'nii.gz',
+            'atlas_guid': f'9f3c2a1b-{index:04d}-4e8f-b7a2-1c5d6e7f8a9b',
+            'display_path': f'admin/raw/session-1/scan_{index:05d}.nii.gz',
+            'dcm_id': 'undefined',
+            'location': f'minio://http://minio.minio:9000/gr-test_project/admin/raw/scan_{index:05d}.nii.gz',
+            'global_entity_id': f'{index:08d}-0b1f-4f5e-9d3c-7c1e2a9b{index % 10000:04d}-1646629200',
+            'project_code': 'test_project',
+            'priority': 0,
+            'operator': '',
+            'attributes': [
+                {'attribute_name': 'site', 'name': 'Manifest', 'value': 'toronto – west'},
+                {'attribute_name': 'modality', 'name': 'Manifest', 'value': 'T1'},
+            ],
+        },
+        'sort': [1646629200000 + index],
+    }
+
+
+def build_response(hits: int) -> APIResponse:
+    response = APIResponse()
+    response.code = EAPIResponseCode.success
+    response.result = [file_hit(index) for index in range(hits)]
+    response.total = hits
+    return response
+
+
+def legacy(response: APIResponse) -> bytes:
+    data = response.dict()
+    data['code'] = response.code.value
+    return JSONResponse(status_code=response.code.value, content=data).body
+
+
+def stdlib(response: APIResponse) -> bytes:
+    with mock.patch.object(base_models, 'orjson', None):
+        return response.json_response().body
+
+
+def fast(response: APIResponse) -> bytes:
+    return response.json_response().body
+
+
+def main(number: int = 50) -> None:
+    variants = [legacy, stdlib]
+    if base_models.orjson is not None:
+        fast.__name__ = 'orjson'
+        variants.append(fast)
+
+    print(f'{"hits":<8}' + ''.join(f'{variant.__name__:>14}' for variant in variants))  # noqa: T001
+    for hits in (10, 100, 1000):
+        response = build_response(hits)
+        expected = json.loads(legacy(response))
+        assert all(json.loads(variant(response)) == expected for variant in variants)
+
+        timings = []
+        for variant in variants:
+            seconds = min(timeit.repeat(lambda: variant(response), number=number, repeat=5))
+            timings.append(seconds / number * 1e3)
+        print(f'{hits:<8}' + ''.join(f'{timing:>12.3f}ms' for timing in timings))  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compare building file search DSL with the query compiler against the former two-pass translation.
+
+Every variant starts from the JSON query string received by GET /v1/entity/file:
+
+* legacy: json.loads and the two-pass translation the API used before the compiler.
+* cold: json.loads, validation and compilation of a shape that is not cached yet.
+* shape hit: json.loads and binding new values into an already compiled shape.
+* repeat: the exact same query string again, served by the memoized query.
+
+Run from the repository root with the service settings available in the environment or `.env`:
+
+    poetry run python -m benchmarks.file_query_compile
+"""
+
+import json
+import timeit
+
+from app.resources.file_query_compiler import compile_file_query
+from app.resources.file_query_compiler import compile_file_query_string
+from app.resources.file_query_compiler import compiled_query_cache
+
+QUERIES = {
+    'simple': {
+        'project_code': {'value': 'test_project', 'condition': 'equal'},
+        'zone': {'value': 'greenroom', 'condition': 'equal'},
+        'archived': {'value': False, 'condition': 'equal'},
+    },
+    'dashboard': {
+        'project_code': {'value': 'test_project', 'condition': 'equal'},
+        'file_name': {'value': 'scan', 'condition': 'contain'},
+        'uploader': {'value': 'admin', 'condition': 'start_with'},
+        'time_created': {'value': [1646629200, 1646715600], 'condition': 'between'},
+        'file_size': {'value': [1024], 'condition': 'gte'},
+        'tags': {'value': ['raw', 'mri'], 'condition': 'contain'},
+        'attributes': {
+            'name': 'Manifest',
+            'attributes': [
+                {'attribute_name': 'site', 'type': 'text', 'condition': 'contain', 'value': 'toronto'},
+                {'attribute_name': 'modality', 'type': 'multiple_choice', 'condition': 'equal', 'value': ['T1', 'T2']},
+            ],
+        },
+    },
+}
+
+
+def legacy_translate(queries: dict) -> dict:  # noqa: C901
+    """The translation file_meta_query and file_search performed before the compiler, kept as the reference."""
+    search_params = []
+
+    for key in queries:
+        if key == 'attributes':
+            filed_params = {
+                'nested': True,
+                'field': 'attributes',
+                'range': False,
+                'name': queries['attributes']['name'],
+                'multi_values': False,
+            }
+            search_params.append(filed_params)
+            for record in queries['attributes'].get('attributes', []):
+                filed_params = {
+                    'nested': True,
+                    'field': 'attributes',
+                    'range': False,
+                    'name': queries['attributes']['name'],
+                    'multi_values': False,
+                    'attribute_name': record['attribute_name'],
+                }
+                if record['type'] == 'text':
+                    if record['condition'] == 'contain':
+                        filed_params['value'] = '*{}*'.format(record['value'])
+                        filed_params['search_type'] = 'wildcard'
+                    else:
+                        filed_params['value'] = record['value']
+                        filed_params['search_type'] = 'match'
+                else:
+                    filed_params['search_type'] = 'should' if record['condition'] == 'contain' else 'must'
+                    filed_params['value'] = record['value']
+                    filed_params['multi_values'] = True
+                search_params.append(filed_params)
+        elif key == 'time_created' or key == 'file_size':
+            search_params.append(
+                {
+                    'nested': False,
+                    'field': key,
+                    'range': queries[key]['value'],
+                    'multi_values': False,
+                    'search_type': queries[key]['condition'],
+                }
+            )
+        elif key == 'tags':
+            search_params.append(
+                {
+                    'nested': False,
+                    'field': key,
+                    'range': False,
+                    'multi_values': True,
+                    'search_type': 'should' if queries['tags']['condition'] == 'contain' else 'must',
+                    'value': queries['tags']['value'],
+                }
+            )
+        else:
+            search_params.append(
+                {
+                    'nested': False,
+                    'field': key,
+                    'range': False,
+                    'multi_values': False,
+                    'value': queries[key]['value'],
+                    'search_type': queries[key]['condition'],
+                }
+            )
+
+    search_fields = []
+    for item in search_params:
+        if item['nested']:
+            field_values = [{'match': {'attributes.name': item['name']}}]
+            if 'attribute_name' in item:
+                field_values.append({'match': {'attributes.attribute_name': item['attribute_name']}})
+            if 'search_type' in item:
+                if item['search_type'] == 'wildcard':
+                    field_values.append({'wildcard': {'attributes.value': item['value']}})
+                elif item['search_type'] == 'match':
+                    field_values.append({'match': {'attributes.value': item['value']}})
+                else:
+                    options = [{'match': {'attributes.value': option}} for option in item['value']]
+                    field_values.append({'bool': {item['search_type']: options}})
+            search_fields.append({'nested': {'path': item['field'], 'query': {'bool': {'must': field_values}}}})
+        elif item['range']:
+            bounds = []
+            for bound in item['range']:
+                bound = str(bound)
+                if len(bound) > 20:
+                    bound = bound[:19]
+                bounds.append(int(bound))
+            if len(bounds) == 1:
+                operator = 'lte' if item['search_type'] == 'lte' else 'gte'
+                search_fields.append({'range': {item['field']: {operator: bounds[0]}}})
+            else:
+                search_fields.append({'range': {item['field']: {'gte': bounds[0], 'lte': bounds[1]}}})
+        elif item['multi_values']:
+            options = [{'term': {item['field']: option}} for option in item['value']]
+            search_fields.append({'bool': {'should' if item['search_type'] == 'should' else 'must': options}})
+        elif item['search_type'] == 'contain':
+            search_fields.append({'wildcard': {item['field']: '*{}*'.format(item['value'])}})
+        elif item['search_type'] == 'start_with':
+            search_fields.append({'wildcard': {item['field']: '{}*'.format(item['value'])}})
+        elif item['search_type'] == 'end_with':
+            search_fields.append({'wildcard': {item['field']: '*{}'.format(item['value'])}})
+        else:
+            search_fields.append({'term': {item['field']: item['value']}})
+
+    return {'bool': {'must': search_fields}}
+
+
+def legacy(query: str) -> dict:
+    return legacy_translate(json.loads(query))
+
+
+def cold(query: str) -> dict:
+    compiled_query_cache.clear()
+    return compile_file_query(json.loads(query))
+
+
+def shape_hit(query: str) -> dict:
+    return compile_file_query(json.loads(query))
+
+
+def repeat(query: str) -> dict:
+    return compile_file_query_string(query)
+
+
+def main(number: int = 20000) -> None:
+    variants = (legacy, cold, shape_hit, repeat)
+    print(f'{"query":<12}' + ''.join(f'{variant.__name__:>14}' for variant in variants))  # noqa: T001
+    for name, queries in QUERIES.items():
+        query = json.dumps(queries)
+        assert legacy(query) == cold(query) == repeat(query)
+
+        timings = []
+        for variant in variants:
+            seconds = min(timeit.repeat(lambda: variant(query), number=number, repeat=5))
+            timings.append(seconds / number * 1e6)
+        print(f'{name:<12}' + ''.join(f'{timing:>12.2f}us' for timing in timings))  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
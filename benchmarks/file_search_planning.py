@@ -0,0 +1,153 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compare file search latency with and without query planning against a local elastic search.
+
+Start a disposable elastic search 7.x (the `wildcard` field type needs 7.9 or later), point the service settings at it
+and run from the repository root:
+
+    docker run -d -p 9200:9200 -e discovery.type=single-node elasticsearch:7.17.9
+    ELASTIC_SEARCH_HOST=localhost ELASTIC_SEARCH_PORT=9200 poetry run python -m benchmarks.file_search_planning
+
+The benchmark creates and finally deletes the `files_benchmark` index. Before timing a query it checks that planning
+does not change its hits, which pins the ngram rewrite of FILE_QUERY_NGRAM_REWRITE_ENABLED against a real analyzer.
+"""
+
+import asyncio
+import random
+import statistics
+import time
+
+from app.resources.es_helper import ELASTIC_SEARCH_URL
+from app.resources.es_helper import bulk
+from app.resources.es_helper import file_search
+from app.resources.file_query_compiler import compile_file_query
+from app.resources.file_query_planner import FileSearchMapping
+from app.resources.file_query_planner import plan_file_query
+from app.resources.http_client import close_http_clients
+from app.resources.http_client import es_client
+
+ES_INDEX = 'files_benchmark'
+DOCUMENTS = 200000
+ROUNDS = 200
+
+MAPPING = {
+    'settings': {
+        'index': {
+            'max_ngram_diff': 0,
+            'analysis': {
+                'analyzer': {'path_ngram': {'type': 'custom', 'tokenizer': 'trigram'}},
+                'tokenizer': {'trigram': {'type': 'ngram', 'min_gram': 3, 'max_gram': 3}},
+            },
+        }
+    },
+    'mappings': {
+        'properties': {
+            'project_code': {'type': 'keyword'},
+            'zone': {'type': 'keyword'},
+            'archived': {'type': 'boolean'},
+            'uploader': {'type': 'keyword'},
+            'tags': {'type': 'keyword'},
+            'file_size': {'type': 'long'},
+            'time_created': {'type': 'long'},
+            'file_name': {'type': 'keyword', 'fields': {'wc': {'type': 'wildcard'}}},
+            'display_path': {
+                'type': 'keyword',
+                'fields': {'grams': {'type': 'text', 'analyzer': 'path_ngram'}},
+            },
+        }
+    },
+}
+
+QUERIES = {
+    'list view': {
+        'project_code': {'value': 'project_3', 'condition': 'equal'},
+        'zone': {'value': 'greenroom', 'condition': 'equal'},
+        'archived': {'value': False, 'condition': 'equal'},
+    },
+    'date range': {
+        'project_code': {'value': 'project_3', 'condition': 'equal'},
+        'time_created': {'value': [1646629200, 1649307600], 'condition': 'between'},
+        'tags': {'value': ['raw', 'mri'], 'condition': 'contain'},
+    },
+    'name contains': {
+        'project_code': {'value': 'project_3', 'condition': 'equal'},
+        'file_name': {'value': 'scan_12', 'condition': 'contain'},
+    },
+    'path contains': {
+        'project_code': {'value': 'project_3', 'condition': 'equal'},
+        'display_path': {'value': 'Raw/sub', 'condition': 'contain'},
+    },
+}
+
+
+def _document(number: int) -> dict:
+    return {
+        'project_code': f'project_{number % 10}',
+        'zone': random.choice(['greenroom', 'core']),
+        'archived': number % 20 == 0,
+        'uploader': f'user_{number % 50}',
+        'tags': random.sample(['raw', 'mri', 'eeg', 'processed', 'qc'], 2),
+        'file_size': random.randint(1, 10**9),
+        'time_created': 1640995200 + number * 60,
+        'file_name': f'subject_{number % 997}_scan_{number}.nii.gz',
+        'display_path': f'{random.choice(["raw", "Raw", "processed"])}/subject_{number % 997}',
+    }
+
+
+async def seed() -> None:
+    client = es_client.get()
+    await client.delete(ELASTIC_SEARCH_URL + ES_INDEX)
+    await client.put(ELASTIC_SEARCH_URL + ES_INDEX, json=MAPPING)
+    for start in range(0, DOCUMENTS, 5000):
+        actions = [({'index': {'_index': ES_INDEX}}, _document(number)) for number in range(start, start + 5000)]
+        await bulk(actions)
+    await client.post(ELASTIC_SEARCH_URL + f'{ES_INDEX}/_refresh')
+
+
+async def hit_ids(query: dict) -> list:
+    res = await file_search(ES_INDEX, 0, 10000, query, 'time_created', 'desc', source=False)
+    return [hit['_id'] for hit in res['hits']['hits']]
+
+
+async def measure(query: dict) -> tuple:
+    walls, tooks = [], []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        res = await file_search(ES_INDEX, 0, 25, query, 'time_created', 'desc')
+        walls.append((time.perf_counter() - start) * 1000)
+        tooks.append(res['took'])
+    walls.sort()
+    return statistics.median(walls), walls[int(len(walls) * 0.95)], statistics.mean(tooks)
+
+
+async def main() -> None:
+    await seed()
+    subfields = await FileSearchMapping(ES_INDEX, ngram_rewrite=True).contain_subfields()
+    print(f'{"query":<16}{"mode":<10}{"median ms":>12}{"p95 ms":>10}{"avg took ms":>14}')  # noqa: T001
+    try:
+        for name, queries in QUERIES.items():
+            compiled = compile_file_query(queries)
+            if await hit_ids(compiled) != await hit_ids(plan_file_query(compiled, subfields)):
+                raise AssertionError(f'planning changed the hits of {name}')
+            for mode, query in (('must', compiled), ('planned', plan_file_query(compiled, subfields))):
+                median, p95, took = await measure(query)
+                print(f'{name:<16}{mode:<10}{median:>12.2f}{p95:>10.2f}{took:>14.2f}')  # noqa: T001
+    finally:
+        await es_client.get().delete(ELASTIC_SEARCH_URL + ES_INDEX)
+        await close_http_clients()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
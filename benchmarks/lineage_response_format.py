@@ -0,0 +1,108 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Compare the size and client parse time of a lineage response of Atlas with its compact format.
+
+The lineage is a chain of files and processes shaped like the entity headers Atlas returns, enriched with zone and
+display path like GET /v1/lineage does.
+
+Run from the repository root with the service settings available in the environment or `.env`:
+
+    poetry run python -m benchmarks.lineage_response_format
+"""
+
+import json
+import timeit
+
+from app.commons.atlas.lineage_format import compact_atlas_lineage
+
+
+def file_entity(index: int) -> dict:
+    return {
+        'typeName': 'file_data',
+        'attributes': {
+            'owner': 'admin',
+            'createTime': 1637072372,
+            'qualifiedName': f'test_project:admin/raw/scan_{index:05d}.nii.gz',
+            'name': f'scan_{index:05d}.nii.gz',
+            'description': 'Raw file in greenroom',
+            'global_entity_id': f'{index:08d}-0b1f-4f5e-9d3c-7c1e2a9b0000-1646629200',
+            'full_path': f'admin/raw/scan_{index:05d}.nii.gz',
+            'zone': ['Greenroom'],
+            'display_path': f'admin/raw/scan_{index:05d}.nii.gz',
+        },
+        'guid': f'{index:08d}-63bc-4232-ad32-7a5c20386df1',
+        'status': 'ACTIVE',
+        'displayText': f'scan_{index:05d}.nii.gz',
+        'classificationNames': [],
+        'classifications': [],
+        'meaningNames': [],
+        'meanings': [],
+        'isIncomplete': False,
+        'labels': [],
+    }
+
+
+def process_entity(index: int) -> dict:
+    name = f'test_project:dicom_edit:1646629200:scan_{index:05d}.nii.gz:to:scan_{index + 1:05d}.nii.gz:v2'
+    return {
+        'typeName': 'Process',
+        'attributes': {'owner': None, 'createTime': 1646629200, 'qualifiedName': name, 'name': name},
+        'guid': f'{index:08d}-7a1d-4c1b-9e3f-2b6d8e4f1a0c',
+        'status': 'ACTIVE',
+        'displayText': name,
+        'classificationNames': [],
+        'meaningNames': [],
+        'meanings': [],
+        'isIncomplete': False,
+        'labels': [],
+    }
+
+
+def build_lineage(files: int) -> dict:
+    guid_entity_map = {}
+    relations = []
+    for index in range(files):
+        entity = file_entity(index)
+        guid_entity_map[entity['guid']] = entity
+        if index:
+            process = process_entity(index - 1)
+            guid_entity_map[process['guid']] = process
+            previous = file_entity(index - 1)['guid']
+            for from_guid, to_guid in ((previous, process['guid']), (process['guid'], entity['guid'])):
+                relations.append({'fromEntityId': from_guid, 'toEntityId': to_guid, 'relationshipId': to_guid})
+    return {
+        'baseEntityGuid': file_entity(files - 1)['guid'],
+        'lineageDirection': 'INPUT',
+        'lineageDepth': 50,
+        'guidEntityMap': guid_entity_map,
+        'relations': relations,
+    }
+
+
+def main(number: int = 20) -> None:
+    print(f'{"files":<8}{"full":>12}{"compact":>12}{"full parse":>14}{"compact parse":>16}')  # noqa: T001
+    for files in (10, 100, 1000):
+        lineage = build_lineage(files)
+        full = json.dumps(lineage, separators=(',', ':'))
+        compact = json.dumps(compact_atlas_lineage(lineage), separators=(',', ':'))
+        timings = [min(timeit.repeat(lambda: json.loads(body), number=number, repeat=5)) for body in (full, compact)]
+        print(  # noqa: T001
+            f'{files:<8}{len(full):>11}B{len(compact):>11}B'
+            f'{timings[0] / number * 1e3:>12.3f}ms{timings[1] / number * 1e3:>14.3f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
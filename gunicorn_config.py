@@ -13,6 +13,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+
 workers = 4
 threads = 2
 bind = '0.0.0.0:5077'
@@ -21,3 +24,10 @@ worker_connections = 1200
 accesslog = '-'
 errorlog = '-'
 loglevel = 'debug'
+
+
+def on_starting(server):
+    # metrics snapshots of workers from a previous run must not be merged into this one
+    multiproc_dir = os.environ.get('METRICS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
@@ -0,0 +1,142 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+
+from app.commons.atlas.lineage_cache import LineageCache
+from app.commons.atlas.lineage_cache import LineageCacheSync
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, []).append(self)
+
+    async def listen(self):
+        while True:
+            yield await self.messages.get()
+
+    async def close(self):
+        pass
+
+
+class FakeRedis:
+    """In-process stand-in for the pub/sub commands of one redis server shared by every worker."""
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def publish(self, channel, message):
+        for pubsub in self.subscribers.get(channel, []):
+            pubsub.messages.put_nowait({'type': 'message', 'data': message})
+
+    async def close(self):
+        pass
+
+
+def build_lineage(*entity_ids):
+    guid_entity_map = {
+        f'{entity_id}_guid': {'typeName': 'file_data', 'attributes': {'global_entity_id': entity_id}}
+        for entity_id in entity_ids
+    }
+    guid_entity_map['process_guid'] = {'typeName': 'Process', 'attributes': {}}
+    return {'guidEntityMap': guid_entity_map}
+
+
+def test_cache_should_key_lineage_by_item_direction_and_depth():
+    cache = LineageCache(maxsize=10, ttl=60)
+    lineage = build_lineage('a', 'b')
+    cache.set('a', 'INPUT', 50, lineage)
+
+    assert cache.get('a', 'INPUT', 50) is lineage
+    assert cache.get('a', 'OUTPUT', 50) is None
+    assert cache.get('a', 'INPUT', 5) is None
+
+
+def test_invalidate_should_drop_every_graph_containing_entity():
+    cache = LineageCache(maxsize=10, ttl=60)
+    cache.set('a', 'INPUT', 50, build_lineage('a', 'b'))
+    cache.set('c', 'OUTPUT', 50, build_lineage('b', 'c'))
+    cache.set('d', 'INPUT', 50, build_lineage('d'))
+
+    assert cache.invalidate(['b', 'x']) == 2
+    assert cache.get('a', 'INPUT', 50) is None
+    assert cache.get('c', 'OUTPUT', 50) is None
+    assert cache.get('d', 'INPUT', 50) is not None
+
+
+def test_invalidate_should_match_item_without_lineage():
+    cache = LineageCache(maxsize=10, ttl=60)
+    cache.set('a', 'INPUT', 50, {'guidEntityMap': {}})
+
+    assert cache.invalidate(['a']) == 1
+
+
+def test_index_should_not_outgrow_cache():
+    cache = LineageCache(maxsize=2, ttl=60)
+    for index in range(10):
+        cache.set(str(index), 'INPUT', 50, build_lineage(str(index)))
+
+    assert len(cache._entity_ids) <= 4
+    assert cache.get('9', 'INPUT', 50) is not None
+
+
+def test_disabled_cache_should_store_nothing():
+    cache = LineageCache(maxsize=10, ttl=60, enabled=False)
+    cache.set('a', 'INPUT', 50, build_lineage('a'))
+
+    assert cache.get('a', 'INPUT', 50) is None
+
+
+async def test_invalidation_should_reach_every_worker(mocker):
+    mocker.patch('app.commons.atlas.lineage_cache.aioredis.from_url', return_value=FakeRedis())
+    workers = [LineageCacheSync(LineageCache(maxsize=10, ttl=60), 'redis://redis', 'invalidate') for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    await asyncio.sleep(0)
+    for worker in workers:
+        worker.cache.set('a', 'INPUT', 50, build_lineage('a', 'b'))
+
+    await workers[0].invalidate(['b'])
+    await asyncio.sleep(0)
+
+    assert [worker.cache.get('a', 'INPUT', 50) for worker in workers] == [None, None]
+    for worker in workers:
+        await worker.stop()
+
+
+async def test_cache_should_stay_disabled_until_subscribed(mocker):
+    redis = FakeRedis()
+    mocker.patch('app.commons.atlas.lineage_cache.aioredis.from_url', return_value=redis)
+    sync = LineageCacheSync(LineageCache(maxsize=10, ttl=60), 'redis://redis', 'invalidate')
+
+    sync.start()
+    sync.cache.set('a', 'INPUT', 50, build_lineage('a'))
+    assert sync.cache.get('a', 'INPUT', 50) is None
+
+    await asyncio.sleep(0)
+    sync.cache.set('a', 'INPUT', 50, build_lineage('a'))
+    assert sync.cache.get('a', 'INPUT', 50) is not None
+    await redis.publish('invalidate', json.dumps(['a']))
+    await asyncio.sleep(0)
+    assert sync.cache.get('a', 'INPUT', 50) is None
+    await sync.stop()
@@ -0,0 +1,76 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from app.commons.atlas.lineage_format import NODE_FIELDS
+from app.commons.atlas.lineage_format import compact_atlas_lineage
+
+
+def test_compact_atlas_lineage_should_intern_strings_and_index_edges():
+    lineage = {
+        'baseEntityGuid': 'f1',
+        'guidEntityMap': {
+            'f0': {
+                'typeName': 'file_data',
+                'attributes': {
+                    'global_entity_id': 'geid_0',
+                    'name': 'a.txt',
+                    'zone': ['Greenroom'],
+                    'display_path': 'admin/a.txt',
+                },
+                'classificationNames': [],
+            },
+            'p0': {'typeName': 'Process', 'attributes': {'name': 'pipeline'}},
+            'f1': {
+                'typeName': 'file_data',
+                'attributes': {
+                    'global_entity_id': 'geid_1',
+                    'name': 'a.txt',
+                    'zone': ['Greenroom', 'TrashFile'],
+                    'display_path': 'admin/b/a.txt',
+                },
+            },
+        },
+        'relations': [
+            {'fromEntityId': 'f0', 'toEntityId': 'p0', 'relationshipId': 'r0'},
+            {'fromEntityId': 'p0', 'toEntityId': 'f1', 'relationshipId': 'r1'},
+            {'fromEntityId': 'p0', 'toEntityId': 'unknown', 'relationshipId': 'r2'},
+        ],
+    }
+
+    result = compact_atlas_lineage(lineage)
+    strings = result['strings']
+
+    assert result['node_fields'] == NODE_FIELDS
+    assert strings.count('a.txt') == 1
+    assert strings.count('Greenroom') == 1
+    assert result['edges'] == [[0, 1], [1, 2]]
+    assert result['base_entity'] == 2
+    guid, global_entity_id, name, type_name, zone, display_path = result['nodes'][2]
+    assert [strings[guid], strings[global_entity_id], strings[name], strings[type_name]] == [
+        'f1',
+        'geid_1',
+        'a.txt',
+        'file_data',
+    ]
+    assert [strings[label] for label in zone] == ['Greenroom', 'TrashFile']
+    assert strings[display_path] == 'admin/b/a.txt'
+    assert result['nodes'][1][1] is None
+
+
+def test_compact_atlas_lineage_without_entities():
+    result = compact_atlas_lineage({'baseEntityGuid': 'f0', 'guidEntityMap': {}, 'relations': []})
+
+    assert result['nodes'] == []
+    assert result['base_entity'] is None
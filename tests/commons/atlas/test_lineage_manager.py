@@ -0,0 +1,133 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from app.commons.atlas.lineage_manager import EntityNotFound
+from app.commons.atlas.lineage_manager import SrvLineageMgr
+from app.commons.atlas.lineage_manager import guid_cache
+from app.commons.atlas.lineage_manager import invalidate_guid_cache
+from app.models.models_lineage import CreationForm
+
+
+async def test_get_guids_by_ids_should_resolve_concurrently(mocker):
+    started = []
+    both_started = asyncio.Event()
+
+    async def get_guid_by_id(_id, type_name=None):
+        started.append(_id)
+        if len(started) == 2:
+            both_started.set()
+        await both_started.wait()
+        return f'{_id}_guid'
+
+    lineage_mgr = SrvLineageMgr()
+    mocker.patch.object(lineage_mgr, 'get_guid_by_id', side_effect=get_guid_by_id)
+
+    guids = await asyncio.wait_for(lineage_mgr.get_guids_by_ids([('input', 'file_data'), ('output', 'file_data')]), 1)
+
+    assert guids == ['input_guid', 'output_guid']
+
+
+async def test_get_guids_by_ids_should_raise_lookup_error(mocker):
+    async def get_guid_by_id(_id, type_name=None):
+        if _id == 'output':
+            raise Exception(f'Not Found Entity: {_id}')
+        return f'{_id}_guid'
+
+    lineage_mgr = SrvLineageMgr()
+    mocker.patch.object(lineage_mgr, 'get_guid_by_id', side_effect=get_guid_by_id)
+
+    with pytest.raises(Exception, match='Not Found Entity: output'):
+        await lineage_mgr.get_guids_by_ids([('input', 'file_data'), ('output', 'file_data')])
+
+
+def mock_atlas_search(httpx_mock, _id, entities):
+    httpx_mock.add_response(
+        method='GET',
+        url=(
+            'http://altas:123/api/atlas/v2/search/attribute'
+            f'?attrName=global_entity_id&typeName=file_data&attrValuePrefix={_id}'
+        ),
+        json={'entities': entities},
+        status_code=200,
+    )
+
+
+async def test_get_guid_by_id_should_cache_guid(httpx_mock):
+    mock_atlas_search(httpx_mock, 'geid', [{'guid': 'guid', 'attributes': {'global_entity_id': 'geid'}}])
+    lineage_mgr = SrvLineageMgr()
+
+    assert await lineage_mgr.get_guid_by_id('geid', 'file_data') == 'guid'
+    assert await lineage_mgr.get_guid_by_id('geid', 'file_data') == 'guid'
+    assert len(httpx_mock.get_requests()) == 1
+    assert guid_cache.info()['hits'] == 1
+
+
+async def test_get_guid_by_id_should_search_again_after_invalidation(httpx_mock):
+    entities = [{'guid': 'guid', 'attributes': {'global_entity_id': 'geid'}}]
+    mock_atlas_search(httpx_mock, 'geid', entities)
+    mock_atlas_search(httpx_mock, 'geid', entities)
+    lineage_mgr = SrvLineageMgr()
+
+    await lineage_mgr.get_guid_by_id('geid', 'file_data')
+    invalidate_guid_cache('geid')
+    await lineage_mgr.get_guid_by_id('geid', 'file_data')
+
+    assert len(httpx_mock.get_requests()) == 2
+
+
+async def test_get_guid_by_id_should_cache_not_found_with_negative_ttl(httpx_mock, mocker):
+    mocker.patch.object(guid_cache, 'negative_ttl', 5)
+    mock_atlas_search(httpx_mock, 'geid', [])
+    lineage_mgr = SrvLineageMgr()
+
+    for _ in range(2):
+        with pytest.raises(EntityNotFound):
+            await lineage_mgr.get_guid_by_id('geid', 'file_data')
+
+    assert len(httpx_mock.get_requests()) == 1
+
+
+async def test_create_should_forget_guids_when_atlas_rejects_process(httpx_mock):
+    for _id in ('input', 'output', 'input', 'output'):
+        mock_atlas_search(httpx_mock, _id, [{'guid': f'{_id}_guid', 'attributes': {'global_entity_id': _id}}])
+    httpx_mock.add_response(
+        method='POST',
+        url='http://altas:123/api/atlas/v2/entity/bulk',
+        json={'errorCode': 'ATLAS-404-00-005'},
+        status_code=404,
+    )
+    creation_form = CreationForm(
+        {
+            'input_id': 'input',
+            'output_id': 'output',
+            'input_name': 'input_name',
+            'output_name': 'output_name',
+            'project_code': 'test_project',
+            'pipeline_name': 'test pipeline',
+            'description': 'unit test',
+            'process_timestamp': '',
+        }
+    )
+    lineage_mgr = SrvLineageMgr()
+
+    res = await lineage_mgr.create(creation_form, 'v2')
+    await lineage_mgr.get_guids_by_ids([('input', 'file_data'), ('output', 'file_data')])
+
+    assert res.status_code == 404
+    assert len([request for request in httpx_mock.get_requests() if request.method == 'GET']) == 4
@@ -0,0 +1,86 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import httpx
+
+from app.commons.atlas.lineage_traversal import traverse_lineage
+
+
+def file_entity(guid):
+    return {'guid': guid, 'typeName': 'file_data', 'attributes': {'global_entity_id': f'{guid}_geid', 'name': guid}}
+
+
+# f2 -> p2 -> f1 -> p1 -> f0 -> p3 -> f3
+UPSTREAM = {'f0': ('p1', 'f1'), 'f1': ('p2', 'f2')}
+DOWNSTREAM = {'f0': ('p3', 'f3')}
+
+
+class FakeLineageMgr:
+    def __init__(self):
+        self.calls = []
+
+    async def get_by_guid(self, guid, direction, depth=1):
+        self.calls.append((guid, direction))
+        guid_entity_map = {guid: file_entity(guid)}
+        relations = []
+        hop = (UPSTREAM if direction == 'INPUT' else DOWNSTREAM).get(guid)
+        if hop:
+            process, other = hop
+            guid_entity_map[process] = {'guid': process, 'typeName': 'Process', 'attributes': {'name': process}}
+            guid_entity_map[other] = file_entity(other)
+            if direction == 'INPUT':
+                relations = [
+                    {'fromEntityId': other, 'toEntityId': process},
+                    {'fromEntityId': process, 'toEntityId': guid},
+                ]
+            else:
+                relations = [
+                    {'fromEntityId': guid, 'toEntityId': process},
+                    {'fromEntityId': process, 'toEntityId': other},
+                ]
+        return httpx.Response(200, json={'guidEntityMap': guid_entity_map, 'relations': relations})
+
+
+async def test_traverse_lineage_should_walk_both_directions_level_by_level():
+    lineage_mgr = FakeLineageMgr()
+
+    graph = await traverse_lineage(lineage_mgr, file_entity('f0'), 'BOTH', depth=5, max_nodes=100)
+    result = graph.to_dict()
+
+    assert sorted(node['guid'] for node in result['nodes']) == ['f0', 'f1', 'f2', 'f3', 'p1', 'p2', 'p3']
+    assert ['f2', 'p2'] in result['edges']
+    assert ['p3', 'f3'] in result['edges']
+    assert result['truncated'] is False
+    assert ('f3', 'INPUT') not in lineage_mgr.calls
+    assert len(lineage_mgr.calls) == len(set(lineage_mgr.calls))
+
+
+async def test_traverse_lineage_should_stop_at_depth():
+    graph = await traverse_lineage(FakeLineageMgr(), file_entity('f0'), 'INPUT', depth=1, max_nodes=100)
+
+    assert set(graph.entities) == {'f0', 'p1', 'f1'}
+    assert graph.depth == 1
+
+
+async def test_traverse_lineage_should_stop_when_node_budget_is_spent():
+    lineage_mgr = FakeLineageMgr()
+
+    graph = await traverse_lineage(lineage_mgr, file_entity('f0'), 'INPUT', depth=5, max_nodes=2)
+    result = graph.to_dict()
+
+    assert [node['guid'] for node in result['nodes']] == ['f0', 'p1']
+    assert result['edges'] == [['p1', 'f0']]
+    assert result['truncated'] is True
+    assert lineage_mgr.calls == [('f0', 'INPUT')]
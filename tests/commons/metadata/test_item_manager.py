@@ -0,0 +1,79 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.commons.metadata.item_manager import SrvItemMgr
+
+
+def build_item(item_id):
+    return {'id': item_id, 'zone': 0, 'archived': False, 'parent_path': 'admin', 'name': f'{item_id}.txt'}
+
+
+async def test_get_items_should_fetch_every_id_once(httpx_mock):
+    for item_id in ('a', 'b'):
+        httpx_mock.add_response(
+            method='GET', url=f'http://metadata_service/v1/item/{item_id}/', json={'result': build_item(item_id)}
+        )
+
+    items = await SrvItemMgr().get_items(['a', 'b', 'a'])
+
+    assert items == {'a': build_item('a'), 'b': build_item('b')}
+    assert len(httpx_mock.get_requests()) == 2
+
+
+async def test_get_items_should_limit_requests_in_flight(mocker):
+    mocker.patch('app.config.ConfigClass.METADATA_MAX_CONCURRENCY', 2)
+    in_flight = []
+    peak = []
+
+    async def get(url):
+        in_flight.append(url)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0)
+        in_flight.remove(url)
+        return httpx.Response(200, json={'result': {}})
+
+    mocker.patch('app.commons.metadata.item_manager.metadata_client.get', return_value=mocker.Mock(get=get))
+
+    assert await SrvItemMgr().get_items([str(index) for index in range(6)]) == {}
+    assert max(peak) == 2
+
+
+async def test_get_items_should_use_batch_lookup_when_enabled(httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.METADATA_BATCH_LOOKUP_ENABLED', True)
+    mocker.patch('app.config.ConfigClass.METADATA_BATCH_SIZE', 2)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/batch/?ids=a&ids=b',
+        json={'result': [build_item('a'), build_item('b')]},
+    )
+    httpx_mock.add_response(
+        method='GET', url='http://metadata_service/v1/items/batch/?ids=c', json={'result': [build_item('c')]}
+    )
+
+    items = await SrvItemMgr().get_items(['a', 'b', 'c', 'b'])
+
+    assert list(items) == ['a', 'b', 'c']
+
+
+async def test_get_items_should_raise_when_metadata_service_fails(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/a/', status_code=500)
+
+    with pytest.raises(Exception, match='Error calling metadata service'):
+        await SrvItemMgr().get_items(['a'])
@@ -16,7 +16,16 @@
 import pytest
 from async_asgi_testclient import TestClient as TestAsyncClient
 
+from app.commons.atlas.lineage_cache import lineage_cache
+from app.commons.atlas.lineage_cache import lineage_cache_sync
+from app.commons.atlas.lineage_manager import guid_cache
 from app.config import ConfigClass
+from app.resources.audit_log_spool import audit_log_spool
+from app.resources.audit_log_writer import audit_log_writer
+from app.resources.geid_pool import geid_pool
+from app.resources.health_check import health_monitor
+from app.resources.http_client import close_http_clients
+from app.resources.metrics import metrics
 from run import app
 
 
@@ -32,3 +41,19 @@ def mock_settings(monkeypatch):
     monkeypatch.setattr(ConfigClass, 'ATLAS_HOST', 'altas')
     monkeypatch.setattr(ConfigClass, 'ATLAS_PORT', 123)
     monkeypatch.setattr(ConfigClass, 'METADATA_SERVICE', 'http://metadata_service/v1/')
+
+
+@pytest.fixture(autouse=True)
+async def reset_shared_state():
+    yield
+    await audit_log_writer.stop()
+    await audit_log_spool.stop()
+    await geid_pool.stop()
+    await health_monitor.stop()
+    health_monitor.reset()
+    await close_http_clients()
+    guid_cache.clear()
+    await lineage_cache_sync.stop()
+    lineage_cache.clear()
+    await metrics.stop()
+    metrics.clear()
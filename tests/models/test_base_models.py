@@ -0,0 +1,69 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from app.models import base_models
+from app.models.base_models import APIResponse
+from app.models.base_models import EAPIResponseCode
+from app.models.base_models import FastJSONResponse
+
+
+def build_response():
+    response = APIResponse()
+    response.code = EAPIResponseCode.success
+    response.result = [{'_id': 'geid', '_source': {'file_name': 'scan_é.nii.gz', 'file_size': 1024}}]
+    response.total = 1
+    return response
+
+
+def test_json_response_should_render_all_fields():
+    response = build_response().json_response()
+
+    assert isinstance(response, FastJSONResponse)
+    assert response.status_code == 200
+    assert json.loads(response.body) == {
+        'code': 200,
+        'error_msg': '',
+        'page': 0,
+        'total': 1,
+        'num_of_pages': 1,
+        'result': [{'_id': 'geid', '_source': {'file_name': 'scan_é.nii.gz', 'file_size': 1024}}],
+    }
+
+
+def test_json_response_should_fall_back_to_standard_library_without_orjson(mocker):
+    mocker.patch.object(base_models, 'orjson', None)
+
+    body = build_response().json_response().body
+
+    assert body.startswith(b'{"code":200,')
+    assert json.loads(body)['result'][0]['_source']['file_name'] == 'scan_é.nii.gz'
+
+
+def test_fast_json_response_should_render_models_and_enums():
+    body = FastJSONResponse(content={'code': EAPIResponseCode.not_found, 'result': build_response()}).body
+
+    assert json.loads(body) == {
+        'code': 404,
+        'result': {
+            'code': 200,
+            'error_msg': '',
+            'page': 0,
+            'total': 1,
+            'num_of_pages': 1,
+            'result': [{'_id': 'geid', '_source': {'file_name': 'scan_é.nii.gz', 'file_size': 1024}}],
+        },
+    }
@@ -0,0 +1,103 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+import pytest
+
+from app.resources.audit_log_spool import AuditLogSpool
+from app.resources.audit_log_spool import SpoolReplayError
+
+BULK_URL = 'http://elastic_search:123/_bulk'
+
+
+@pytest.fixture
+async def spool(tmp_path):
+    spool = AuditLogSpool(
+        str(tmp_path), segment_max_bytes=1024 * 1024, fsync_interval=0, replay_interval=60, replay_batch_size=2
+    )
+    spool.open()
+    yield spool
+    await spool.stop()
+
+
+def segment_files(directory):
+    return sorted(
+        os.path.join(root, name) for root, _, names in os.walk(directory) for name in names if name.endswith('.log')
+    )
+
+
+async def test_append_should_persist_document_before_returning(spool, tmp_path):
+    await spool.append('unittest', {'geid': 'first'})
+
+    (segment,) = segment_files(tmp_path)
+    with open(segment) as f:
+        assert json.loads(f.readline()) == {'index': 'unittest', 'document': {'geid': 'first'}}
+
+
+async def test_replay_should_index_sealed_segments_and_delete_them(spool, tmp_path, httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url=BULK_URL,
+        json={'errors': False, 'items': [{'index': {'status': 201}}] * 2},
+    )
+    httpx_mock.add_response(
+        method='POST',
+        url=BULK_URL,
+        json={'errors': False, 'items': [{'index': {'status': 201}}]},
+    )
+    for index in range(3):
+        await spool.append('unittest', {'geid': f'geid_{index}'})
+    spool._roll()
+    await spool.append('unittest', {'geid': 'flushes_the_roll'})
+
+    await spool.replay()
+
+    first_chunk = httpx_mock.get_requests()[0].content.decode().splitlines()
+    assert json.loads(first_chunk[0]) == {'index': {'_index': 'unittest', '_type': 'operation_logs', '_id': 'geid_0'}}
+    assert len(segment_files(tmp_path)) == 1
+    assert spool.stats()['replayed'] == 3
+
+
+async def test_replay_should_keep_segment_when_elastic_search_rejects_documents(spool, tmp_path, httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url=BULK_URL,
+        json={'errors': True, 'items': [{'index': {'status': 429, 'error': {'type': 'rejected'}}}]},
+    )
+    await spool.append('unittest', {'geid': 'first'})
+    spool._roll()
+    await spool.append('unittest', {'geid': 'second'})
+
+    with pytest.raises(SpoolReplayError):
+        await spool.replay()
+
+    assert len(segment_files(tmp_path)) == 2
+
+
+async def test_open_should_pick_up_segments_left_by_previous_worker(tmp_path, httpx_mock):
+    slot_dir = tmp_path / 'slot-0'
+    slot_dir.mkdir()
+    (slot_dir / f'{7:020d}.log').write_text(json.dumps({'index': 'unittest', 'document': {'geid': 'left'}}) + '\n')
+    httpx_mock.add_response(method='POST', url=BULK_URL, json={'errors': False, 'items': [{'index': {'status': 201}}]})
+    spool = AuditLogSpool(str(tmp_path), 1024, 0, 60, 500)
+
+    spool.open()
+    await spool.replay()
+    await spool.stop()
+
+    assert json.loads(httpx_mock.get_request().content.decode().splitlines()[1]) == {'geid': 'left'}
+    assert segment_files(tmp_path) == []
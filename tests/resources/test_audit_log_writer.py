@@ -0,0 +1,146 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.resources.audit_log_writer import AuditLogWriter
+
+BULK_URL = 'http://elastic_search:123/_bulk'
+
+
+def bulk_response(count):
+    return {'errors': False, 'items': [{'index': {'status': 201, 'result': 'created'}}] * count}
+
+
+async def test_writer_should_flush_when_batch_size_is_reached(httpx_mock):
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(2))
+    writer = AuditLogWriter(max_queue_size=10, flush_size=2, flush_interval=60)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    writer.enqueue('unittest', {'geid': 'second'})
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    lines = httpx_mock.get_request().content.decode().splitlines()
+    assert [json.loads(line)['geid'] for line in lines[1::2]] == ['first', 'second']
+    assert writer.stats()['flushed'] == 2
+    await writer.stop()
+
+
+async def test_writer_should_flush_after_interval(httpx_mock):
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(1))
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=0.01)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    await asyncio.sleep(0.05)
+
+    assert httpx_mock.get_request() is not None
+    assert writer.stats()['flushes'] == 1
+    await writer.stop()
+
+
+async def test_writer_should_drain_queue_on_stop(httpx_mock):
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(3))
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=60)
+
+    for index in range(3):
+        writer.enqueue('unittest', {'geid': index})
+    await writer.stop()
+
+    assert writer.stats()['flushed'] == 3
+    assert writer.stats()['queue_depth'] == 0
+
+
+async def test_writer_should_reject_documents_when_queue_is_full(httpx_mock):
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(1))
+    writer = AuditLogWriter(max_queue_size=1, flush_size=500, flush_interval=60)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    with pytest.raises(asyncio.QueueFull):
+        writer.enqueue('unittest', {'geid': 'second'})
+    await writer.stop()
+
+
+async def test_writer_should_drop_documents_rejected_for_good(httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url=BULK_URL,
+        json={'errors': True, 'items': [{'index': {'status': 400, 'error': {'type': 'mapper_parsing_exception'}}}]},
+    )
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=60, retry_backoff=0)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    await writer.stop()
+
+    assert len(httpx_mock.get_requests()) == 1
+    assert writer.stats()['failed'] == 1
+
+
+async def test_writer_should_retry_documents_when_bulk_request_fails(httpx_mock):
+    httpx_mock.add_exception(httpx.ConnectError('elastic search is down'), method='POST', url=BULK_URL)
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(2))
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=60, retry_backoff=0)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    writer.enqueue('unittest', {'geid': 'second'})
+    await writer.stop()
+
+    first_attempt, second_attempt = httpx_mock.get_requests()
+    assert second_attempt.content == first_attempt.content
+    assert json.loads(second_attempt.content.decode().splitlines()[0])['index']['_id'] == 'first'
+    assert writer.stats()['flushed'] == 2
+    assert writer.stats()['retried'] == 2
+    assert writer.stats()['failed'] == 0
+
+
+async def test_writer_should_retry_only_documents_failing_with_retryable_status(httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url=BULK_URL,
+        json={
+            'errors': True,
+            'items': [
+                {'index': {'status': 201, 'result': 'created'}},
+                {'index': {'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}},
+            ],
+        },
+    )
+    httpx_mock.add_response(method='POST', url=BULK_URL, json=bulk_response(1))
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=60, retry_backoff=0)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    writer.enqueue('unittest', {'geid': 'second'})
+    await writer.stop()
+
+    lines = httpx_mock.get_requests()[1].content.decode().splitlines()
+    assert [json.loads(line)['geid'] for line in lines[1::2]] == ['second']
+    assert writer.stats()['flushed'] == 2
+
+
+async def test_writer_should_drop_documents_after_last_retry(httpx_mock):
+    for _ in range(3):
+        httpx_mock.add_response(method='POST', url=BULK_URL, status_code=503, json={'error': 'unavailable'})
+    writer = AuditLogWriter(max_queue_size=10, flush_size=500, flush_interval=60, max_retries=2, retry_backoff=0)
+
+    writer.enqueue('unittest', {'geid': 'first'})
+    await writer.stop()
+
+    assert len(httpx_mock.get_requests()) == 3
+    assert writer.stats()['failed'] == 1
+    assert writer.stats()['flushed'] == 0
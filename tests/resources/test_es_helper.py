@@ -0,0 +1,111 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from app.config import ConfigClass
+from app.resources.es_helper import bulk
+from app.resources.es_helper import file_search
+from app.resources.es_helper import insert_one
+from app.resources.es_helper import query_fingerprint
+from app.resources.es_helper import query_shape
+
+SEARCH_RESPONSE = {
+    'took': 12,
+    'timed_out': False,
+    '_shards': {'total': 5, 'successful': 5, 'skipped': 1, 'failed': 0},
+    'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []},
+}
+
+
+def test_query_shape_should_strip_values_and_keep_structure():
+    query = {'bool': {'filter': [{'terms': {'action': ['a', 'b', 'c']}}, {'term': {'zone': 'gr'}}]}, 'size': 10}
+
+    assert query_shape(query) == {
+        'bool': {'filter': [{'terms': {'action': ['?']}}, {'term': {'zone': '?'}}]},
+        'size': '?',
+    }
+
+
+def test_query_fingerprint_should_ignore_values_but_not_fields():
+    first = {'query': {'terms': {'action': ['a']}}, 'from': 0}
+    second = {'from': 20, 'query': {'terms': {'action': ['b', 'c']}}}
+    other_field = {'query': {'terms': {'operator': ['a']}}, 'from': 0}
+
+    assert query_fingerprint(first) == query_fingerprint(second)
+    assert query_fingerprint(first) != query_fingerprint(other_field)
+
+
+async def test_file_search_should_log_elastic_search_stats(httpx_mock, caplog):
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/files/_search', json=SEARCH_RESPONSE)
+
+    with caplog.at_level(logging.INFO, logger='es_helper'):
+        await file_search('files', 0, 10, {'match_all': {}}, 'time_created', 'desc')
+
+    record = next(record for record in caplog.records if record.getMessage().startswith('file_search took'))
+    assert record.es_took_ms == 12
+    assert record.es_timed_out is False
+    assert record.es_shards_total == 5
+    assert record.es_shards_skipped == 1
+    assert record.es_client_ms >= 0
+    assert record.es_query_fingerprint == query_fingerprint(
+        {'query': {'match_all': {}}, 'sort': [{'time_created': 'desc'}], 'track_scores': False, 'size': 10, 'from': 0}
+    )
+    assert not [record for record in caplog.records if record.levelno == logging.WARNING]
+
+
+async def test_file_search_should_log_slow_query_with_its_shape(httpx_mock, caplog, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'ELASTIC_SEARCH_SLOW_QUERY_THRESHOLD_MS', 0.0)
+    httpx_mock.add_response(
+        method='GET', url='http://elastic_search:123/files/_search', json=dict(SEARCH_RESPONSE, timed_out=True)
+    )
+
+    await file_search('files', 0, 10, {'term': {'zone': 'gr'}}, 'time_created', 'desc')
+
+    warnings = [record for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert warnings[0].getMessage().startswith('slow file_search')
+    assert '"term":{"zone":"?"}' in warnings[0].es_query_shape
+
+
+async def test_bulk_should_log_elastic_search_stats(httpx_mock, caplog):
+    httpx_mock.add_response(
+        method='POST', url='http://elastic_search:123/_bulk', json={'took': 7, 'errors': False, 'items': []}
+    )
+
+    with caplog.at_level(logging.INFO, logger='es_helper'):
+        await bulk([({'index': {'_index': 'unittest'}}, {'action': 'upload'})])
+
+    record = next(record for record in caplog.records if record.getMessage().startswith('bulk took'))
+    assert record.es_operation == 'bulk'
+    assert record.es_took_ms == 7
+    assert record.es_query_fingerprint is None
+
+
+async def test_insert_one_should_log_client_time_without_took(httpx_mock, caplog):
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/unittest/operation_logs',
+        json={'result': 'created', '_shards': {'total': 2, 'successful': 1, 'failed': 0}},
+    )
+
+    with caplog.at_level(logging.INFO, logger='es_helper'):
+        res = await insert_one('operation_logs', 'unittest', {'action': 'upload'})
+
+    record = next(record for record in caplog.records if record.getMessage().startswith('insert_one took'))
+    assert res['result'] == 'created'
+    assert record.getMessage().endswith('ms on the client')
+    assert record.es_took_ms is None
+    assert record.es_shards_successful == 1
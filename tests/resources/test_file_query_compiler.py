@@ -0,0 +1,139 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from app.resources.file_query_compiler import InvalidFileQuery
+from app.resources.file_query_compiler import compile_file_query
+from app.resources.file_query_compiler import compiled_query_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_compiled_query_cache():
+    compiled_query_cache.clear()
+
+
+def test_compile_should_translate_every_condition():
+    queries = {
+        'project_code': {'value': 'test_project', 'condition': 'equal'},
+        'file_name': {'value': 'scan', 'condition': 'contain'},
+        'time_created': {'value': [1646629200, 1646715600], 'condition': 'between'},
+        'file_size': {'value': [1024], 'condition': 'lte'},
+        'tags': {'value': ['raw', 'mri'], 'condition': 'contain'},
+        'attributes': {
+            'name': 'Manifest',
+            'attributes': [
+                {'attribute_name': 'site', 'type': 'text', 'condition': 'contain', 'value': 'toronto'},
+                {'attribute_name': 'modality', 'type': 'multiple_choice', 'condition': 'equal', 'value': ['T1']},
+            ],
+        },
+    }
+
+    query = compile_file_query(queries)
+
+    assert query['bool']['must'] == [
+        {'term': {'project_code': 'test_project'}},
+        {'wildcard': {'file_name': '*scan*'}},
+        {'range': {'time_created': {'gte': 1646629200, 'lte': 1646715600}}},
+        {'range': {'file_size': {'lte': 1024}}},
+        {'bool': {'should': [{'term': {'tags': 'raw'}}, {'term': {'tags': 'mri'}}]}},
+        {'nested': {'path': 'attributes', 'query': {'bool': {'must': [{'match': {'attributes.name': 'Manifest'}}]}}}},
+        {
+            'nested': {
+                'path': 'attributes',
+                'query': {
+                    'bool': {
+                        'must': [
+                            {'match': {'attributes.name': 'Manifest'}},
+                            {'match': {'attributes.attribute_name': 'site'}},
+                            {'wildcard': {'attributes.value': '*toronto*'}},
+                        ]
+                    }
+                },
+            }
+        },
+        {
+            'nested': {
+                'path': 'attributes',
+                'query': {
+                    'bool': {
+                        'must': [
+                            {'match': {'attributes.name': 'Manifest'}},
+                            {'match': {'attributes.attribute_name': 'modality'}},
+                            {'bool': {'must': [{'match': {'attributes.value': 'T1'}}]}},
+                        ]
+                    }
+                },
+            }
+        },
+    ]
+
+
+def test_compile_should_truncate_range_bounds_over_twenty_digits():
+    query = compile_file_query({'time_created': {'value': [164662920000000000000], 'condition': 'gte'}})
+
+    assert query['bool']['must'] == [{'range': {'time_created': {'gte': 1646629200000000000}}}]
+
+
+def test_same_shape_with_different_values_should_reuse_compiled_query():
+    compile_file_query({'zone': {'value': 'greenroom', 'condition': 'equal'}})
+    query = compile_file_query({'zone': {'value': 'core', 'condition': 'equal'}})
+
+    assert query['bool']['must'] == [{'term': {'zone': 'core'}}]
+    assert compiled_query_cache.info()['hits'] == 1
+    assert compiled_query_cache.info()['misses'] == 1
+
+
+@pytest.mark.parametrize(
+    'queries',
+    [
+        {'zone': {'value': 'greenroom'}},
+        {'time_created': {'value': [1, 2, 3], 'condition': 'between'}},
+        {'time_created': {'value': ['yesterday'], 'condition': 'gte'}},
+        {'tags': {'value': 'raw', 'condition': 'contain'}},
+        {'attributes': {'name': 'Manifest', 'attributes': [{'attribute_name': 'site', 'type': 'text'}]}},
+        [],
+    ],
+)
+def test_invalid_query_should_raise_invalid_file_query(queries):
+    with pytest.raises(InvalidFileQuery):
+        compile_file_query(queries)
+
+
+@pytest.mark.parametrize(
+    'warm,queries',
+    [
+        (
+            {'file_size': {'value': [1, 2], 'condition': 'gte'}},
+            {'file_size': {'value': '12', 'condition': 'gte'}},
+        ),
+        (
+            {'attributes': {'name': 'Manifest', 'attributes': []}},
+            {'attributes': {'name': {'match_all': {}}, 'attributes': []}},
+        ),
+        (
+            {'zone': {'value': 'greenroom', 'condition': 'equal'}},
+            {'zone': {'value': {'match_all': {}}, 'condition': 'equal'}},
+        ),
+    ],
+)
+def test_invalid_values_should_be_rejected_whatever_shapes_are_cached(warm, queries):
+    with pytest.raises(InvalidFileQuery):
+        compile_file_query(queries)
+
+    compile_file_query(warm)
+
+    with pytest.raises(InvalidFileQuery):
+        compile_file_query(queries)
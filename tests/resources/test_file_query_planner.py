@@ -0,0 +1,137 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from app.resources.file_query_planner import FileSearchMapping
+from app.resources.file_query_planner import plan_file_query
+
+MAPPING = {
+    'files': {
+        'mappings': {
+            'properties': {
+                'file_name': {'type': 'keyword', 'fields': {'wc': {'type': 'wildcard'}}},
+                'display_path': {'type': 'keyword', 'fields': {'grams': {'type': 'text', 'analyzer': 'path_ngram'}}},
+                'uploader': {'type': 'keyword', 'fields': {'grams': {'type': 'text', 'analyzer': 'lower_ngram'}}},
+                'location': {'type': 'keyword', 'fields': {'grams': {'type': 'text', 'analyzer': 'edge_ngram'}}},
+            }
+        }
+    }
+}
+
+SETTINGS = {
+    'files': {
+        'settings': {
+            'index': {
+                'analysis': {
+                    'analyzer': {
+                        'path_ngram': {'type': 'custom', 'tokenizer': 'trigram'},
+                        'lower_ngram': {'type': 'custom', 'tokenizer': 'trigram', 'filter': ['lowercase']},
+                        'edge_ngram': {'type': 'custom', 'tokenizer': 'two_to_five_grams'},
+                    },
+                    'tokenizer': {
+                        'trigram': {'type': 'ngram', 'min_gram': '3', 'max_gram': '3'},
+                        'two_to_five_grams': {'type': 'ngram', 'min_gram': '2', 'max_gram': '5'},
+                    },
+                }
+            }
+        }
+    }
+}
+
+
+def test_plan_should_move_clauses_into_filter_context():
+    query = {'bool': {'must': [{'term': {'zone': 'greenroom'}}, {'range': {'file_size': {'gte': 1}}}]}}
+
+    planned = plan_file_query(query, {})
+
+    assert planned == {'bool': {'filter': [{'term': {'zone': 'greenroom'}}, {'range': {'file_size': {'gte': 1}}}]}}
+    assert 'must' in query['bool']
+
+
+def test_plan_should_route_leading_wildcards_to_subfields():
+    subfields = {'file_name': ('wc', 'wildcard', 0), 'display_path': ('grams', 'ngram', 3)}
+    query = {
+        'bool': {
+            'must': [
+                {'wildcard': {'file_name': '*scan*'}},
+                {'wildcard': {'display_path': '*admin/raw*'}},
+                {'wildcard': {'display_path': '*.csv'}},
+                {'wildcard': {'uploader': '*adm*'}},
+                {'wildcard': {'file_name': 'scan*'}},
+            ]
+        }
+    }
+
+    planned = plan_file_query(query, subfields)
+
+    assert planned['bool']['filter'] == [
+        {'wildcard': {'file_name.wc': '*scan*'}},
+        {'match_phrase': {'display_path.grams': 'admin/raw'}},
+        {'wildcard': {'display_path': '*.csv'}},
+        {'wildcard': {'uploader': '*adm*'}},
+        {'wildcard': {'file_name': 'scan*'}},
+    ]
+
+
+def test_plan_should_keep_contain_searches_an_ngram_subfield_cannot_answer_exactly():
+    subfields = {'display_path': ('grams', 'ngram', 3)}
+    query = {
+        'bool': {
+            'must': [
+                {'wildcard': {'display_path': '*ad*'}},
+                {'wildcard': {'display_path': '*adm?n*'}},
+                {'wildcard': {'display_path': '*Admin*'}},
+            ]
+        }
+    }
+
+    planned = plan_file_query(query, subfields)
+
+    # shorter than a gram it would match nothing, and with a wildcard of its own it is no phrase; case is kept
+    assert planned['bool']['filter'] == [
+        {'wildcard': {'display_path': '*ad*'}},
+        {'wildcard': {'display_path': '*adm?n*'}},
+        {'match_phrase': {'display_path.grams': 'Admin'}},
+    ]
+
+
+async def test_mapping_should_only_detect_wildcard_subfields_by_default(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/files/_mapping', json=MAPPING)
+    mapping = FileSearchMapping('files')
+
+    subfields = await mapping.contain_subfields()
+    await mapping.contain_subfields()
+
+    assert subfields == {'file_name': ('wc', 'wildcard', 0)}
+    assert len(httpx_mock.get_requests()) == 1
+
+
+async def test_mapping_should_detect_ngram_subfields_with_case_sensitive_fixed_size_grams(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/files/_mapping', json=MAPPING)
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/files/_settings', json=SETTINGS)
+    mapping = FileSearchMapping('files', ngram_rewrite=True)
+
+    subfields = await mapping.contain_subfields()
+
+    # the lowercase filter would make the search case insensitive, and mixed gram sizes break phrase positions
+    assert subfields == {'file_name': ('wc', 'wildcard', 0), 'display_path': ('grams', 'ngram', 3)}
+
+
+async def test_mapping_failure_should_disable_rewrites_until_retry(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/files/_mapping', status_code=500)
+    mapping = FileSearchMapping('files', retry_interval=60)
+
+    assert await mapping.contain_subfields() == {}
+    assert await mapping.contain_subfields() == {}
+    assert len(httpx_mock.get_requests()) == 1
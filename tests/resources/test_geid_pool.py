@@ -0,0 +1,50 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from app.resources.geid_pool import GEIDPool
+
+
+async def test_take_should_return_unique_ids():
+    pool = GEIDPool(block_size=10, low_water_mark=2)
+
+    ids = await pool.take(25)
+
+    assert len(set(ids)) == 25
+    await pool.stop()
+
+
+async def test_get_should_serve_from_pre_generated_block(mocker):
+    pool = GEIDPool(block_size=10, low_water_mark=2)
+    generate = mocker.spy(pool._client, 'get_GEID_bulk')
+
+    first = await pool.get()
+    second = await pool.get()
+
+    assert first != second
+    assert generate.call_count == 1
+    assert pool.available == 9
+    await pool.stop()
+
+
+async def test_pool_should_refill_in_background_below_low_water_mark():
+    pool = GEIDPool(block_size=10, low_water_mark=12)
+
+    await pool.take(6)
+    await asyncio.sleep(0.05)
+
+    assert pool.available == 20
+    await pool.stop()
@@ -0,0 +1,67 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from app.resources.health_check import HealthMonitor
+
+
+async def test_monitor_should_record_results_of_every_check():
+    async def healthy():
+        pass
+
+    async def failing():
+        raise Exception('connection refused')
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    monitor = HealthMonitor({'a': healthy, 'b': failing, 'c': slow}, interval=10, timeout=0.01, max_age=30)
+
+    results = await monitor.check()
+
+    assert results['a']['healthy'] is True
+    assert results['b'] == {**results['b'], 'healthy': False, 'error': 'connection refused'}
+    assert results['c']['error'] == 'timed out after 0.01s'
+    assert results['c']['latency'] < 1
+
+
+async def test_monitor_should_serve_cached_results_until_max_age():
+    calls = []
+
+    async def check():
+        calls.append(1)
+
+    monitor = HealthMonitor({'a': check}, interval=10, timeout=1, max_age=30)
+
+    await asyncio.gather(monitor.current(), monitor.current())
+    await monitor.current()
+
+    assert len(calls) == 1
+
+
+async def test_monitor_should_poll_in_background():
+    calls = []
+
+    async def check():
+        calls.append(1)
+
+    monitor = HealthMonitor({'a': check}, interval=0.001, timeout=1, max_age=30)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert len(calls) > 1
+    assert monitor.results['a']['healthy'] is True
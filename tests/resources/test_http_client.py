@@ -0,0 +1,54 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from app.resources.http_client import SharedHTTPClient
+from app.resources.http_client import atlas_client
+from app.resources.http_client import close_http_clients
+from app.resources.http_client import es_client
+
+
+async def test_es_client_should_be_reused_between_calls():
+    assert es_client.get() is es_client.get()
+
+
+async def test_es_client_should_use_pool_limits_from_settings(mocker):
+    mocker.patch('app.config.ConfigClass.ELASTIC_SEARCH_MAX_CONNECTIONS', 7)
+    await es_client.close()
+
+    client = es_client.get()
+
+    assert client._transport._pool._max_connections == 7
+
+
+async def test_closed_client_should_be_rebuilt_on_next_use():
+    client = es_client.get()
+    await close_http_clients()
+
+    assert client.is_closed
+    assert es_client.get() is not client
+
+
+async def test_shared_client_should_register_itself():
+    shared_client = SharedHTTPClient('test', lambda: None)
+
+    assert shared_client in SharedHTTPClient._registry
+    SharedHTTPClient._registry.remove(shared_client)
+
+
+async def test_atlas_client_should_authenticate_as_atlas_admin():
+    client = atlas_client.get()
+
+    assert client.auth is not None
+    assert client is atlas_client.get()
@@ -0,0 +1,118 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import httpx
+import pytest
+
+from app.resources.http_client import ES_OPERATIONS
+from app.resources.http_client import InstrumentedTransport
+from app.resources.metrics import Metrics
+from app.resources.metrics import metrics
+from app.resources.ttl_cache import TTLCache
+
+
+def test_render_should_expose_cumulative_histogram_buckets():
+    registry = Metrics(buckets=(0.1, 1.0))
+    registry.observe('audit_trail_http_request_duration_seconds', {'route': '/', 'method': 'GET'}, 0.05)
+    registry.observe('audit_trail_http_request_duration_seconds', {'route': '/', 'method': 'GET'}, 0.5)
+    registry.observe('audit_trail_http_request_duration_seconds', {'route': '/', 'method': 'GET'}, 5)
+
+    lines = registry.render().splitlines()
+
+    assert '# TYPE audit_trail_http_request_duration_seconds histogram' in lines
+    assert 'audit_trail_http_request_duration_seconds_bucket{method="GET",route="/",le="0.1"} 1' in lines
+    assert 'audit_trail_http_request_duration_seconds_bucket{method="GET",route="/",le="1.0"} 2' in lines
+    assert 'audit_trail_http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"} 3' in lines
+    assert 'audit_trail_http_request_duration_seconds_sum{method="GET",route="/"} 5.55' in lines
+    assert 'audit_trail_http_request_duration_seconds_count{method="GET",route="/"} 3' in lines
+
+
+def test_render_should_escape_label_values():
+    registry = Metrics()
+    registry.add('audit_trail_http_requests_in_flight', {'route': 'a"b\\c'}, 1)
+
+    assert 'audit_trail_http_requests_in_flight{route="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_render_should_merge_snapshots_of_all_workers(tmp_path):
+    registry = Metrics(multiproc_dir=str(tmp_path), buckets=(0.1,))
+    registry.observe('audit_trail_downstream_request_duration_seconds', {'downstream': 'atlas'}, 0.05)
+    registry.add('audit_trail_downstream_requests_in_flight', {'downstream': 'atlas'}, 2)
+    dead_worker = {
+        'pid': 2**22 + 1,
+        'histograms': [['audit_trail_downstream_request_duration_seconds', [['downstream', 'atlas']], [0, 1], 0.5, 1]],
+        'gauges': [['audit_trail_downstream_requests_in_flight', [['downstream', 'atlas']], 5]],
+    }
+    (tmp_path / 'dead.json').write_text(json.dumps(dead_worker))
+
+    lines = registry.render().splitlines()
+
+    assert 'audit_trail_downstream_request_duration_seconds_count{downstream="atlas"} 2' in lines
+    assert 'audit_trail_downstream_request_duration_seconds_bucket{downstream="atlas",le="0.1"} 1' in lines
+    assert 'audit_trail_downstream_requests_in_flight{downstream="atlas"} 2' in lines
+
+
+def test_collectors_should_add_gauges_to_snapshot():
+    registry = Metrics()
+    registry.register_collector(lambda: [('audit_trail_http_pool_max_connections', {'downstream': 'atlas'}, 50)])
+
+    assert 'audit_trail_http_pool_max_connections{downstream="atlas"} 50' in registry.render()
+
+
+def test_register_cache_should_report_cache_info():
+    registry = Metrics()
+    cache = TTLCache(maxsize=10, ttl=60)
+    registry.register_cache('guid', cache.info)
+    cache.set('key', 'value')
+    cache.get('key')
+    cache.get('other')
+
+    lines = registry.render().splitlines()
+
+    assert '# TYPE audit_trail_cache_hits_total counter' in lines
+    assert 'audit_trail_cache_hits_total{cache="guid"} 1' in lines
+    assert 'audit_trail_cache_misses_total{cache="guid"} 1' in lines
+    assert 'audit_trail_cache_entries{cache="guid"} 1' in lines
+    assert 'audit_trail_cache_max_entries{cache="guid"} 10' in lines
+
+
+@pytest.mark.parametrize(
+    'method,path,operation',
+    [
+        ('POST', '/files/_update/geid', 'update'),
+        ('POST', '/files/_search', 'search'),
+        ('GET', '/files/_settings', 'settings'),
+        ('POST', '/_nodes', 'other'),
+        ('POST', '/audit-logs/operation_logs', 'index'),
+        ('PUT', '/files/doc/geid', 'index'),
+        ('GET', '/files/doc/geid', 'other'),
+    ],
+)
+async def test_instrumented_transport_should_record_downstream_latency_by_operation(method, path, operation):
+    transport = InstrumentedTransport(
+        'elasticsearch', httpx.MockTransport(lambda request: httpx.Response(201)), ES_OPERATIONS, 'index'
+    )
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.request(method, f'http://elastic_search:123{path}')
+
+    lines = metrics.render().splitlines()
+    assert (
+        'audit_trail_downstream_request_duration_seconds_count'
+        f'{{downstream="elasticsearch",operation="{operation}",status="201"}} 1'
+    ) in lines
+    assert 'audit_trail_downstream_requests_in_flight{downstream="elasticsearch"} 0' in lines
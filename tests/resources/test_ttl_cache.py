@@ -0,0 +1,75 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from app.resources.ttl_cache import MISSING
+from app.resources.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_should_expire_entries_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a') is MISSING
+    assert cache.info() == {'hits': 1, 'misses': 1, 'size': 0, 'maxsize': 2}
+
+
+def test_cache_should_evict_least_recently_used_entry():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_negative_entries_should_use_negative_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, negative_ttl=1, clock=clock)
+    cache.set_negative('a')
+
+    assert cache.get('a') is None
+    clock.now = 1
+    assert cache.get('a') is MISSING
+
+
+def test_negative_entries_should_not_be_stored_without_negative_ttl():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set_negative('a')
+
+    assert cache.get('a') is MISSING
+
+
+def test_invalidate_matching_should_drop_matching_keys():
+    cache = TTLCache(maxsize=3, ttl=10)
+    cache.set(('a', 'file_data'), 1)
+    cache.set(('a', 'nfs_file'), 2)
+    cache.set(('b', 'file_data'), 3)
+
+    assert cache.invalidate_matching(lambda key: key[0] == 'a') == 2
+    assert cache.get(('b', 'file_data')) == 3
@@ -0,0 +1,45 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+async def test_health_should_return_204_when_dependencies_are_healthy(test_async_client, httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://altas:123/api/atlas/admin/metrics', json={})
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/_cluster/health', json={})
+
+    response = await test_async_client.get('/v1/health')
+    ready = await test_async_client.get('/v1/health/ready')
+
+    assert response.status_code == 204
+    assert ready.status_code == 204
+    assert len(httpx_mock.get_requests()) == 2
+
+
+async def test_health_should_return_503_with_report_when_a_dependency_fails(test_async_client, httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://altas:123/api/atlas/admin/metrics', status_code=500)
+    httpx_mock.add_response(method='GET', url='http://elastic_search:123/_cluster/health', json={})
+
+    response = await test_async_client.get('/v1/health/ready')
+    report = response.json()
+
+    assert response.status_code == 503
+    assert report['atlas']['healthy'] is False
+    assert report['atlas']['error'] == 'Atlas admin metrics returned 500'
+    assert report['elasticsearch']['healthy'] is True
+
+
+async def test_liveness_should_not_check_dependencies(test_async_client):
+    response = await test_async_client.get('/v1/health/live')
+
+    assert response.status_code == 204
@@ -0,0 +1,38 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+async def test_metrics_should_expose_route_and_pool_metrics(test_async_client, httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/files/_update/fake_geid',
+        json={'result': 'updated'},
+    )
+    await test_async_client.get('/')
+    await test_async_client.put(
+        '/v1/entity/file', json={'global_entity_id': 'fake_geid', 'updated_fields': {'archived': True}}
+    )
+
+    response = await test_async_client.get('/v1/metrics')
+    lines = response.text.splitlines()
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert 'audit_trail_http_request_duration_seconds_count{method="GET",route="/",status="200"} 1' in lines
+    assert (
+        'audit_trail_http_request_duration_seconds_count{method="PUT",route="/v1/entity/file",status="200"} 1' in lines
+    )
+    assert 'audit_trail_http_requests_in_flight{method="GET",route="/v1/metrics"} 1' in lines
+    assert 'audit_trail_http_pool_max_connections{downstream="elasticsearch"} 100' in lines
@@ -13,6 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+
+import httpx
+
+from app.commons.atlas.lineage_cache import lineage_cache
+
 test_lineage_api = '/v1/lineage/'
 
 
@@ -224,3 +230,234 @@ async def test_create_lineage_with_not_found_entity_should_return_403(test_async
     )
     res = await test_async_client.post(test_lineage_api, json=payload)
     assert res.status_code == 404
+
+
+async def test_get_lineage_should_be_cached_until_lineage_is_created(test_async_client, httpx_mock, monkeypatch):
+    monkeypatch.setattr(lineage_cache, 'enabled', True)
+    lineage_url = (
+        'http://altas:123/api/atlas/v2/lineage/uniqueAttribute/type/file_data'
+        '?attr:global_entity_id=fake_output_id&depth=50&direction=INPUT'
+    )
+    guid_entity_map = {
+        'output_guid': {
+            'typeName': 'file_data',
+            'attributes': {'global_entity_id': 'fake_output_id', 'full_path': 'fake_output_id'},
+        }
+    }
+    httpx_mock.add_response(
+        method='GET', url=lineage_url, json={'baseEntityGuid': 'output_guid', 'guidEntityMap': guid_entity_map}
+    )
+    httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/fake_output_id/', json={'result': {}})
+    for _id in ('fake_input_id', 'fake_output_id'):
+        httpx_mock.add_response(
+            method='GET',
+            url=(
+                'http://altas:123/api/atlas/v2/search/attribute'
+                f'?attrName=global_entity_id&typeName=file_data&attrValuePrefix={_id}'
+            ),
+            json={'entities': [{'guid': f'{_id}_guid', 'attributes': {'global_entity_id': _id}}]},
+        )
+    httpx_mock.add_response(method='POST', url='http://altas:123/api/atlas/v2/entity/bulk', json={})
+    query = {'item_id': 'fake_output_id', 'direction': 'INPUT'}
+
+    await test_async_client.get(test_lineage_api, query_string=query)
+    res = await test_async_client.get(test_lineage_api, query_string=query)
+
+    assert res.status_code == 200
+    assert res.json()['result']['baseEntityGuid'] == 'output_guid'
+    assert len(httpx_mock.get_requests(url=lineage_url)) == 1
+
+    payload = {
+        'input_id': 'fake_input_id',
+        'output_id': 'fake_output_id',
+        'input_name': 'fake_input_name',
+        'output_name': 'fake_output_name',
+        'project_code': 'test_project',
+        'pipeline_name': 'test pipeline',
+        'description': 'unit test',
+    }
+    await test_async_client.post(test_lineage_api, json=payload)
+    await test_async_client.get(test_lineage_api, query_string=query)
+
+    assert len(httpx_mock.get_requests(url=lineage_url)) == 2
+
+
+async def test_create_lineage_batch_should_return_per_edge_results(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.LINEAGE_BATCH_CHUNK_SIZE', 1)
+    for _id in ('a', 'b', 'c', 'e'):
+        entities = [] if _id == 'e' else [{'guid': f'{_id}_guid', 'attributes': {'global_entity_id': _id}}]
+        httpx_mock.add_response(
+            method='GET',
+            url=(
+                'http://altas:123/api/atlas/v2/search/attribute'
+                f'?attrName=global_entity_id&typeName=file_data&attrValuePrefix={_id}'
+            ),
+            json={'entities': entities},
+        )
+    httpx_mock.add_response(
+        method='POST', url='http://altas:123/api/atlas/v2/entity/bulk', json={'guidAssignments': {'-1': 'process_1'}}
+    )
+    httpx_mock.add_response(
+        method='POST', url='http://altas:123/api/atlas/v2/entity/bulk', json={'errorCode': 'ATLAS-500'}, status_code=500
+    )
+    edge = {
+        'input_name': 'fake_input_name',
+        'output_name': 'fake_output_name',
+        'project_code': 'test_project',
+        'pipeline_name': 'test pipeline',
+        'description': 'unit test',
+    }
+    payload = [
+        {**edge, 'input_id': 'a', 'output_id': 'b'},
+        {**edge, 'input_id': 'a', 'output_id': 'c'},
+        {**edge, 'input_id': 'd', 'output_id': 'd'},
+        {**edge, 'input_id': 'e', 'output_id': 'b'},
+    ]
+
+    res = await test_async_client.post(f'{test_lineage_api}batch', json=payload)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert [result['status'] for result in response['result']] == [200, 500, 400, 404]
+    assert response['result'][0]['guid'] == 'process_1'
+    assert response['result'][3]['error'] == 'Not Found Entity: e'
+    assert response['error_msg'] == '3 of 4 lineages failed to create'
+
+    search_requests = [request for request in httpx_mock.get_requests() if request.method == 'GET']
+    assert len(search_requests) == 4
+    bulk_requests = [json.loads(request.content) for request in httpx_mock.get_requests() if request.method == 'POST']
+    assert [len(request['entities']) for request in bulk_requests] == [1, 1]
+    assert bulk_requests[0]['entities'][0]['attributes']['inputs'] == [{'guid': 'a_guid', 'typeName': 'file_data'}]
+
+
+async def test_create_lineage_batch_should_report_chunk_lost_in_transport(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.LINEAGE_BATCH_CHUNK_SIZE', 1)
+    invalidate = mocker.patch('app.routers.v1.api_lineage.lineage.lineage_cache_sync.invalidate')
+    for _id in ('a', 'b', 'c'):
+        httpx_mock.add_response(
+            method='GET',
+            url=(
+                'http://altas:123/api/atlas/v2/search/attribute'
+                f'?attrName=global_entity_id&typeName=file_data&attrValuePrefix={_id}'
+            ),
+            json={'entities': [{'guid': f'{_id}_guid', 'attributes': {'global_entity_id': _id}}]},
+        )
+    httpx_mock.add_exception(
+        httpx.ReadTimeout('timed out'), method='POST', url='http://altas:123/api/atlas/v2/entity/bulk'
+    )
+    httpx_mock.add_response(
+        method='POST', url='http://altas:123/api/atlas/v2/entity/bulk', json={'guidAssignments': {'-2': 'process_2'}}
+    )
+    edge = {
+        'input_name': 'fake_input_name',
+        'output_name': 'fake_output_name',
+        'project_code': 'test_project',
+        'pipeline_name': 'test pipeline',
+        'description': 'unit test',
+    }
+    payload = [{**edge, 'input_id': 'a', 'output_id': 'b'}, {**edge, 'input_id': 'a', 'output_id': 'c'}]
+
+    res = await test_async_client.post(f'{test_lineage_api}batch', json=payload)
+    result = res.json()['result']
+
+    assert res.status_code == 200
+    assert [edge['status'] for edge in result] == [500, 200]
+    assert 'ReadTimeout' in result[0]['error']
+    assert result[1]['guid'] == 'process_2'
+    invalidate.assert_called_once_with({'a', 'c'})
+
+
+async def test_get_lineage_graph_should_return_nodes_and_edges(test_async_client, httpx_mock):
+    entity = {'guid': 'f0', 'typeName': 'file_data', 'attributes': {'global_entity_id': 'geid_0', 'name': 'f0'}}
+    httpx_mock.add_response(
+        method='GET',
+        url=(
+            'http://altas:123/api/atlas/v2/search/attribute'
+            '?attrName=global_entity_id&typeName=file_data&attrValuePrefix=geid_0'
+        ),
+        json={'entities': [entity]},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://altas:123/api/atlas/v2/lineage/f0?direction=OUTPUT&depth=1',
+        json={
+            'guidEntityMap': {'f0': entity, 'p1': {'guid': 'p1', 'typeName': 'Process', 'attributes': {'name': 'p1'}}},
+            'relations': [{'fromEntityId': 'f0', 'toEntityId': 'p1'}],
+        },
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/geid_0/',
+        json={'result': {'zone': 0, 'archived': False, 'parent_path': 'admin', 'name': 'f0.txt'}},
+    )
+
+    res = await test_async_client.get(
+        f'{test_lineage_api}graph', query_string={'item_id': 'geid_0', 'direction': 'OUTPUT', 'depth': 3}
+    )
+    result = res.json()['result']
+
+    assert res.status_code == 200
+    assert result['nodes'][0] == {
+        'guid': 'f0',
+        'global_entity_id': 'geid_0',
+        'name': 'f0',
+        'typeName': 'file_data',
+        'zone': ['Greenroom'],
+        'display_path': 'admin/f0.txt',
+    }
+    assert result['edges'] == [['f0', 'p1']]
+    assert result['depth'] == 1
+
+
+async def test_get_lineage_graph_of_unknown_entity_should_return_404(test_async_client, httpx_mock):
+    httpx_mock.add_response(
+        method='GET',
+        url=(
+            'http://altas:123/api/atlas/v2/search/attribute'
+            '?attrName=global_entity_id&typeName=file_data&attrValuePrefix=geid_0'
+        ),
+        json={'entities': []},
+    )
+
+    res = await test_async_client.get(f'{test_lineage_api}graph', query_string={'item_id': 'geid_0'})
+
+    assert res.status_code == 404
+
+
+async def test_get_lineage_graph_over_depth_limit_should_return_400(test_async_client):
+    res = await test_async_client.get(f'{test_lineage_api}graph', query_string={'item_id': 'geid_0', 'depth': 51})
+
+    assert res.status_code == 400
+
+
+async def test_get_lineage_graph_in_compact_format(test_async_client, httpx_mock):
+    entity = {'guid': 'f0', 'typeName': 'file_data', 'attributes': {'global_entity_id': 'geid_0', 'name': 'f0'}}
+    httpx_mock.add_response(
+        method='GET',
+        url=(
+            'http://altas:123/api/atlas/v2/search/attribute'
+            '?attrName=global_entity_id&typeName=file_data&attrValuePrefix=geid_0'
+        ),
+        json={'entities': [entity]},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://altas:123/api/atlas/v2/lineage/f0?direction=INPUT&depth=1',
+        json={
+            'guidEntityMap': {'f0': entity, 'p1': {'guid': 'p1', 'typeName': 'Process', 'attributes': {'name': 'p1'}}},
+            'relations': [{'fromEntityId': 'p1', 'toEntityId': 'f0'}],
+        },
+    )
+    httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/geid_0/', json={'result': {}})
+
+    res = await test_async_client.get(
+        f'{test_lineage_api}graph', query_string={'item_id': 'geid_0', 'direction': 'INPUT', 'format': 'compact'}
+    )
+    result = res.json()['result']
+
+    assert res.status_code == 200
+    assert result['format'] == 'compact'
+    assert result['strings'][:4] == ['f0', 'geid_0', 'file_data', 'p1']
+    assert result['nodes'] == [[0, 1, 0, 2, None, None], [3, None, 3, 4, None, None]]
+    assert result['edges'] == [[1, 0]]
+    assert result['base_entity'] == 0
@@ -13,6 +13,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from app.resources.audit_log_spool import audit_log_spool
+from app.resources.audit_log_writer import audit_log_writer
+from app.resources.cursor_pagination import decode_cursor
+from app.resources.cursor_pagination import encode_cursor
+
 audit_log_api = '/v1/audit-logs'
 
 
@@ -90,3 +101,419 @@ async def test_query_audit_log_should_return_200(test_async_client, httpx_mock):
     )
     res = await test_async_client.get(audit_log_api, query_string=params)
     assert res.status_code == 200
+
+
+async def test_create_audit_log_batch_should_return_per_item_status(test_async_client, httpx_mock):
+    payload = [
+        {
+            'operator': 'test_user',
+            'action': 'data_upload',
+            'target': f'file_{index}',
+            'outcome': 'string2',
+            'resource': 'unittest',
+            'display_name': 'string2',
+            'project_code': 'testproject',
+            'extra': {},
+        }
+        for index in range(2)
+    ]
+
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={
+            'took': 3,
+            'errors': True,
+            'items': [
+                {'index': {'_index': 'unittest', '_id': 'fake_id', 'status': 201, 'result': 'created'}},
+                {'index': {'_index': 'unittest', 'status': 429, 'error': {'type': 'es_rejected_execution_exception'}}},
+            ],
+        },
+        status_code=200,
+    )
+    res = await test_async_client.post(f'{audit_log_api}/batch', json=payload)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert response['total'] == 2
+    assert response['result'][0]['status'] == 201
+    assert response['result'][1]['error'] == {'type': 'es_rejected_execution_exception'}
+    assert response['error_msg'] == '1 of 2 audit logs failed to insert'
+
+    lines = httpx_mock.get_request().content.decode().splitlines()
+    assert len(lines) == 4
+    assert json.loads(lines[0]) == {'index': {'_index': 'unittest', '_type': 'operation_logs'}}
+    assert json.loads(lines[1])['target'] == 'file_0'
+
+
+async def test_create_audit_log_batch_with_empty_list_should_return_400(test_async_client):
+    res = await test_async_client.post(f'{audit_log_api}/batch', json=[])
+
+    assert res.status_code == 400
+
+
+async def test_create_audit_log_in_write_behind_mode_should_return_202(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.AUDIT_LOG_WRITE_BEHIND_ENABLED', True)
+    payload = {
+        'operator': 'test_user',
+        'action': 'testaction',
+        'target': 'string1',
+        'outcome': 'string2',
+        'resource': 'unittest',
+        'display_name': 'string2',
+        'project_code': 'testproject',
+        'extra': {},
+    }
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={'errors': False, 'items': [{'index': {'status': 201, 'result': 'created'}}]},
+        status_code=200,
+    )
+
+    res = await test_async_client.post(audit_log_api, json=payload)
+    await audit_log_writer.stop()
+
+    assert res.status_code == 202
+    assert res.json()['result']['result'] == 'queued'
+    assert json.loads(httpx_mock.get_request().content.decode().splitlines()[1])['target'] == 'string1'
+
+
+async def test_create_audit_log_with_full_queue_should_return_503(test_async_client, mocker):
+    mocker.patch('app.config.ConfigClass.AUDIT_LOG_WRITE_BEHIND_ENABLED', True)
+    mocker.patch('app.routers.v1.api_audit_log.audit_log_writer.enqueue', side_effect=asyncio.QueueFull)
+    payload = {
+        'operator': 'test_user',
+        'action': 'testaction',
+        'target': 'string1',
+        'outcome': 'string2',
+        'resource': 'unittest',
+        'display_name': 'string2',
+        'project_code': 'testproject',
+        'extra': {},
+    }
+
+    res = await test_async_client.post(audit_log_api, json=payload)
+
+    assert res.status_code == 503
+
+
+async def test_create_audit_log_in_spool_mode_should_return_202(test_async_client, mocker, tmp_path):
+    mocker.patch('app.config.ConfigClass.AUDIT_LOG_SPOOL_ENABLED', True)
+    mocker.patch('app.routers.v1.api_audit_log.audit_log_spool.directory', str(tmp_path))
+    payload = {
+        'operator': 'test_user',
+        'action': 'testaction',
+        'target': 'string1',
+        'outcome': 'string2',
+        'resource': 'unittest',
+        'display_name': 'string2',
+        'project_code': 'testproject',
+        'extra': {},
+    }
+
+    res = await test_async_client.post(audit_log_api, json=payload)
+
+    assert res.status_code == 202
+    assert res.json()['result']['result'] == 'spooled'
+    assert audit_log_spool.stats()['appended'] == 1
+
+
+async def test_query_audit_log_with_cursor_should_open_pit_and_return_next_cursor(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'page_size': 1, 'paginate_by_cursor': True}
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/unittest/_pit?keep_alive=5m',
+        json={'id': 'fake_pit'},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={
+            'pit_id': 'fake_pit_2',
+            'hits': {'hits': [{'_id': 'log', 'sort': [1646629200, 7]}], 'total': {'value': 20000}},
+        },
+    )
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert response['total'] == 20000
+    assert decode_cursor(response['next_cursor']) == ('fake_pit_2', [1646629200, 7])
+    search_body = json.loads(httpx_mock.get_requests()[1].content)
+    assert search_body['pit'] == {'id': 'fake_pit', 'keep_alive': '5m'}
+    assert 'from' not in search_body
+
+
+async def test_query_audit_log_last_cursor_page_should_close_pit(test_async_client, httpx_mock):
+    params = {
+        'project_code': 'testproject',
+        'resource': 'unittest',
+        'page_size': 10,
+        'cursor': encode_cursor('fake_pit', [1646629200, 7]),
+    }
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={'pit_id': 'fake_pit', 'hits': {'hits': [], 'total': {'value': 1}}},
+    )
+    httpx_mock.add_response(
+        method='DELETE', url='http://elastic_search:123/_pit', json={'succeeded': True, 'num_freed': 1}
+    )
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+
+    assert res.status_code == 200
+    assert res.json()['next_cursor'] is None
+    assert json.loads(httpx_mock.get_requests()[0].content)['search_after'] == [1646629200, 7]
+
+
+async def test_query_audit_log_with_invalid_cursor_should_return_400(test_async_client):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'cursor': 'not-a-cursor'}
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+
+    assert res.status_code == 400
+
+
+async def test_query_audit_log_with_expired_cursor_should_return_400(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'cursor': encode_cursor('fake_pit', [1, 7])}
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        status_code=404,
+        json={
+            'error': {
+                'root_cause': [{'type': 'search_context_missing_exception', 'reason': 'No search context found'}],
+                'type': 'search_phase_execution_exception',
+            },
+            'status': 404,
+        },
+    )
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+
+    assert res.status_code == 400
+    assert 'Cursor is no longer valid' in res.json()['error_msg']
+
+
+async def test_query_audit_log_first_cursor_page_error_should_close_pit(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'paginate_by_cursor': True, 'sort_by': 'unknown'}
+    httpx_mock.add_response(
+        method='POST', url='http://elastic_search:123/unittest/_pit?keep_alive=5m', json={'id': 'fake_pit'}
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        status_code=400,
+        json={
+            'error': {
+                'root_cause': [
+                    {'type': 'query_shard_exception', 'reason': 'No mapping found for [unknown] in order to sort on'}
+                ],
+                'type': 'search_phase_execution_exception',
+            },
+            'status': 400,
+        },
+    )
+    httpx_mock.add_response(method='DELETE', url='http://elastic_search:123/_pit', json={'succeeded': True})
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+
+    assert res.status_code == 500
+    assert 'Cursor' not in res.json()['error_msg']
+    assert json.loads(httpx_mock.get_requests()[-1].content) == {'id': 'fake_pit'}
+
+
+async def test_export_audit_logs_should_stream_every_page_as_ndjson(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.AUDIT_LOG_EXPORT_BATCH_SIZE', 1)
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'start_date': 1646629200, 'end_date': 1646715600}
+    httpx_mock.add_response(
+        method='POST', url='http://elastic_search:123/unittest/_pit?keep_alive=5m', json={'id': 'pit'}
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={'hits': {'hits': [{'_source': {'geid': 'first', 'extra_field': 1}, 'sort': [1]}], 'total': {'value': 2}}},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={'hits': {'hits': [{'_source': {'geid': 'second'}, 'sort': [2]}], 'total': {'value': 2}}},
+    )
+    httpx_mock.add_response(
+        method='GET', url='http://elastic_search:123/_search', json={'hits': {'hits': [], 'total': {'value': 2}}}
+    )
+    httpx_mock.add_response(method='DELETE', url='http://elastic_search:123/_pit', json={'succeeded': True})
+
+    res = await test_async_client.get(f'{audit_log_api}/export', query_string=params)
+
+    assert res.status_code == 200
+    assert res.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in res.text.splitlines()] == [
+        {'geid': 'first', 'extra_field': 1},
+        {'geid': 'second'},
+    ]
+    assert json.loads(httpx_mock.get_requests()[2].content)['search_after'] == [1]
+
+
+async def test_export_audit_logs_as_compressed_csv(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'export_format': 'csv', 'compress': True}
+    httpx_mock.add_response(
+        method='POST', url='http://elastic_search:123/unittest/_pit?keep_alive=5m', json={'id': 'pit'}
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={
+            'hits': {
+                'hits': [{'_source': {'geid': 'first', 'action': 'data_upload', 'extra_field': 1}, 'sort': [1]}],
+                'total': {'value': 1},
+            }
+        },
+    )
+    httpx_mock.add_response(method='DELETE', url='http://elastic_search:123/_pit', json={'succeeded': True})
+
+    res = await test_async_client.get(f'{audit_log_api}/export', query_string=params)
+
+    assert res.status_code == 200
+    assert res.headers['content-encoding'] == 'gzip'
+    lines = gzip.decompress(res.content).decode().splitlines()
+    assert lines[0].startswith('geid,createdTime,action')
+    assert lines[1] == 'first,,data_upload,,,,,,'
+
+
+async def test_export_audit_logs_of_missing_index_should_return_404(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'missing'}
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/missing/_pit?keep_alive=5m',
+        status_code=404,
+        json={'error': {'type': 'index_not_found_exception', 'reason': 'no such index [missing]'}, 'status': 404},
+    )
+
+    res = await test_async_client.get(f'{audit_log_api}/export', query_string=params)
+
+    assert res.status_code == 404
+    assert 'index_not_found_exception' in res.json()['error_msg']
+
+
+async def test_export_audit_logs_first_page_error_should_return_500_and_close_pit(test_async_client, httpx_mock):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'export_format': 'csv', 'sort_by': 'unknown'}
+    httpx_mock.add_response(
+        method='POST', url='http://elastic_search:123/unittest/_pit?keep_alive=5m', json={'id': 'pit'}
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        status_code=400,
+        json={'error': {'type': 'search_phase_execution_exception', 'reason': 'all shards failed'}, 'status': 400},
+    )
+    httpx_mock.add_response(method='DELETE', url='http://elastic_search:123/_pit', json={'succeeded': True})
+
+    res = await test_async_client.get(f'{audit_log_api}/export', query_string=params)
+
+    assert res.status_code == 500
+    assert res.headers['content-type'] == 'application/json'
+    assert json.loads(httpx_mock.get_requests()[-1].content) == {'id': 'pit'}
+
+
+async def test_audit_log_stats_should_return_flattened_bucket_counts(test_async_client, httpx_mock):
+    params = {
+        'project_code': 'testproject',
+        'resource': 'unittest',
+        'action': 'data_upload',
+        'interval': 'day',
+        'group_by': 'operator',
+    }
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/unittest/operation_logs/_search',
+        json={
+            'hits': {'total': {'value': 3}, 'hits': []},
+            'aggregations': {
+                'createdTime': {
+                    'buckets': [
+                        {
+                            'key_as_string': '2022-03-07',
+                            'key': 1646611200000,
+                            'doc_count': 3,
+                            'operator': {'buckets': [{'key': 'alice', 'doc_count': 2}, {'key': 'bob', 'doc_count': 1}]},
+                        }
+                    ]
+                }
+            },
+        },
+    )
+
+    res = await test_async_client.get(f'{audit_log_api}/stats', query_string=params)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert response['result'] == [
+        {'createdTime': '2022-03-07', 'operator': 'alice', 'count': 2},
+        {'createdTime': '2022-03-07', 'operator': 'bob', 'count': 1},
+    ]
+    search_body = json.loads(httpx_mock.get_request().content)
+    assert search_body['size'] == 0
+    histogram = search_body['aggs']['createdTime']['date_histogram']
+    assert histogram['calendar_interval'] == 'day'
+    assert 'field' not in histogram
+    assert histogram['script']['params'] == {'field': 'createdTime'}
+    assert '* 1000' in histogram['script']['source']
+    assert search_body['aggs']['createdTime']['aggs']['operator']['terms'] == {'field': 'operator', 'size': 100}
+
+
+async def test_audit_log_stats_without_grouping_should_return_400(test_async_client):
+    params = {'project_code': 'testproject', 'resource': 'unittest'}
+
+    res = await test_async_client.get(f'{audit_log_api}/stats', query_string=params)
+
+    assert res.status_code == 400
+
+
+@pytest.mark.parametrize('bucket_size', [0, 1001])
+async def test_audit_log_stats_with_bucket_size_out_of_bounds_should_return_400(test_async_client, bucket_size):
+    params = {'project_code': 'testproject', 'resource': 'unittest', 'group_by': 'operator', 'bucket_size': bucket_size}
+
+    res = await test_async_client.get(f'{audit_log_api}/stats', query_string=params)
+
+    assert res.status_code == 400
+    assert res.json()['error_msg'] == 'bucket_size must be between 1 and 1000'
+
+
+async def test_query_audit_log_with_projection_in_lean_mode_should_return_sources(test_async_client, httpx_mock):
+    params = {
+        'project_code': 'testproject',
+        'resource': 'unittest',
+        'fields': 'action,operator',
+        'exclude': 'extra_field',
+        'lean': True,
+    }
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/unittest/operation_logs/_search',
+        json={
+            'hits': {
+                'hits': [
+                    {
+                        '_index': 'unittest',
+                        '_type': 'operation_logs',
+                        '_id': 'log_id',
+                        '_score': None,
+                        '_source': {'action': 'data_upload', 'operator': 'alice'},
+                        'sort': [1646629200],
+                    }
+                ],
+                'total': {'value': 1},
+            }
+        },
+    )
+
+    res = await test_async_client.get(audit_log_api, query_string=params)
+
+    assert res.status_code == 200
+    assert res.json()['result'] == [{'_id': 'log_id', 'action': 'data_upload', 'operator': 'alice'}]
+    search_body = json.loads(httpx_mock.get_request().content)
+    assert search_body['_source'] == {'includes': ['action', 'operator'], 'excludes': ['extra_field']}
@@ -15,6 +15,13 @@
 
 import json
 
+import httpx
+
+from app.config import ConfigClass
+from app.resources.cursor_pagination import decode_cursor
+from app.resources.cursor_pagination import encode_cursor
+from app.routers.v1.api_file_meta import file_search_mapping
+
 test_file_entity_api = '/v1/entity/file'
 
 
@@ -144,3 +151,332 @@ async def test_update_file_meta_with_es_failed_should_return_500(test_async_clie
     response = res.json()
     assert res.status_code == 500
     assert response['result'] == 'Faied to Update Filemeta in elastic search'
+
+
+async def test_query_file_meta_with_cursor_should_search_after_previous_page(test_async_client, httpx_mock):
+    query = json.dumps({'project_code': {'value': 'test_project', 'condition': 'equal'}})
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_search',
+        json={
+            'pit_id': 'fake_pit',
+            'hits': {'total': {'value': 3, 'relation': 'eq'}, 'hits': [{'_id': 'file', 'sort': [1646629200, 3]}]},
+        },
+        status_code=200,
+    )
+    cursor = encode_cursor('fake_pit', [1646715600, 2])
+
+    res = await test_async_client.get(
+        test_file_entity_api, query_string={'query': query, 'page_size': 1, 'cursor': cursor}
+    )
+    response = res.json()
+
+    assert res.status_code == 200
+    assert decode_cursor(response['next_cursor']) == ('fake_pit', [1646629200, 3])
+    assert json.loads(httpx_mock.get_request().content)['search_after'] == [1646715600, 2]
+
+
+async def test_query_file_meta_with_invalid_query_should_return_400(test_async_client):
+    query = json.dumps({'project_code': {'value': 'test_project'}})
+
+    res = await test_async_client.get(test_file_entity_api, query_string={'query': query})
+
+    assert res.status_code == 400
+
+
+async def test_query_file_meta_should_search_in_filter_context(test_async_client, httpx_mock):
+    file_search_mapping.invalidate()
+    query = json.dumps(
+        {
+            'project_code': {'value': 'test_project', 'condition': 'equal'},
+            'file_name': {'value': 'scan', 'condition': 'contain'},
+        }
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/files/_mapping',
+        json={'files': {'mappings': {'properties': {'file_name': {'fields': {'wc': {'type': 'wildcard'}}}}}}},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/files/_search',
+        json={'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}},
+    )
+
+    res = await test_async_client.get(test_file_entity_api, query_string={'query': query})
+
+    assert res.status_code == 200
+    search_body = json.loads(httpx_mock.get_requests()[1].content)
+    assert search_body['query'] == {
+        'bool': {'filter': [{'term': {'project_code': 'test_project'}}, {'wildcard': {'file_name.wc': '*scan*'}}]}
+    }
+    assert search_body['track_scores'] is False
+
+
+async def test_query_file_meta_in_lean_mode_should_flatten_hits(test_async_client, httpx_mock):
+    query = json.dumps({'project_code': {'value': 'test_project', 'condition': 'equal'}})
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/files/_search',
+        json={
+            'hits': {
+                'total': {'value': 1, 'relation': 'eq'},
+                'hits': [{'_index': 'files', '_id': 'fake_id', '_score': None, '_source': {'file_name': 'a.txt'}}],
+            },
+        },
+    )
+
+    res = await test_async_client.get(
+        test_file_entity_api, query_string={'query': query, 'fields': 'file_name', 'lean': True}
+    )
+
+    assert res.status_code == 200
+    assert res.json()['result'] == [{'_id': 'fake_id', 'file_name': 'a.txt'}]
+    assert json.loads(httpx_mock.get_requests()[-1].content)['_source'] == {'includes': ['file_name']}
+
+
+async def test_query_file_meta_should_report_server_timing(test_async_client, httpx_mock, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'SERVER_TIMING_ENABLED', True)
+    monkeypatch.setattr(ConfigClass, 'FILE_QUERY_PLANNING_ENABLED', False)
+    query = json.dumps({'project_code': {'value': 'test_project', 'condition': 'equal'}})
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/files/_search',
+        json={'took': 7, 'timed_out': False, 'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}},
+    )
+
+    res = await test_async_client.get(test_file_entity_api, query_string={'query': query})
+
+    assert res.status_code == 200
+    timings = dict(entry.split(';dur=') for entry in res.headers['server-timing'].split(', '))
+    assert timings['es'] == '7.0'
+    assert set(timings) == {'dsl', 'es', 'es-client', 'es-encode'}
+
+
+async def test_query_file_meta_should_not_report_server_timing_by_default(test_async_client, httpx_mock, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'FILE_QUERY_PLANNING_ENABLED', False)
+    query = json.dumps({'project_code': {'value': 'test_project', 'condition': 'equal'}})
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/files/_search',
+        json={'took': 7, 'timed_out': False, 'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}},
+    )
+
+    res = await test_async_client.get(test_file_entity_api, query_string={'query': query})
+
+    assert res.status_code == 200
+    assert 'server-timing' not in res.headers
+
+
+def build_file_payload(global_entity_id):
+    return {
+        'global_entity_id': global_entity_id,
+        'operator': 'test_user',
+        'zone': 'gr',
+        'file_size': 1234,
+        'tags': ['teattag'],
+        'archived': False,
+        'location': 'http://minio',
+        'time_lastmodified': 1646715600,
+        'time_created': 1646629200,
+        'process_pipeline': 'fake_pipeline',
+        'uploader': 'test_user',
+        'file_name': f'{global_entity_id}_file',
+        'atlas_guid': 'fake_guid',
+        'display_path': f'test_user/{global_entity_id}_file',
+        'project_code': 'testproject',
+    }
+
+
+async def test_create_file_meta_batch_should_return_per_item_status(test_async_client, httpx_mock):
+    payload = [build_file_payload('geid_0'), build_file_payload('geid_1')]
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={
+            'took': 3,
+            'errors': True,
+            'items': [
+                {'create': {'_index': 'files', '_id': 'geid_0', 'status': 201, 'result': 'created'}},
+                {'create': {'_index': 'files', '_id': 'geid_1', 'status': 409, 'error': {'type': 'conflict'}}},
+            ],
+        },
+        status_code=200,
+    )
+
+    res = await test_async_client.post(f'{test_file_entity_api}/batch?op_type=create', json=payload)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert response['result'] == [
+        {'global_entity_id': 'geid_0', 'status': 201, 'result': 'created', 'error': None},
+        {'global_entity_id': 'geid_1', 'status': 409, 'result': None, 'error': {'type': 'conflict'}},
+    ]
+    assert response['error_msg'] == '1 of 2 file entities failed to index'
+
+    lines = httpx_mock.get_request().content.decode().splitlines()
+    assert json.loads(lines[0]) == {'create': {'_index': 'files', '_id': 'geid_0'}}
+    assert json.loads(lines[1])['file_name'] == 'geid_0_file'
+
+
+async def test_create_file_meta_batch_should_split_bulk_requests_by_size(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.ELASTIC_SEARCH_BULK_MAX_BYTES', 1024)
+    payload = [build_file_payload(f'geid_{index}') for index in range(3)]
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={'errors': False, 'items': [{'index': {'status': 201, 'result': 'created'}}] * 2},
+        status_code=200,
+    )
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={'error': {'type': 'es_rejected_execution_exception'}, 'status': 429},
+        status_code=429,
+    )
+
+    res = await test_async_client.post(f'{test_file_entity_api}/batch', json=payload)
+    response = res.json()
+
+    assert [len(request.content.decode().splitlines()) for request in httpx_mock.get_requests()] == [4, 2]
+    assert [result['status'] for result in response['result']] == [201, 201, 429]
+    assert response['result'][2]['error'] == {'type': 'es_rejected_execution_exception'}
+
+
+async def test_create_file_meta_batch_should_report_chunk_lost_in_transport(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.ELASTIC_SEARCH_BULK_MAX_BYTES', 1024)
+    payload = [build_file_payload(f'geid_{index}') for index in range(3)]
+    httpx_mock.add_exception(httpx.ReadTimeout('timed out'), method='POST', url='http://elastic_search:123/_bulk')
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={'errors': False, 'items': [{'index': {'status': 201, 'result': 'created'}}]},
+    )
+
+    res = await test_async_client.post(f'{test_file_entity_api}/batch', json=payload)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert [result['status'] for result in response['result']] == [500, 500, 201]
+    assert 'ReadTimeout' in response['result'][0]['error']
+    assert response['error_msg'] == '2 of 3 file entities failed to index'
+
+
+async def test_create_file_meta_batch_with_empty_list_should_return_400(test_async_client):
+    res = await test_async_client.post(f'{test_file_entity_api}/batch', json=[])
+
+    assert res.status_code == 400
+
+
+async def test_update_file_meta_batch_should_return_per_item_status(test_async_client, httpx_mock):
+    payload = [
+        {'global_entity_id': 'geid_0', 'updated_fields': {'archived': True, 'time_lastmodified': '1646715600'}},
+        {'global_entity_id': 'geid_1', 'updated_fields': {'archived': True}},
+        {'global_entity_id': 'geid_2', 'updated_fields': {'archived': True}},
+    ]
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/_bulk',
+        json={
+            'took': 3,
+            'errors': True,
+            'items': [
+                {'update': {'_id': 'geid_0', 'status': 200, 'result': 'updated'}},
+                {'update': {'_id': 'geid_1', 'status': 200, 'result': 'noop'}},
+                {'update': {'_id': 'geid_2', 'status': 404, 'error': {'type': 'document_missing_exception'}}},
+            ],
+        },
+        status_code=200,
+    )
+
+    res = await test_async_client.put(f'{test_file_entity_api}/batch', json=payload)
+    response = res.json()
+
+    assert res.status_code == 200
+    assert [result['result'] for result in response['result']] == ['updated', 'updated', None]
+    assert response['result'][2]['error'] == {'type': 'document_missing_exception'}
+    assert response['error_msg'] == '1 of 3 file entities failed to update'
+
+    lines = httpx_mock.get_request().content.decode().splitlines()
+    assert json.loads(lines[0]) == {'update': {'_index': 'files', '_id': 'geid_0', 'retry_on_conflict': 3}}
+    assert json.loads(lines[1]) == {'doc': {'archived': True, 'time_lastmodified': 1646715600}}
+
+
+async def test_update_file_meta_batch_with_empty_list_should_return_400(test_async_client):
+    res = await test_async_client.put(f'{test_file_entity_api}/batch', json=[])
+
+    assert res.status_code == 400
+
+
+async def test_update_file_meta_by_query_should_start_task(test_async_client, httpx_mock, mocker):
+    mocker.patch('app.config.ConfigClass.FILE_QUERY_PLANNING_ENABLED', False)
+    payload = {
+        'query': {'project_code': {'value': 'testproject', 'condition': 'equal'}},
+        'updated_fields': {'archived': True, 'time_lastmodified': '1646715600'},
+        'slices': 4,
+    }
+    httpx_mock.add_response(
+        method='POST',
+        url='http://elastic_search:123/files/_update_by_query?wait_for_completion=false&slices=4&conflicts=proceed',
+        json={'task': 'node_1:1234'},
+        status_code=200,
+    )
+
+    res = await test_async_client.post(f'{test_file_entity_api}/update-by-query', json=payload)
+
+    assert res.status_code == 202
+    assert res.json()['result'] == {'task_id': 'node_1:1234'}
+    body = json.loads(httpx_mock.get_request().content)
+    assert body['query'] == {'bool': {'must': [{'term': {'project_code': 'testproject'}}]}}
+    assert body['script']['params'] == {'fields': {'archived': True, 'time_lastmodified': 1646715600}}
+
+
+async def test_update_file_meta_by_query_with_empty_query_should_return_400(test_async_client):
+    payload = {'query': {}, 'updated_fields': {'archived': True}}
+
+    res = await test_async_client.post(f'{test_file_entity_api}/update-by-query', json=payload)
+
+    assert res.status_code == 400
+
+
+async def test_update_file_meta_by_query_with_empty_updated_fields_should_return_400(test_async_client):
+    payload = {'query': {'archived': {'value': False, 'condition': 'equal'}}, 'updated_fields': {}}
+
+    res = await test_async_client.post(f'{test_file_entity_api}/update-by-query', json=payload)
+
+    assert res.status_code == 400
+    assert res.json()['error_msg'] == 'Updated fields must not be empty'
+
+
+async def test_get_update_by_query_status_should_return_task_progress(test_async_client, httpx_mock):
+    status = {'total': 10, 'updated': 10, 'version_conflicts': 0}
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_tasks/node_1:1234',
+        json={'completed': True, 'task': {'status': status}, 'response': {'failures': []}},
+        status_code=200,
+    )
+
+    res = await test_async_client.get(f'{test_file_entity_api}/update-by-query/node_1:1234')
+
+    assert res.status_code == 200
+    assert res.json()['result'] == {
+        'task_id': 'node_1:1234',
+        'completed': True,
+        'status': status,
+        'failures': [],
+        'error': None,
+    }
+
+
+async def test_get_update_by_query_status_of_unknown_task_should_return_404(test_async_client, httpx_mock):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://elastic_search:123/_tasks/node_1:1',
+        json={'error': {'type': 'resource_not_found_exception'}, 'status': 404},
+        status_code=404,
+    )
+
+    res = await test_async_client.get(f'{test_file_entity_api}/update-by-query/node_1:1')
+
+    assert res.status_code == 404